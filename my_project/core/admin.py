@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Baraja, Tarjeta, Programacion, Sesion, PerfilUsuario, Clase, Tarea, HistorialRespuesta
+from .models import Baraja, Tarjeta, Programacion, Sesion, PerfilUsuario, Clase, Tarea, HistorialRespuesta, ImportacionCSV, PendientesDiarios, HistorialDiario, MarcaProceso
 
 @admin.register(Baraja)
 class BarajaAdmin(admin.ModelAdmin):
@@ -15,12 +15,13 @@ class TarjetaAdmin(admin.ModelAdmin):
 
 @admin.register(Programacion)
 class ProgramacionAdmin(admin.ModelAdmin):
-    list_display = ('tarjeta', 'ease_factor', 'intervalo', 'proximo_estudio')
+    list_display = ('usuario', 'tarjeta', 'ease_factor', 'intervalo', 'proximo_estudio')
     list_filter = ('proximo_estudio',)
+    search_fields = ('usuario__username', 'tarjeta__anverso')
 
 @admin.register(Sesion)
 class SesionAdmin(admin.ModelAdmin):
-    list_display = ('usuario', 'baraja', 'fecha_inicio', 'duracion_minutos', 'tarjetas_estudiadas')
+    list_display = ('usuario', 'baraja', 'fecha_inicio', 'fecha_fin', 'duracion_minutos', 'tarjetas_estudiadas')
     list_filter = ('fecha_inicio', 'usuario')
 
 # Registro de Perfil de Usuario en el admin
@@ -51,4 +52,31 @@ class HistorialRespuestaAdmin(admin.ModelAdmin):
     list_display = ('usuario', 'tarjeta', 'calificacion', 'fecha_respuesta', 'tiempo_respuesta_segundos')  # Columnas
     list_filter = ('calificacion', 'fecha_respuesta', 'usuario')  # Filtros
     search_fields = ('usuario__username', 'tarjeta__anverso')  # Búsqueda
-    readonly_fields = ('fecha_respuesta',)  # Campo de solo lectura (no editable)
\ No newline at end of file
+    readonly_fields = ('fecha_respuesta',)  # Campo de solo lectura (no editable)
+
+# Registro de Importaciones CSV en el admin
+@admin.register(ImportacionCSV)
+class ImportacionCSVAdmin(admin.ModelAdmin):
+    list_display = ('usuario', 'baraja', 'estado', 'tarjetas_creadas', 'fecha_creacion')  # Columnas
+    list_filter = ('estado', 'fecha_creacion')  # Filtros
+    search_fields = ('usuario__username', 'baraja__titulo')  # Búsqueda
+    readonly_fields = ('fecha_creacion', 'fecha_actualizacion')  # Campos de solo lectura
+
+# Registro de Pendientes Diarios en el admin (resumen que se recalcula solo)
+@admin.register(PendientesDiarios)
+class PendientesDiariosAdmin(admin.ModelAdmin):
+    list_display = ('usuario', 'baraja', 'fecha', 'pendientes')  # Columnas
+    list_filter = ('fecha',)  # Filtros
+    search_fields = ('usuario__username', 'baraja__titulo')  # Búsqueda
+
+# Registro de Historial Diario en el admin (respuestas antiguas compactadas)
+@admin.register(HistorialDiario)
+class HistorialDiarioAdmin(admin.ModelAdmin):
+    list_display = ('usuario', 'tarjeta', 'fecha', 'respuestas', 'tiempo_total_segundos')  # Columnas
+    list_filter = ('fecha',)  # Filtros
+    search_fields = ('usuario__username', 'tarjeta__anverso')  # Búsqueda
+
+# Registro de Marca de Proceso en el admin (hasta dónde llegaron los procesos incrementales)
+@admin.register(MarcaProceso)
+class MarcaProcesoAdmin(admin.ModelAdmin):
+    list_display = ('nombre', 'fecha')  # Columnas
@@ -0,0 +1,80 @@
+"""
+Almacenamiento de medios direccionado por contenido.
+
+Las imágenes, audios y portadas se guardan con el hash SHA-256 de su
+contenido como nombre, dentro de la carpeta de su upload_to:
+
+    tarjetas/foto.jpg -> tarjetas/3f/3fa4...c2.jpg
+
+Un mismo archivo subido en muchas tarjetas o barajas se guarda una sola vez:
+si el contenido ya existe no se vuelve a escribir y las filas comparten el
+nombre. Por eso un archivo no se puede borrar junto con una tarjeta; lo borra
+medios.recolectar() cuando ya ninguna fila lo usa.
+"""
+import hashlib
+import os
+import time
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+# Bytes que se leen por vez al calcular el hash
+TAMANO_BLOQUE = 64 * 1024
+
+
+@deconstructible
+class AlmacenamientoPorContenido(FileSystemStorage):
+    """
+    FileSystemStorage que nombra cada archivo por el hash de su contenido.
+    """
+    def __init__(self, **kwargs):
+        # Dos subidas simultáneas del mismo contenido escriben los mismos bytes en el mismo nombre
+        kwargs.setdefault('allow_overwrite', True)
+        super().__init__(**kwargs)
+
+    def nombre_por_contenido(self, name, content):
+        """
+        Retorna: nombre del archivo según su contenido, en la carpeta y con la extensión de name.
+        """
+        sha = hashlib.sha256()
+        content.seek(0)
+        for bloque in content.chunks(TAMANO_BLOQUE):
+            sha.update(bloque if isinstance(bloque, bytes) else bloque.encode())
+        content.seek(0)
+
+        carpeta, nombre = os.path.split(name)
+        extension = os.path.splitext(nombre)[1].lower()
+        resumen = sha.hexdigest()
+        return os.path.join(carpeta, resumen[:2], resumen + extension)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+
+        name = self.nombre_por_contenido(name, content)
+        if self.exists(name):
+            # Contenido ya conocido: no se escribe. Se marca como recién usado para
+            # que la recolección no lo borre mientras se guarda la fila que lo usa
+            os.utime(self.path(name))
+            return name
+        return super().save(name, content, max_length=max_length)
+
+    def guardar_con_nombre(self, name, content):
+        """
+        Guarda content con el nombre name tal cual, reemplazando el archivo si
+        existe (los derivados se nombran por su original, no por su contenido).
+        Retorna: el nombre guardado
+        """
+        return super().save(name, content)
+
+    def antiguedad(self, name):
+        """
+        Retorna: segundos desde la última vez que se escribió o se volvió a subir el archivo.
+        """
+        return time.time() - os.path.getmtime(self.path(name))
+
+
+# Almacenamiento de los archivos de Tarjeta y Baraja (en MEDIA_ROOT, como antes)
+almacenamiento_medios = AlmacenamientoPorContenido()
@@ -9,5 +9,7 @@ class CoreConfig(AppConfig):
         """
         Importar las señales cuando la app esté lista.
         Esto asegura que los perfiles se creen automáticamente.
+        También registra las comprobaciones de configuración.
         """
-        import core.signals
\ No newline at end of file
+        import core.signals
+        import core.checks
\ No newline at end of file
@@ -0,0 +1,238 @@
+"""
+Banco de pruebas de rendimiento del flujo de estudio.
+
+poblar() llena una base de datos desechable con un conjunto sintético
+(usuarios, barajas, tarjetas, programaciones e historial de respuestas) y
+ejecutar_estudio() recorre el ciclo dashboard -> estudiar_baraja ->
+calificar_respuesta xN con el cliente de pruebas de Django, midiendo el
+tiempo y las consultas de cada petición. resumir() calcula peticiones por
+segundo, percentiles de latencia y consultas por petición para cada vista.
+
+Se usa desde el comando benchmark_estudio, que crea y borra la base de datos.
+"""
+import json
+import math
+import random
+import re
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from datetime import timedelta
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from .models import Baraja, HistorialRespuesta, PerfilUsuario, Programacion, Tarjeta
+from . import historial, pendientes
+
+# Filas por cada bulk_create al crear usuarios y barajas
+TAMANO_LOTE = 5000
+
+# Las respuestas sintéticas se reparten en este número de días hacia atrás
+DIAS_HISTORIAL = 180
+
+# Vistas medidas, en el orden del ciclo de estudio
+VISTAS = ['dashboard', 'estudiar_baraja', 'calificar_respuesta']
+
+# Lote inicial de tarjetas que estudiar_baraja incrusta en la página
+_LOTE_INICIAL = re.compile(r'<script id="lote-inicial" type="application/json">(.*?)</script>', re.S)
+
+
+def poblar(usuarios, barajas_por_usuario, tarjetas_por_baraja, respuestas, semilla=0):
+    """
+    Crea el conjunto de datos sintético. Tarjetas, programaciones e historial
+    se insertan con INSERT ... SELECT en PostgreSQL, porque crear millones de
+    objetos en Python tardaría más que el benchmark.
+
+    Retorna: dict con la cantidad de filas de cada tabla
+    """
+    hoy = timezone.localdate()
+    clave = make_password('benchmark')  # Un solo hash para todos los usuarios
+
+    User.objects.bulk_create(
+        (User(username=f'benchmark{i}', password=clave) for i in range(usuarios)),
+        batch_size=TAMANO_LOTE
+    )
+    usuario_ids = list(User.objects.filter(username__startswith='benchmark').values_list('id', flat=True))
+
+    # bulk_create no envía post_save, así que los perfiles se crean aquí
+    PerfilUsuario.objects.bulk_create(
+        (PerfilUsuario(usuario_id=uid, rol='estudiante') for uid in usuario_ids),
+        batch_size=TAMANO_LOTE
+    )
+    Baraja.objects.bulk_create(
+        (
+            Baraja(propietario_id=uid, titulo=f'Baraja {j + 1}', descripcion='Baraja sintética')
+            for uid in usuario_ids
+            for j in range(barajas_por_usuario)
+        ),
+        batch_size=TAMANO_LOTE
+    )
+
+    # Las respuestas antiguas van a sus particiones mensuales, no a la de por defecto
+    mes = (hoy - timedelta(days=DIAS_HISTORIAL)).replace(day=1)
+    while mes <= hoy:
+        historial.crear_particion(mes)
+        mes = (mes + timedelta(days=32)).replace(day=1)
+
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT setseed(%s)', [(semilla % 1000) / 1000])
+        cursor.execute(
+            """
+            INSERT INTO core_tarjeta (baraja_id, tipo, anverso, reverso, extra, etiquetas, fecha_creacion)
+            SELECT b.id, 'anverso_reverso', 'Pregunta ' || b.id || '-' || g, 'Respuesta ' || g, '',
+                   'tema' || (g %% 10) || ', nivel' || (g %% 3), now()
+            FROM core_baraja b CROSS JOIN generate_series(1, %s) AS g
+            """,
+            [tarjetas_por_baraja]
+        )
+        # Cada propietario ya repasó cada tarjeta, que queda entre 5 días atrasada y 10 adelante
+        cursor.execute(
+            """
+            INSERT INTO core_programacion
+                (usuario_id, tarjeta_id, ease_factor, intervalo, repeticiones, proximo_estudio,
+                 fecha_primer_repaso, fecha_ultimo_repaso)
+            SELECT usuario_id, tarjeta_id, ease_factor, intervalo, repeticiones, proximo_estudio,
+                   proximo_estudio - intervalo - %s, proximo_estudio - intervalo
+            FROM (
+                SELECT b.propietario_id AS usuario_id, t.id AS tarjeta_id, 1.3 + random() * 1.7 AS ease_factor,
+                       1 + floor(random() * 30)::int AS intervalo, floor(random() * 6)::int AS repeticiones,
+                       %s::date + (floor(random() * 16)::int - 5) AS proximo_estudio
+                FROM core_tarjeta t JOIN core_baraja b ON b.id = t.baraja_id
+            ) AS programadas
+            """,
+            [DIAS_HISTORIAL, hoy]
+        )
+        total_programaciones = Programacion.objects.count()
+        if respuestas and total_programaciones:
+            cursor.execute(
+                """
+                INSERT INTO core_historialrespuesta
+                    (usuario_id, tarjeta_id, calificacion, fecha_respuesta, tiempo_respuesta_segundos)
+                SELECT p.usuario_id, p.tarjeta_id, 1 + floor(random() * 4)::int,
+                       now() - random() * make_interval(days => %s), floor(random() * 30)::int
+                FROM core_programacion p CROSS JOIN generate_series(1, %s)
+                LIMIT %s
+                """,
+                [DIAS_HISTORIAL, math.ceil(respuestas / total_programaciones), respuestas]
+            )
+        # Estadísticas del planificador al día, como en una base de datos en uso
+        cursor.execute('ANALYZE')
+
+    pendientes.reconstruir_pendientes(hoy)
+
+    return {
+        'usuarios': len(usuario_ids),
+        'barajas': Baraja.objects.count(),
+        'tarjetas': Tarjeta.objects.count(),
+        'programaciones': total_programaciones,
+        'respuestas': HistorialRespuesta.objects.count(),
+    }
+
+
+def _medir(mediciones, vista, peticion, *args, **kwargs):
+    """
+    Ejecuta una petición y guarda (segundos, consultas, éxito) en mediciones[vista].
+    """
+    # Las consultas de todas las bases de datos (las vistas de lectura usan las réplicas)
+    with ExitStack() as pila:
+        consultas = [pila.enter_context(CaptureQueriesContext(conexion)) for conexion in connections.all()]
+        inicio = time.perf_counter()
+        respuesta = peticion(*args, **kwargs)
+        segundos = time.perf_counter() - inicio
+    mediciones[vista].append((segundos, sum(len(c) for c in consultas), respuesta.status_code < 400))
+    return respuesta
+
+
+def _sesion(cliente, baraja_id, calificaciones, rnd, mediciones):
+    """
+    Un ciclo de estudio: dashboard, página de estudio y calificaciones de sus tarjetas.
+    """
+    _medir(mediciones, 'dashboard', cliente.get, reverse('core:dashboard'))
+    pagina = _medir(mediciones, 'estudiar_baraja', cliente.get, reverse('core:estudiar_baraja', args=[baraja_id]))
+
+    lote = _LOTE_INICIAL.search(pagina.content.decode())
+    tarjetas = json.loads(lote.group(1)) if lote else []
+    for tarjeta in tarjetas[:calificaciones]:
+        _medir(
+            mediciones, 'calificar_respuesta', cliente.post,
+            reverse('core:calificar_respuesta', args=[tarjeta['id']]),
+            # Distribución aproximada de calificaciones reales
+            {'calificacion': rnd.choices([1, 2, 3, 4], weights=[15, 15, 55, 15])[0], 'tiempo': rnd.randint(1, 20)}
+        )
+
+
+def _trabajador(sesiones, calificaciones, semilla):
+    mediciones = {vista: [] for vista in VISTAS}
+    rnd = random.Random(semilla)
+    try:
+        for usuario_id, baraja_id in sesiones:
+            cliente = Client()
+            cliente.force_login(User.objects.get(pk=usuario_id))
+            _sesion(cliente, baraja_id, calificaciones, rnd, mediciones)
+    finally:
+        # Cada hilo tiene sus propias conexiones a las bases de datos
+        connections.close_all()
+    return mediciones
+
+
+def ejecutar_estudio(sesiones, calificaciones, concurrencia=1, semilla=0):
+    """
+    Ejecuta sesiones de estudio de usuarios y barajas al azar, repartidas en
+    concurrencia hilos.
+
+    Retorna: (mediciones por vista, segundos totales)
+    """
+    rnd = random.Random(semilla)
+    barajas = list(Baraja.objects.values_list('propietario_id', 'id'))
+    elegidas = [rnd.choice(barajas) for _ in range(sesiones)]
+    partes = [elegidas[i::concurrencia] for i in range(concurrencia)]
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrencia) as ejecutor:
+        resultados = list(ejecutor.map(
+            _trabajador, partes, [calificaciones] * concurrencia, [semilla + i for i in range(concurrencia)]
+        ))
+    segundos = time.perf_counter() - inicio
+
+    mediciones = {vista: [] for vista in VISTAS}
+    for resultado in resultados:
+        for vista, valores in resultado.items():
+            mediciones[vista].extend(valores)
+    return mediciones, segundos
+
+
+def _percentil(valores_ordenados, porcentaje):
+    """
+    Percentil por rango más cercano de una lista ya ordenada.
+    """
+    indice = max(math.ceil(porcentaje / 100 * len(valores_ordenados)) - 1, 0)
+    return valores_ordenados[indice]
+
+
+def resumir(mediciones, segundos):
+    """
+    Retorna: dict {vista: métricas} más una entrada 'total'
+    """
+    resumen = {}
+    for vista, valores in list(mediciones.items()) + [('total', [v for vs in mediciones.values() for v in vs])]:
+        if not valores:
+            continue
+        tiempos = sorted(v[0] * 1000 for v in valores)
+        consultas = [v[1] for v in valores]
+        resumen[vista] = {
+            'peticiones': len(valores),
+            'errores': sum(1 for v in valores if not v[2]),
+            'peticiones_por_segundo': round(len(valores) / segundos, 2),
+            'latencia_media_ms': round(statistics.fmean(tiempos), 2),
+            'latencia_p50_ms': round(_percentil(tiempos, 50), 2),
+            'latencia_p95_ms': round(_percentil(tiempos, 95), 2),
+            'latencia_p99_ms': round(_percentil(tiempos, 99), 2),
+            'consultas_media': round(statistics.fmean(consultas), 2),
+            'consultas_max': max(consultas),
+        }
+    return resumen
@@ -0,0 +1,64 @@
+"""
+Búsqueda de tarjetas con el motor de texto completo de PostgreSQL.
+
+Tarjeta.busqueda es un tsvector que PostgreSQL mantiene solo (columna
+generada) a partir del anverso (peso A), el reverso (peso B) y las etiquetas
+(peso C), con un índice GIN. Las búsquedas usan ese índice y se ordenan por
+relevancia, así que no recorren la tabla completa como icontains.
+"""
+import re
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import F
+from .etiquetas import filtrar_por_etiquetas
+from .models import CONFIGURACION_BUSQUEDA, Tarjeta
+
+# Resultados por página
+RESULTADOS_POR_PAGINA = 20
+
+
+def construir_consulta(texto):
+    """
+    Convierte el texto del usuario en una consulta tsquery donde cada palabra
+    también coincide como prefijo ("gat" encuentra "gato" y "gatos").
+    
+    Retorna: SearchQuery, o None si el texto no tiene palabras
+    """
+    palabras = re.findall(r'\w+', texto)
+    if not palabras:
+        return None
+    
+    # Las palabras solo tienen caracteres alfanuméricos, así que la consulta raw es segura
+    return SearchQuery(
+        ' & '.join(f'{palabra}:*' for palabra in palabras),
+        search_type='raw',
+        config=CONFIGURACION_BUSQUEDA
+    )
+
+
+def buscar_tarjetas(usuario, texto, etiquetas=None):
+    """
+    Busca en las tarjetas del usuario.
+    
+    Parámetros:
+    - texto: palabras a buscar (puede ser vacío si se filtra por etiquetas)
+    - etiquetas: lista de etiquetas normalizadas que deben tener todas las tarjetas
+    
+    Retorna: queryset ordenado por relevancia (vacío si no hay palabras ni etiquetas)
+    """
+    consulta = construir_consulta(texto)
+    if consulta is None and not etiquetas:
+        return Tarjeta.objects.none()
+    
+    tarjetas = filtrar_por_etiquetas(
+        Tarjeta.objects.filter(baraja__propietario=usuario).select_related('baraja'),
+        etiquetas
+    )
+    
+    if consulta is None:
+        return tarjetas.order_by('id')
+    
+    return tarjetas.filter(
+        busqueda=consulta  # Usa el índice GIN
+    ).annotate(
+        rango=SearchRank(F('busqueda'), consulta)
+    ).order_by('-rango', 'id')
@@ -0,0 +1,27 @@
+"""
+Comprobaciones de la configuración (python manage.py check --deploy).
+"""
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+# Backends de caché que guardan los datos en la memoria de cada proceso
+CACHES_POR_PROCESO = ('django.core.cache.backends.locmem.LocMemCache',)
+
+
+@register(Tags.caches, deploy=True)
+def revisar_cache_compartida(app_configs, **kwargs):
+    """
+    Los roles, las estadísticas, los pendientes, las rachas y la fijación a la
+    base de datos principal se invalidan en el proceso que hace el cambio: con
+    varios procesos, la caché tiene que ser compartida.
+    """
+    backend = settings.CACHES.get('default', {}).get('BACKEND')
+    if backend in CACHES_POR_PROCESO:
+        return [Error(
+            f"La caché 'default' ({backend}) es de cada proceso.",
+            hint='Configurar CACHES con una caché compartida (Redis o Memcached): si no, un '
+                 'rol quitado en un proceso sigue valiendo en los demás y un usuario que '
+                 'acaba de escribir puede leer de una réplica atrasada.',
+            id='core.E001',
+        )]
+    return []
@@ -1,10 +1,13 @@
 from django.shortcuts import redirect
 from django.contrib import messages
 from functools import wraps
+from .roles import obtener_rol
+from .replicas import elegir_replica, iterar_en_replica, usar_replica
 
 def rol_requerido(*roles_permitidos):
     """
     Decorador que verifica si el usuario tiene uno de los roles permitidos.
+    El rol se lee de la caché de roles (ver core.roles), no del perfil.
     
     Uso:
     @rol_requerido('docente', 'administrador')
@@ -18,14 +21,14 @@ def rol_requerido(*roles_permitidos):
             if not request.user.is_authenticated:
                 return redirect('admin:login')
             
+            rol_usuario = obtener_rol(request)
+            
             # Verificar que tenga perfil
-            if not hasattr(request.user, 'perfil'):
+            if rol_usuario is None:
                 messages.error(request, 'No tienes un perfil asignado. Contacta al administrador.')
                 return redirect('core:dashboard')
             
             # Verificar el rol
-            rol_usuario = request.user.perfil.rol
-            
             if rol_usuario not in roles_permitidos:
                 messages.error(
                     request, 
@@ -58,4 +61,31 @@ def docente_o_colaborador(view_func):
     """
     Decorador para vistas que pueden acceder docentes y colaboradores.
     """
-    return rol_requerido('docente', 'colaborador', 'administrador')(view_func)
\ No newline at end of file
+    return rol_requerido('docente', 'colaborador', 'administrador')(view_func)
+
+def lectura_en_replica(view_func):
+    """
+    Decorador para vistas de solo lectura: sus consultas van a una réplica de
+    la base de datos (ver core.replicas), salvo que el usuario haya escrito hace
+    poco. Las escrituras siguen yendo a 'default'. Solo para vistas síncronas.
+    
+    Uso:
+    @login_required
+    @lectura_en_replica
+    def mi_reporte(request):
+        ...
+    """
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        alias = elegir_replica(request)
+        if alias is None:
+            return view_func(request, *args, **kwargs)
+        
+        with usar_replica(alias):
+            response = view_func(request, *args, **kwargs)
+        # El contenido de una respuesta en streaming se genera después de la vista
+        if response.streaming:
+            response.streaming_content = iterar_en_replica(alias, response.streaming_content)
+        return response
+    
+    return wrapper
@@ -0,0 +1,180 @@
+"""
+Escritura del historial de respuestas en segundo plano.
+
+Las vistas de calificación async no esperan el INSERT del historial: dejan
+la respuesta en una cola en memoria y un hilo la guarda con bulk_create en
+lotes (cada HISTORIAL_ESCRITURA_TAMANO_LOTE respuestas o cada
+HISTORIAL_ESCRITURA_INTERVALO segundos). Después de cada lote se actualiza
+el progreso de las tareas, que se calcula a partir del historial, y las
+sesiones de estudio (core/sesiones.py).
+
+Es un hilo y no una tarea de asyncio para que funcione igual con ASGI y con
+WSGI (donde cada vista async corre en su propio bucle de eventos). Las
+respuestas pendientes se guardan al cerrar el proceso; si el proceso muere
+de golpe se pierden como mucho las de un intervalo.
+
+Una respuesta inválida no hace perder el lote: las de tarjetas borradas
+mientras esperaban en la cola se descartan antes del INSERT, y si el lote
+falla de todas formas (por ejemplo, un usuario borrado) se guarda de a una
+respuesta, perdiendo solo las que fallan.
+"""
+import atexit
+import logging
+import queue
+import threading
+from django.conf import settings
+from django.db import close_old_connections, connection
+from .models import HistorialRespuesta, Tarjeta
+from . import progreso, sesiones
+
+logger = logging.getLogger(__name__)
+
+# Respuestas que se insertan en cada bulk_create
+TAMANO_LOTE = getattr(settings, 'HISTORIAL_ESCRITURA_TAMANO_LOTE', 500)
+
+# Tiempo máximo (segundos) que una respuesta espera en la cola
+INTERVALO = getattr(settings, 'HISTORIAL_ESCRITURA_INTERVALO', 2)
+
+
+class EscritorHistorial:
+    """
+    Cola de HistorialRespuesta sin guardar y el hilo que las persiste.
+    """
+    def __init__(self, tamano_lote=TAMANO_LOTE, intervalo=INTERVALO):
+        self.tamano_lote = tamano_lote
+        self.intervalo = intervalo
+        self._cola = queue.SimpleQueue()
+        self._lote_lleno = threading.Event()
+        self._detenido = threading.Event()
+        self._hilo = None
+        self._candado_hilo = threading.Lock()
+        # Un solo lote se escribe a la vez (el hilo o vaciar())
+        self._candado_escritura = threading.Lock()
+
+    def agregar(self, respuesta):
+        """
+        Encola una HistorialRespuesta sin guardar. No bloquea ni consulta la base de datos.
+        """
+        self._cola.put(respuesta)
+        # Sin segundo plano (por ejemplo, en pruebas) la cola se guarda solo al llamar a vaciar()
+        if not getattr(settings, 'HISTORIAL_ESCRITURA_EN_SEGUNDO_PLANO', True):
+            return
+        if self._cola.qsize() >= self.tamano_lote:
+            self._lote_lleno.set()  # No esperar al intervalo
+        if self._hilo is None or not self._hilo.is_alive():
+            self._iniciar()
+
+    def _iniciar(self):
+        with self._candado_hilo:
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._ejecutar, name='escritor-historial', daemon=True)
+                self._hilo.start()
+
+    def _ejecutar(self):
+        try:
+            while not self._detenido.is_set():
+                self._lote_lleno.wait(self.intervalo)
+                self._lote_lleno.clear()
+                # Respetar CONN_MAX_AGE y descartar conexiones rotas, como al final de una petición
+                close_old_connections()
+                self.vaciar()
+        finally:
+            connection.close()
+
+    def _insertar(self, lote):
+        """
+        Inserta el lote en el historial.
+        Retorna: las respuestas guardadas
+        """
+        # Descartar las de tarjetas borradas mientras esperaban en la cola (una consulta)
+        existentes = set(
+            Tarjeta.objects.filter(id__in={respuesta.tarjeta_id for respuesta in lote}).values_list('id', flat=True)
+        )
+        validas = [respuesta for respuesta in lote if respuesta.tarjeta_id in existentes]
+        if len(validas) < len(lote):
+            logger.warning('Se descartaron %d respuestas de tarjetas borradas', len(lote) - len(validas))
+        if not validas:
+            return []
+
+        try:
+            HistorialRespuesta.objects.bulk_create(validas)
+            return validas
+        except Exception:
+            logger.exception('No se pudieron guardar %d respuestas del historial; se guardan de a una', len(validas))
+
+        guardadas = []
+        for respuesta in validas:
+            try:
+                HistorialRespuesta.objects.bulk_create([respuesta])
+            except Exception:
+                logger.exception(
+                    'No se pudo guardar la respuesta del usuario %s a la tarjeta %s',
+                    respuesta.usuario_id, respuesta.tarjeta_id
+                )
+            else:
+                guardadas.append(respuesta)
+        return guardadas
+
+    def _guardar(self, lote):
+        try:
+            lote = self._insertar(lote)
+        except Exception:
+            logger.exception('No se pudieron guardar %d respuestas del historial', len(lote))
+            return
+        if not lote:
+            return
+
+        # El historial ya está guardado: cada paso siguiente registra su propio error
+        try:
+            tarjetas_por_usuario = {}
+            for respuesta in lote:
+                tarjetas_por_usuario.setdefault(respuesta.usuario, set()).add(respuesta.tarjeta_id)
+            for usuario, tarjeta_ids in tarjetas_por_usuario.items():
+                progreso.registrar_respuestas(usuario, tarjeta_ids)
+        except Exception:
+            logger.exception('No se pudo actualizar el progreso de %d respuestas del historial', len(lote))
+
+        if sesiones.AL_CALIFICAR:
+            try:
+                sesiones.registrar_respuestas(
+                    [(respuesta.usuario_id, respuesta.tarjeta_id, respuesta.fecha_respuesta) for respuesta in lote]
+                )
+            except Exception:
+                logger.exception('No se pudieron agrupar en sesiones %d respuestas del historial', len(lote))
+
+    def vaciar(self):
+        """
+        Guarda todo lo que esté en la cola, en lotes, en el hilo actual.
+        """
+        with self._candado_escritura:
+            while True:
+                lote = []
+                try:
+                    while len(lote) < self.tamano_lote:
+                        lote.append(self._cola.get_nowait())
+                except queue.Empty:
+                    pass
+                if not lote:
+                    break
+                self._guardar(lote)
+
+
+    def detener(self):
+        """
+        Detiene el hilo (cerrando su conexión) y guarda lo que quede en la cola.
+        Una respuesta agregada después vuelve a iniciar el hilo.
+        """
+        hilo = self._hilo
+        if hilo is not None and hilo.is_alive():
+            self._detenido.set()
+            self._lote_lleno.set()
+            hilo.join()
+        self._detenido.clear()
+        self.vaciar()
+
+
+# Escritor compartido por todo el proceso
+escritor = EscritorHistorial()
+
+# Guardar lo pendiente cuando el proceso termina normalmente
+atexit.register(escritor.detener)
@@ -0,0 +1,153 @@
+"""
+Estadísticas del dashboard con caché por usuario.
+
+Cada contador se guarda en su propia clave de caché para poder incrementarlo
+de forma atómica (cache.incr) cuando el usuario califica tarjetas o importa
+un CSV. Las claves incluyen la fecha y expiran a la medianoche local, así que
+los contadores "de hoy" se reinician solos al cambiar de día.
+"""
+from datetime import datetime, time, timedelta
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.utils import timezone
+from .models import Baraja, HistorialRespuesta
+from .pendientes import obtener_pendientes_por_baraja
+from .replicas import usar_replica
+
+
+# Campos que se guardan en caché (uno por clave)
+CAMPOS_ESTADISTICAS = [
+    'total_barajas',
+    'total_tarjetas',
+    'tarjetas_pendientes',
+    'tarjetas_estudiadas_hoy',
+    'otra_vez',
+    'dificil',
+    'bien',
+    'facil',
+]
+
+# Nombre del contador para cada calificación (1-4)
+CAMPO_POR_CALIFICACION = {1: 'otra_vez', 2: 'dificil', 3: 'bien', 4: 'facil'}
+
+
+def _clave(usuario_id, hoy, campo):
+    return f'estadisticas:{usuario_id}:{hoy.isoformat()}:{campo}'
+
+
+def _segundos_hasta_medianoche():
+    """
+    Segundos que faltan para que termine el día local del usuario.
+    """
+    ahora = timezone.localtime()
+    manana = datetime.combine(ahora.date() + timedelta(days=1), time.min, tzinfo=ahora.tzinfo)
+    return max(int((manana - ahora).total_seconds()), 1)
+
+
+def calcular_estadisticas(usuario, hoy):
+    """
+    Calcula las estadísticas desde la base de datos con consultas agregadas.
+    """
+    # Barajas y tarjetas del usuario en una sola consulta
+    totales = Baraja.objects.filter(propietario=usuario).aggregate(
+        total_barajas=Count('id', distinct=True),
+        total_tarjetas=Count('tarjetas')
+    )
+    
+    # Tarjetas pendientes hoy, sumando el resumen diario por baraja
+    tarjetas_pendientes = sum(obtener_pendientes_por_baraja(usuario).values())
+    
+    # Respuestas de hoy y desglose por calificación en una sola consulta.
+    # Se filtra por rango de fechas (no por __date) para que pueda usarse un índice.
+    inicio_dia = timezone.make_aware(datetime.combine(hoy, time.min))
+    respuestas_hoy = HistorialRespuesta.objects.filter(
+        usuario=usuario,
+        fecha_respuesta__gte=inicio_dia,
+        fecha_respuesta__lt=inicio_dia + timedelta(days=1)
+    ).aggregate(
+        tarjetas_estudiadas_hoy=Count('id'),
+        **{
+            campo: Count('id', filter=Q(calificacion=calificacion))
+            for calificacion, campo in CAMPO_POR_CALIFICACION.items()
+        }
+    )
+    
+    return {
+        **totales,
+        'tarjetas_pendientes': tarjetas_pendientes,
+        **respuestas_hoy,
+    }
+
+
+def obtener_estadisticas(usuario):
+    """
+    Devuelve las estadísticas del dashboard, desde la caché si están disponibles.
+    """
+    hoy = timezone.localdate()
+    claves = {campo: _clave(usuario.id, hoy, campo) for campo in CAMPOS_ESTADISTICAS}
+    
+    guardadas = cache.get_many(claves.values())
+    if len(guardadas) == len(claves):
+        return {campo: guardadas[clave] for campo, clave in claves.items()}
+    
+    # Falta algún contador: recalcular todo y guardarlo hasta la medianoche.
+    # Desde 'default' aunque la vista lea de una réplica: la caché no puede quedar atrasada
+    with usar_replica(None):
+        estadisticas = calcular_estadisticas(usuario, hoy)
+    cache.set_many(
+        {claves[campo]: valor for campo, valor in estadisticas.items()},
+        timeout=_segundos_hasta_medianoche()
+    )
+    return estadisticas
+
+
+def _incrementar(usuario_id, cambios):
+    """
+    Aplica incrementos a los contadores en caché. Si un contador no existe, se
+    borran todos para que la próxima lectura los recalcule desde la base de datos.
+    """
+    hoy = timezone.localdate()
+    for campo, delta in cambios.items():
+        if not delta:
+            continue
+        try:
+            cache.incr(_clave(usuario_id, hoy, campo), delta)
+        except ValueError:
+            invalidar_estadisticas(usuario_id)
+            return
+
+
+def registrar_respuestas(usuario, calificaciones, pendientes_resueltas=0):
+    """
+    Actualiza la caché después de calificar tarjetas.
+    
+    Parámetros:
+    - calificaciones: lista de calificaciones (1-4) registradas
+    - pendientes_resueltas: cuántas de esas tarjetas estaban pendientes para hoy
+    """
+    cambios = {
+        'tarjetas_estudiadas_hoy': len(calificaciones),
+        'tarjetas_pendientes': -pendientes_resueltas,
+    }
+    for calificacion in calificaciones:
+        campo = CAMPO_POR_CALIFICACION[calificacion]
+        cambios[campo] = cambios.get(campo, 0) + 1
+    _incrementar(usuario.id, cambios)
+
+
+def registrar_importacion(usuario, tarjetas_creadas, pendientes_creadas=0):
+    """
+    Actualiza la caché después de importar tarjetas a una baraja del usuario.
+    """
+    _incrementar(usuario.id, {
+        'total_tarjetas': tarjetas_creadas,
+        'tarjetas_pendientes': pendientes_creadas,
+    })
+
+
+def invalidar_estadisticas(usuario_id):
+    """
+    Borra los contadores del día para que se recalculen en la próxima lectura.
+    """
+    hoy = timezone.localdate()
+    cache.delete_many([_clave(usuario_id, hoy, campo) for campo in CAMPOS_ESTADISTICAS])
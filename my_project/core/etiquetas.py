@@ -0,0 +1,46 @@
+"""
+Normalización de etiquetas.
+
+Tarjeta.etiquetas es el texto que escribe el usuario ("Verbos, Básico");
+Tarjeta.lista_etiquetas es el arreglo normalizado que calcula PostgreSQL
+({'verbos', 'básico'}) y que tiene un índice GIN. Estas funciones aplican la
+misma normalización en Python para construir los filtros.
+"""
+
+
+def normalizar_etiquetas(texto):
+    """
+    Convierte un texto de etiquetas separadas por comas en una lista normalizada
+    (minúsculas, sin espacios, sin vacías ni repetidas), igual que lista_etiquetas.
+    """
+    etiquetas = []
+    for etiqueta in texto.split(','):
+        etiqueta = etiqueta.strip().lower()
+        if etiqueta and etiqueta not in etiquetas:
+            etiquetas.append(etiqueta)
+    return etiquetas
+
+
+def limpiar_etiquetas(texto):
+    """
+    Ordena el texto de etiquetas tal como lo escribió el usuario: quita espacios
+    sobrantes, etiquetas vacías y repetidas (sin cambiar mayúsculas).
+    """
+    etiquetas = []
+    vistas = set()
+    for etiqueta in texto.split(','):
+        etiqueta = etiqueta.strip()
+        if etiqueta and etiqueta.lower() not in vistas:
+            vistas.add(etiqueta.lower())
+            etiquetas.append(etiqueta)
+    return ', '.join(etiquetas)
+
+
+def filtrar_por_etiquetas(tarjetas, etiquetas):
+    """
+    Filtra un queryset de tarjetas que tengan todas las etiquetas indicadas
+    (operador @> de PostgreSQL, usa el índice GIN).
+    """
+    if not etiquetas:
+        return tarjetas
+    return tarjetas.filter(lista_etiquetas__contains=etiquetas)
@@ -0,0 +1,65 @@
+"""
+Exportación de tarjetas a CSV en streaming.
+
+Las filas se leen con values_list().iterator(), sin crear instancias del
+modelo ni guardar el queryset en caché, y se envían al navegador a medida
+que se generan. La memoria usada no depende del tamaño de la baraja.
+"""
+import csv
+import zlib
+from .models import Tarjeta
+
+# Columnas del CSV (mismo formato que acepta la importación)
+COLUMNAS = ['anverso', 'reverso', 'etiquetas', 'extra', 'tipo']
+
+# Filas que se leen de la base de datos en cada viaje
+TAMANO_LOTE = 2000
+
+# Se junta la salida hasta este tamaño antes de enviarla (menos escrituras pequeñas)
+TAMANO_BLOQUE = 64 * 1024
+
+
+class _Eco:
+    """
+    Objeto tipo archivo que devuelve lo que se le escribe, para usar csv.writer
+    sin un buffer intermedio.
+    """
+    def write(self, valor):
+        return valor
+
+
+def generar_csv(baraja):
+    """
+    Genera el contenido CSV de una baraja en bloques de texto.
+    """
+    writer = csv.writer(_Eco())
+    
+    # BOM para UTF-8 (para que Excel lo abra correctamente) y encabezados
+    bloque = ['\ufeff', writer.writerow(COLUMNAS)]
+    tamano = 0
+    
+    filas = Tarjeta.objects.filter(baraja=baraja).order_by('fecha_creacion').values_list(*COLUMNAS)
+    
+    for fila in filas.iterator(chunk_size=TAMANO_LOTE):
+        linea = writer.writerow(fila)
+        bloque.append(linea)
+        tamano += len(linea)
+        if tamano >= TAMANO_BLOQUE:
+            yield ''.join(bloque)
+            bloque = []
+            tamano = 0
+    
+    if bloque:
+        yield ''.join(bloque)
+
+
+def comprimir_gzip(bloques):
+    """
+    Comprime en formato gzip una secuencia de bloques de texto, también en streaming.
+    """
+    compresor = zlib.compressobj(wbits=31)  # wbits=31: cabecera y cola gzip
+    for bloque in bloques:
+        datos = compresor.compress(bloque.encode('utf-8'))
+        if datos:
+            yield datos
+    yield compresor.flush()
@@ -0,0 +1,119 @@
+"""
+Caché de fragmentos versionada.
+
+Las claves de los fragmentos incluyen la versión de lo que muestran, así que
+nunca hace falta borrarlos: al cambiar el contenido cambia la clave y el
+fragmento viejo expira solo. La versión de una baraja (y de sus tarjetas) es
+Baraja.fecha_modificacion y la de una clase (y de sus alumnos y tareas) es
+Clase.fecha_modificacion. Las señales las actualizan con tocar_baraja() y
+tocar_clase() cuando cambia algo que no pasa por el save() del propio modelo.
+
+Las plantillas usan {% cache %} con esas fechas como parte de la clave. Las
+tarjetas de la página de estudio se guardan ya serializadas, una por tarjeta,
+y las comparten todos los usuarios que estudian la misma baraja: la consulta
+del lote solo trae ids y las tarjetas que faltan en caché se cargan juntas.
+"""
+from django.core.cache import cache
+from django.utils import timezone
+from .models import Baraja, Clase, Tarjeta
+from . import medios
+
+# Los fragmentos no quedan desactualizados (la versión está en la clave);
+# el tiempo solo limita cuánto ocupan los que ya no se usan
+FRAGMENTO_CACHE_SEGUNDOS = 24 * 60 * 60
+
+# Campos que necesita serializar_tarjeta_estudio (la baraja, para encolar derivados de sus medios)
+CAMPOS_TARJETA_ESTUDIO = ['id', 'baraja', 'tipo', 'anverso', 'reverso', 'extra', 'imagen', 'audio']
+
+# Ancho (px) de la imagen de una tarjeta en la página de estudio
+ANCHO_IMAGEN_ESTUDIO = 640
+
+
+def tocar_baraja(baraja_id):
+    """
+    Cambia la versión de la baraja (por ejemplo, al cambiar sus tarjetas).
+    update() no envía señales ni vuelve a guardar el resto de campos.
+    """
+    Baraja.objects.filter(id=baraja_id).update(fecha_modificacion=timezone.now())
+
+
+def tocar_clase(clase_ids):
+    """
+    Cambia la versión de una o varias clases (alumnos o tareas modificados).
+    """
+    if isinstance(clase_ids, int):
+        clase_ids = [clase_ids]
+    Clase.objects.filter(id__in=clase_ids).update(fecha_modificacion=timezone.now())
+
+
+def serializar_tarjeta_estudio(tarjeta):
+    """
+    Convierte una tarjeta en el diccionario que usa la página de estudio.
+    Las URLs de imagen y audio son las de sus derivados reducidos si ya están
+    listos (ver core/medios.py); imagen_srcset son las variantes WebP.
+    """
+    return {
+        'id': tarjeta.id,
+        'tipo': tarjeta.get_tipo_display(),
+        'anverso': tarjeta.anverso,
+        'reverso': tarjeta.reverso,
+        'extra': tarjeta.extra,
+        'imagen': medios.url_imagen(tarjeta.imagen, ANCHO_IMAGEN_ESTUDIO),
+        'imagen_srcset': medios.srcset_imagen(tarjeta.imagen),
+        'audio': medios.url_audio(tarjeta.audio),
+    }
+
+
+def _claves_tarjetas(baraja, tarjeta_ids):
+    version = baraja.fecha_modificacion.timestamp()
+    return {f'tarjeta_estudio:{tarjeta_id}:{version}': tarjeta_id for tarjeta_id in tarjeta_ids}
+
+
+def _completar(claves, en_cache, cargadas):
+    """
+    Une las tarjetas de la caché con las cargadas de la base de datos, en el
+    orden del lote. Retorna: (tarjetas serializadas, nuevas entradas para la caché)
+    """
+    nuevas = {
+        clave: serializar_tarjeta_estudio(cargadas[tarjeta_id])
+        for clave, tarjeta_id in claves.items()
+        if clave not in en_cache and tarjeta_id in cargadas
+    }
+    tarjetas = [en_cache.get(clave) or nuevas.get(clave) for clave in claves]
+    # Una tarjeta borrada entre la consulta del lote y la carga se omite
+    return [t for t in tarjetas if t is not None], nuevas
+
+
+def tarjetas_estudio(baraja, tarjeta_ids):
+    """
+    Retorna: lista de tarjetas serializadas, en el orden de tarjeta_ids.
+    Solo consulta la base de datos por las que no están en caché (una consulta).
+    """
+    claves = _claves_tarjetas(baraja, tarjeta_ids)
+    en_cache = cache.get_many(claves)
+    faltantes = [tarjeta_id for clave, tarjeta_id in claves.items() if clave not in en_cache]
+    cargadas = {}
+    if faltantes:
+        cargadas = Tarjeta.objects.only(*CAMPOS_TARJETA_ESTUDIO).in_bulk(faltantes)
+
+    tarjetas, nuevas = _completar(claves, en_cache, cargadas)
+    if nuevas:
+        cache.set_many(nuevas, FRAGMENTO_CACHE_SEGUNDOS)
+    return tarjetas
+
+
+async def atarjetas_estudio(baraja, tarjeta_ids):
+    """
+    Versión async de tarjetas_estudio.
+    """
+    claves = _claves_tarjetas(baraja, tarjeta_ids)
+    en_cache = await cache.aget_many(claves)
+    faltantes = [tarjeta_id for clave, tarjeta_id in claves.items() if clave not in en_cache]
+    cargadas = {}
+    if faltantes:
+        cargadas = await Tarjeta.objects.only(*CAMPOS_TARJETA_ESTUDIO).ain_bulk(faltantes)
+
+    tarjetas, nuevas = _completar(claves, en_cache, cargadas)
+    if nuevas:
+        await cache.aset_many(nuevas, FRAGMENTO_CACHE_SEGUNDOS)
+    return tarjetas
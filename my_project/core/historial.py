@@ -0,0 +1,174 @@
+"""
+Particiones y retención del historial de respuestas.
+
+core_historialrespuesta es una tabla particionada por rango de
+fecha_respuesta en PostgreSQL, con una partición por mes
+(core_historialrespuesta_pAAAA_MM) y una partición por defecto para las filas
+que caigan fuera de los meses creados. Las consultas por rango de fechas solo
+leen las particiones de esos meses.
+
+Las respuestas más antiguas que HISTORIAL_DIAS_RETENCION se compactan en
+HistorialDiario (una fila por usuario, tarjeta y día) y su partición se borra
+entera, sin DELETE fila por fila. Ambas tareas las ejecuta el comando
+mantener_historial.
+"""
+from datetime import date, datetime, time, timezone as dt_timezone
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from .models import HistorialDiario, HistorialRespuesta, PerfilUsuario
+
+# Respuestas más antiguas que esto (en días) se compactan en HistorialDiario
+DIAS_RETENCION = getattr(settings, 'HISTORIAL_DIAS_RETENCION', 365)
+
+# Meses futuros para los que se dejan creadas las particiones
+MESES_ADELANTE = getattr(settings, 'HISTORIAL_MESES_ADELANTE', 3)
+
+TABLA = HistorialRespuesta._meta.db_table
+PARTICION_DEFECTO = f'{TABLA}_default'
+
+
+def _sumar_meses(mes, cantidad):
+    indice = mes.year * 12 + mes.month - 1 + cantidad
+    return date(indice // 12, indice % 12 + 1, 1)
+
+
+def _limite(mes):
+    """
+    Límite de una partición como literal timestamptz (inicio del mes en UTC).
+    """
+    return f"'{datetime.combine(mes, time.min, tzinfo=dt_timezone.utc).isoformat()}'"
+
+
+def nombre_particion(mes):
+    return f'{TABLA}_p{mes.year:04d}_{mes.month:02d}'
+
+
+def listar_particiones():
+    """
+    Retorna: lista ordenada de los meses (date del día 1) que tienen partición
+    """
+    prefijo = f'{TABLA}_p'
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT hija.relname FROM pg_inherits
+            JOIN pg_class padre ON padre.oid = pg_inherits.inhparent
+            JOIN pg_class hija ON hija.oid = pg_inherits.inhrelid
+            WHERE padre.relname = %s
+            """,
+            [TABLA]
+        )
+        nombres = [fila[0] for fila in cursor.fetchall()]
+
+    return sorted(
+        date(int(nombre[-7:-3]), int(nombre[-2:]), 1)
+        for nombre in nombres if nombre.startswith(prefijo)
+    )
+
+
+def crear_particion(mes):
+    """
+    Crea la partición de un mes si no existe. Las filas de ese mes que hayan
+    caído en la partición por defecto se mueven a la nueva.
+    """
+    nombre = nombre_particion(mes)
+    desde, hasta = _limite(mes), _limite(_sumar_meses(mes, 1))
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('SELECT to_regclass(%s)', [nombre])
+        if cursor.fetchone()[0] is not None:
+            return False
+
+        # Se crea suelta y se adjunta después: con filas de ese mes en la
+        # partición por defecto, CREATE TABLE ... PARTITION OF fallaría
+        cursor.execute(f'CREATE TABLE "{nombre}" (LIKE "{TABLA}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+        cursor.execute(
+            f'WITH movidas AS (DELETE FROM "{PARTICION_DEFECTO}" '
+            f'WHERE fecha_respuesta >= {desde} AND fecha_respuesta < {hasta} RETURNING *) '
+            f'INSERT INTO "{nombre}" SELECT * FROM movidas'
+        )
+        cursor.execute(
+            f'ALTER TABLE "{TABLA}" ATTACH PARTITION "{nombre}" FOR VALUES FROM ({desde}) TO ({hasta})'
+        )
+    return True
+
+
+def crear_particiones(hoy=None, meses_adelante=MESES_ADELANTE):
+    """
+    Asegura que existan las particiones del mes actual y de los próximos meses.
+
+    Retorna: lista de los meses creados
+    """
+    mes = (hoy or timezone.localdate()).replace(day=1)
+    return [
+        _sumar_meses(mes, i)
+        for i in range(meses_adelante + 1)
+        if crear_particion(_sumar_meses(mes, i))
+    ]
+
+
+def _compactar(cursor, origen, hasta):
+    """
+    Suma en HistorialDiario las respuestas de la tabla origen anteriores a hasta.
+
+    El día de cada respuesta es el local de PerfilUsuario.zona_horaria, el
+    mismo que usan las rachas y las sesiones (recalcular_rachas lee estos
+    días de HistorialDiario); sin perfil se usa settings.TIME_ZONE.
+    """
+    cursor.execute(
+        f"""
+        INSERT INTO "{HistorialDiario._meta.db_table}" AS diario
+            (usuario_id, tarjeta_id, fecha, respuestas, otra_vez, dificil, bien, facil, tiempo_total_segundos)
+        SELECT h.usuario_id, h.tarjeta_id, (h.fecha_respuesta AT TIME ZONE coalesce(p.zona_horaria, %s))::date,
+               count(*),
+               count(*) FILTER (WHERE calificacion = 1),
+               count(*) FILTER (WHERE calificacion = 2),
+               count(*) FILTER (WHERE calificacion = 3),
+               count(*) FILTER (WHERE calificacion = 4),
+               coalesce(sum(h.tiempo_respuesta_segundos), 0)
+        FROM "{origen}" h
+        LEFT JOIN "{PerfilUsuario._meta.db_table}" p ON p.usuario_id = h.usuario_id
+        WHERE h.fecha_respuesta < %s
+        GROUP BY 1, 2, 3
+        ON CONFLICT (usuario_id, fecha, tarjeta_id) DO UPDATE SET
+            respuestas = diario.respuestas + EXCLUDED.respuestas,
+            otra_vez = diario.otra_vez + EXCLUDED.otra_vez,
+            dificil = diario.dificil + EXCLUDED.dificil,
+            bien = diario.bien + EXCLUDED.bien,
+            facil = diario.facil + EXCLUDED.facil,
+            tiempo_total_segundos = diario.tiempo_total_segundos + EXCLUDED.tiempo_total_segundos
+        """,
+        [settings.TIME_ZONE, hasta]
+    )
+
+
+def compactar_historial(hoy=None, dias_retencion=DIAS_RETENCION):
+    """
+    Compacta en HistorialDiario los meses completos anteriores al límite de
+    retención y borra sus particiones.
+
+    Retorna: lista de los meses compactados
+    """
+    hoy = hoy or timezone.localdate()
+    # Solo meses completos: el límite es el inicio del mes donde cae la retención
+    limite = date.fromordinal(hoy.toordinal() - dias_retencion).replace(day=1)
+    hasta = datetime.combine(limite, time.min, tzinfo=dt_timezone.utc)
+
+    compactados = []
+    for mes in listar_particiones():
+        if _sumar_meses(mes, 1) > limite:
+            break
+        nombre = nombre_particion(mes)
+        with transaction.atomic(), connection.cursor() as cursor:
+            _compactar(cursor, nombre, hasta)
+            cursor.execute(f'ALTER TABLE "{TABLA}" DETACH PARTITION "{nombre}"')
+            cursor.execute(f'DROP TABLE "{nombre}"')
+        compactados.append(mes)
+
+    # Filas antiguas que hayan quedado en la partición por defecto
+    with transaction.atomic(), connection.cursor() as cursor:
+        _compactar(cursor, PARTICION_DEFECTO, hasta)
+        cursor.execute(f'DELETE FROM "{PARTICION_DEFECTO}" WHERE fecha_respuesta < %s', [hasta])
+
+    return compactados
@@ -0,0 +1,231 @@
+"""
+Importación de tarjetas desde CSV.
+
+El archivo se decodifica de forma incremental (sin cargarlo entero en memoria)
+y las tarjetas se insertan con bulk_create en lotes, junto con su programación.
+Los archivos grandes se guardan como ImportacionCSV y se procesan en un hilo
+en segundo plano; la página consulta el avance en estado_importacion.
+
+Cada lote se confirma por separado (así el avance se ve mientras tanto): si
+el archivo falla a la mitad (por ejemplo, no es UTF-8 o una fila no se puede
+leer), los lotes anteriores quedan importados y ImportacionInterrumpida
+informa cuántas tarjetas y hasta qué fila.
+"""
+import csv
+import io
+import threading
+from datetime import date
+from django.conf import settings
+from django.db import connection, transaction
+from .models import ImportacionCSV, Programacion, Tarjeta
+from .etiquetas import limpiar_etiquetas
+from . import estadisticas, fragmentos, pendientes
+
+# Tarjetas que se insertan en cada bulk_create
+TAMANO_LOTE = getattr(settings, 'IMPORTACION_CSV_TAMANO_LOTE', 1000)
+
+# Archivos más grandes que esto se procesan en segundo plano
+UMBRAL_SEGUNDO_PLANO = getattr(settings, 'IMPORTACION_CSV_UMBRAL_BYTES', 1024 * 1024)
+
+# Máximo de errores por fila que se reportan (el resto se descarta)
+MAX_ERRORES = 500
+
+
+class ImportacionInterrumpida(Exception):
+    """
+    Error que detuvo una importación después de guardar algunos lotes.
+    """
+    def __init__(self, causa, tarjetas_creadas, ultima_fila, filas_procesadas, errores):
+        self.causa = causa
+        self.tarjetas_creadas = tarjetas_creadas
+        self.ultima_fila = ultima_fila  # Última fila del último lote guardado
+        self.filas_procesadas = filas_procesadas
+        self.errores = errores
+        super().__init__(str(self))
+    
+    def __str__(self):
+        if not self.tarjetas_creadas:
+            return f'No se importó ninguna tarjeta: {self.causa}'
+        return (
+            f'Se importaron {self.tarjetas_creadas} tarjetas (hasta la fila {self.ultima_fila}) '
+            f'y el resto no: {self.causa}'
+        )
+
+
+def _leer_filas(archivo):
+    """
+    Recorre las filas del CSV decodificando el archivo poco a poco.
+    Genera tuplas (numero_fila, fila).
+    """
+    # utf-8-sig descarta el BOM que agrega Excel (y el que agrega exportar_csv)
+    texto = io.TextIOWrapper(archivo, encoding='utf-8-sig', newline='')
+    try:
+        reader = csv.DictReader(texto)
+        # start=2 porque la fila 1 es el encabezado
+        yield from enumerate(reader, start=2)
+    finally:
+        texto.detach()  # No cerrar el archivo original al terminar
+
+
+def _guardar_lote(baraja, usuario, tarjetas):
+    """
+    Inserta un lote de tarjetas y su programación en una transacción.
+    """
+    hoy = date.today()
+    with transaction.atomic():
+        # PostgreSQL devuelve los ids generados, necesarios para la programación
+        Tarjeta.objects.bulk_create(tarjetas)
+        Programacion.objects.bulk_create([
+            Programacion(usuario=usuario, tarjeta=tarjeta, proximo_estudio=hoy)
+            for tarjeta in tarjetas
+        ])
+
+
+def importar_archivo(archivo, baraja, usuario, al_avanzar=None):
+    """
+    Importa las tarjetas de un archivo CSV a una baraja.
+    
+    Parámetros:
+    - archivo: archivo abierto en modo binario
+    - al_avanzar: función opcional que se llama después de cada lote con
+      (filas_procesadas, tarjetas_creadas, errores)
+    
+    Retorna: (tarjetas_creadas, errores)
+    Lanza ImportacionInterrumpida si un error detiene la importación (los lotes ya guardados quedan).
+    """
+    tarjetas_creadas = 0
+    filas_procesadas = 0
+    row_num = ultima_fila = 1
+    errores = []
+    lote = []
+    
+    def guardar():
+        nonlocal tarjetas_creadas, ultima_fila
+        _guardar_lote(baraja, usuario, lote)
+        tarjetas_creadas += len(lote)
+        ultima_fila = row_num
+        estadisticas.registrar_importacion(usuario, len(lote), pendientes_creadas=len(lote))
+        pendientes.registrar_importacion(usuario, baraja, len(lote))
+        fragmentos.tocar_baraja(baraja.id)  # bulk_create no envía las señales de Tarjeta
+        lote.clear()
+        if al_avanzar:
+            al_avanzar(filas_procesadas, tarjetas_creadas, errores)
+    
+    try:
+        for row_num, row in _leer_filas(archivo):
+            filas_procesadas += 1
+            anverso = (row.get('anverso') or '').strip()
+            reverso = (row.get('reverso') or '').strip()
+            etiquetas = limpiar_etiquetas(row.get('etiquetas') or '')
+            
+            # Validar que tenga al menos anverso y reverso
+            if not anverso or not reverso:
+                if len(errores) < MAX_ERRORES:
+                    errores.append(f'Fila {row_num}: Falta anverso o reverso')
+                continue
+            
+            if len(etiquetas) > Tarjeta._meta.get_field('etiquetas').max_length:
+                if len(errores) < MAX_ERRORES:
+                    errores.append(f'Fila {row_num}: Las etiquetas son demasiado largas')
+                continue
+            
+            lote.append(Tarjeta(
+                baraja=baraja,
+                anverso=anverso,
+                reverso=reverso,
+                etiquetas=etiquetas
+            ))
+            if len(lote) >= TAMANO_LOTE:
+                guardar()
+        
+        if lote:
+            guardar()
+        elif al_avanzar:
+            al_avanzar(filas_procesadas, tarjetas_creadas, errores)
+    except Exception as e:
+        raise ImportacionInterrumpida(e, tarjetas_creadas, ultima_fila, filas_procesadas, errores) from e
+    
+    return tarjetas_creadas, errores
+
+
+def procesar_importacion(importacion_id):
+    """
+    Procesa una ImportacionCSV pendiente. Si otro proceso ya la tomó, no hace nada.
+    """
+    # Marcar como "procesando" solo si sigue pendiente (evita procesarla dos veces)
+    tomada = ImportacionCSV.objects.filter(
+        pk=importacion_id, estado='pendiente'
+    ).update(estado='procesando')
+    if not tomada:
+        return
+    
+    importacion = ImportacionCSV.objects.select_related('baraja', 'usuario').get(pk=importacion_id)
+    
+    try:
+        with importacion.archivo.open('rb') as archivo:
+            def al_avanzar(filas_procesadas, tarjetas_creadas, errores):
+                ImportacionCSV.objects.filter(pk=importacion.pk).update(
+                    filas_procesadas=filas_procesadas,
+                    tarjetas_creadas=tarjetas_creadas,
+                    bytes_procesados=archivo.tell(),
+                    errores=errores
+                )
+            
+            tarjetas_creadas, errores = importar_archivo(
+                archivo, importacion.baraja, importacion.usuario, al_avanzar=al_avanzar
+            )
+        
+        importacion.estado = 'completada'
+        importacion.tarjetas_creadas = tarjetas_creadas
+        importacion.errores = errores
+        importacion.bytes_procesados = importacion.tamano_bytes
+    except ImportacionInterrumpida as e:
+        # Los lotes guardados antes del error quedan: se informa cuántos
+        importacion.estado = 'error'
+        importacion.tarjetas_creadas = e.tarjetas_creadas
+        importacion.filas_procesadas = e.filas_procesadas
+        importacion.errores = e.errores
+        importacion.mensaje_error = str(e)
+    except Exception as e:
+        importacion.estado = 'error'
+        importacion.mensaje_error = str(e)
+    
+    importacion.save(update_fields=[
+        'estado', 'filas_procesadas', 'tarjetas_creadas', 'errores', 'bytes_procesados',
+        'mensaje_error', 'fecha_actualizacion'
+    ])
+    
+    # El archivo ya no se necesita
+    if importacion.estado == 'completada':
+        importacion.archivo.delete(save=False)
+
+
+def _procesar_en_hilo(importacion_id):
+    try:
+        procesar_importacion(importacion_id)
+    finally:
+        # Cada hilo tiene su propia conexión a la base de datos
+        connection.close()
+
+
+def encolar_importacion(archivo, baraja, usuario):
+    """
+    Guarda el archivo subido y lanza su procesamiento en segundo plano.
+    Las importaciones que queden pendientes (por ejemplo, si el servidor se
+    reinicia) se pueden procesar con: python manage.py procesar_importaciones
+    
+    Retorna: la ImportacionCSV creada
+    """
+    importacion = ImportacionCSV.objects.create(
+        usuario=usuario,
+        baraja=baraja,
+        archivo=archivo,
+        tamano_bytes=archivo.size
+    )
+    
+    # Lanzar el hilo cuando la fila ya esté confirmada en la base de datos
+    transaction.on_commit(lambda: threading.Thread(
+        target=_procesar_en_hilo, args=(importacion.pk,), daemon=True
+    ).start())
+    
+    return importacion
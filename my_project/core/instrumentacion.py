@@ -0,0 +1,317 @@
+"""
+Medición de consultas y tiempos por vista.
+
+InstrumentacionMiddleware mide una muestra de las peticiones
+(INSTRUMENTACION_MUESTREO, entre 0 y 1): cantidad de consultas, tiempo en la
+base de datos, tiempo renderizando plantillas y tiempo total. Cada medición
+se guarda en un buffer circular en memoria (las últimas
+INSTRUMENTACION_TAMANO_BUFFER de este proceso), que la vista instrumentacion
+resume por nombre de vista para el staff.
+
+Si una petición medida supera INSTRUMENTACION_UMBRAL_CONSULTAS consultas o
+INSTRUMENTACION_UMBRAL_MS milisegundos, se registra un warning con su
+consulta más lenta. Las peticiones que no entran en la muestra solo cuestan
+un número aleatorio, por lo que el middleware puede quedar activo en
+producción.
+
+El middleware es sync y async: con ASGI no obliga a Django a adaptar la
+cadena de middlewares, así que las vistas async siguen siendo async. Las
+consultas se cuentan con un wrapper instalado en cada conexión, que suma a la
+medición de la petición en curso (una ContextVar, que también ven los hilos
+de sync_to_async). Las respuestas en streaming se miden hasta que terminan de
+enviarse, porque sus consultas se hacen mientras se generan.
+"""
+import logging
+import random
+import statistics
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from functools import wraps
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.backends.django import Template
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Fracción de las peticiones que se miden (1 = todas, 0 = ninguna)
+MUESTREO = 0.1
+
+# Mediciones que se conservan en memoria por proceso
+TAMANO_BUFFER = 1000
+
+# Una petición medida con más consultas o más milisegundos que esto se registra en el log
+# (None desactiva el umbral)
+UMBRAL_CONSULTAS = 50
+UMBRAL_MS = 1000
+
+# Medición de la petición en curso; la leen el wrapper de consultas y el de plantillas
+_medicion_actual = ContextVar('medicion_actual', default=None)
+
+
+class Medicion:
+    """
+    Tiempos y consultas de una petición. Los tiempos se acumulan en segundos.
+    """
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.consultas = 0
+        self.tiempo_bd = 0.0
+        self.tiempo_plantillas = 0.0
+        self.consulta_mas_lenta = None
+        self.tiempo_consulta_mas_lenta = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        """
+        Cuenta y cronometra una consulta (lo llama _medir_consulta).
+        """
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duracion = time.perf_counter() - inicio
+            self.consultas += 1
+            self.tiempo_bd += duracion
+            if duracion > self.tiempo_consulta_mas_lenta:
+                # Solo el SQL con marcadores, sin los parámetros (pueden tener datos personales)
+                self.consulta_mas_lenta = sql
+                self.tiempo_consulta_mas_lenta = duracion
+
+
+class RegistroMediciones:
+    """
+    Buffer circular con las últimas mediciones del proceso.
+    """
+    def __init__(self, tamano=TAMANO_BUFFER):
+        self._mediciones = deque(maxlen=tamano)
+        self._candado = threading.Lock()
+
+    def agregar(self, medicion):
+        with self._candado:
+            self._mediciones.append(medicion)
+
+    def mediciones(self):
+        with self._candado:
+            return list(self._mediciones)
+
+    def limpiar(self):
+        with self._candado:
+            self._mediciones.clear()
+
+    def resumen(self):
+        """
+        Retorna: lista de dicts por vista (peticiones, medias y máximos), de la
+        vista con más tiempo total acumulado a la de menos
+        """
+        por_vista = {}
+        for medicion in self.mediciones():
+            por_vista.setdefault(medicion['vista'], []).append(medicion)
+
+        resumen = []
+        for vista, mediciones in por_vista.items():
+            totales = sorted(m['total_ms'] for m in mediciones)
+            resumen.append({
+                'vista': vista,
+                'peticiones': len(mediciones),
+                'consultas_media': round(statistics.fmean(m['consultas'] for m in mediciones), 1),
+                'consultas_max': max(m['consultas'] for m in mediciones),
+                'bd_ms_media': round(statistics.fmean(m['bd_ms'] for m in mediciones), 2),
+                'plantillas_ms_media': round(statistics.fmean(m['plantillas_ms'] for m in mediciones), 2),
+                'total_ms_media': round(statistics.fmean(totales), 2),
+                'total_ms_p95': totales[max(-(-len(totales) * 95 // 100) - 1, 0)],
+                'total_ms_max': totales[-1],
+                'total_ms_acumulado': round(sum(totales), 2),
+            })
+        resumen.sort(key=lambda fila: fila['total_ms_acumulado'], reverse=True)
+        return resumen
+
+
+# Registro compartido por todo el proceso
+registro = RegistroMediciones(getattr(settings, 'INSTRUMENTACION_TAMANO_BUFFER', TAMANO_BUFFER))
+
+
+def _instrumentar_plantillas():
+    """
+    Envuelve Template.render del backend de Django para sumar su tiempo a la
+    medición en curso. Las plantillas incluidas o extendidas se renderizan
+    dentro de la principal, así que no se cuentan dos veces.
+    """
+    render_original = Template.render
+
+    @wraps(render_original)
+    def render(self, context=None, request=None):
+        medicion = _medicion_actual.get()
+        if medicion is None:
+            return render_original(self, context, request)
+        inicio = time.perf_counter()
+        try:
+            return render_original(self, context, request)
+        finally:
+            medicion.tiempo_plantillas += time.perf_counter() - inicio
+
+    Template.render = render
+
+
+_instrumentar_plantillas()
+
+
+def _medir_consulta(execute, sql, params, many, context):
+    """
+    Wrapper de consultas de todas las conexiones: mide la consulta si la petición en curso se está midiendo.
+    """
+    medicion = _medicion_actual.get()
+    if medicion is None:
+        return execute(sql, params, many, context)
+    return medicion(execute, sql, params, many, context)
+
+
+def _instalar_en_conexion(conexion):
+    if _medir_consulta not in conexion.execute_wrappers:
+        conexion.execute_wrappers.append(_medir_consulta)
+
+
+def _instalar_al_conectar(sender, connection, **kwargs):
+    # Cada hilo tiene sus propias conexiones (también el de sync_to_async en ASGI)
+    _instalar_en_conexion(connection)
+
+
+connection_created.connect(_instalar_al_conectar)
+
+
+def _milisegundos(segundos):
+    return round(segundos * 1000, 2)
+
+
+class InstrumentacionMiddleware:
+    """
+    Mide una muestra de las peticiones y la guarda en el registro (ver el
+    docstring del módulo). Debe ir al principio de MIDDLEWARE para que el
+    tiempo total incluya el resto de middlewares.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.es_async = iscoroutinefunction(get_response)
+        if self.es_async:
+            markcoroutinefunction(self)
+        # Leídos aquí y no al importar: el cliente de pruebas crea el middleware
+        # de nuevo y así respeta override_settings (lo usa el comando perfilar_vistas)
+        self.muestreo = getattr(settings, 'INSTRUMENTACION_MUESTREO', MUESTREO)
+        self.umbral_consultas = getattr(settings, 'INSTRUMENTACION_UMBRAL_CONSULTAS', UMBRAL_CONSULTAS)
+        self.umbral_ms = getattr(settings, 'INSTRUMENTACION_UMBRAL_MS', UMBRAL_MS)
+
+    def _en_muestra(self):
+        return self.muestreo > 0 and random.random() < self.muestreo
+
+    def __call__(self, request):
+        if self.es_async:
+            return self._acall(request)
+        if not self._en_muestra():
+            return self.get_response(request)
+
+        # Conexiones de este hilo abiertas antes de importar este módulo
+        for conexion in connections.all(initialized_only=True):
+            _instalar_en_conexion(conexion)
+        medicion = Medicion()
+        token = _medicion_actual.set(medicion)
+        try:
+            response = self.get_response(request)
+        finally:
+            _medicion_actual.reset(token)
+        return self._terminar(request, response, medicion)
+
+    async def _acall(self, request):
+        if not self._en_muestra():
+            return await self.get_response(request)
+
+        medicion = Medicion()
+        token = _medicion_actual.set(medicion)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _medicion_actual.reset(token)
+        return self._terminar(request, response, medicion)
+
+    def _terminar(self, request, response, medicion):
+        """
+        Registra la medición, o la deja para cuando termine de enviarse una respuesta en streaming.
+        """
+        if not response.streaming:
+            self._registrar(request, response, medicion)
+        elif response.is_async:
+            response.streaming_content = self._medir_contenido_async(
+                request, response, medicion, response.streaming_content
+            )
+        else:
+            response.streaming_content = self._medir_contenido(request, response, medicion, response.streaming_content)
+        return response
+
+    def _medir_contenido(self, request, response, medicion, contenido):
+        """
+        Recorre el contenido de la respuesta midiendo lo que se consulta al generar cada parte.
+        """
+        iterador = iter(contenido)
+        try:
+            while True:
+                # Cada parte puede generarse en otro contexto (con ASGI, en otro hilo)
+                token = _medicion_actual.set(medicion)
+                try:
+                    parte = next(iterador)
+                except StopIteration:
+                    return
+                finally:
+                    _medicion_actual.reset(token)
+                yield parte
+        finally:
+            self._registrar(request, response, medicion)
+
+    async def _medir_contenido_async(self, request, response, medicion, contenido):
+        iterador = aiter(contenido)
+        try:
+            while True:
+                token = _medicion_actual.set(medicion)
+                try:
+                    parte = await anext(iterador)
+                except StopAsyncIteration:
+                    return
+                finally:
+                    _medicion_actual.reset(token)
+                yield parte
+        finally:
+            self._registrar(request, response, medicion)
+
+    def _registrar(self, request, response, medicion):
+        total = time.perf_counter() - medicion.inicio
+
+        # Sin resolver_match la URL no existía (404 del resolver)
+        vista = request.resolver_match.view_name if request.resolver_match else '<sin vista>'
+        datos = {
+            'vista': vista,
+            'metodo': request.method,
+            'ruta': request.path,
+            'estado': response.status_code,
+            'consultas': medicion.consultas,
+            'bd_ms': _milisegundos(medicion.tiempo_bd),
+            'plantillas_ms': _milisegundos(medicion.tiempo_plantillas),
+            'total_ms': _milisegundos(total),
+            'fecha': timezone.now().isoformat(),
+        }
+        registro.agregar(datos)
+
+        if (
+            (self.umbral_consultas is not None and medicion.consultas > self.umbral_consultas)
+            or (self.umbral_ms is not None and datos['total_ms'] > self.umbral_ms)
+        ):
+            logger.warning(
+                'Petición lenta %s %s (%s): %d consultas, %.0f ms en BD, %.0f ms en plantillas, '
+                '%.0f ms en total. Consulta más lenta (%.0f ms): %s',
+                request.method, request.path, vista, medicion.consultas, datos['bd_ms'],
+                datos['plantillas_ms'], datos['total_ms'],
+                medicion.tiempo_consulta_mas_lenta * 1000, medicion.consulta_mas_lenta
+            )
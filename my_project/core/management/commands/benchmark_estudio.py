@@ -0,0 +1,109 @@
+import json
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test.utils import setup_test_environment, teardown_test_environment
+from core import benchmark
+from core.models import Baraja
+from core.escritor_historial import escritor
+from core.replicas import alias_replicas
+
+
+class Command(BaseCommand):
+    """
+    Mide el rendimiento del flujo de estudio (dashboard -> estudiar_baraja ->
+    calificar_respuesta) sobre un conjunto de datos sintético.
+
+    Crea una base de datos desechable con el mismo nombre que usan las pruebas
+    (test_<NAME>), la puebla, ejecuta las sesiones con el cliente de pruebas de
+    Django en este mismo proceso y la borra al terminar. Los resultados (por
+    vista: peticiones por segundo, latencias p50/p95/p99 y consultas por
+    petición) se imprimen y se pueden guardar en JSON con --salida para
+    comparar entre versiones.
+    """
+    help = 'Ejecuta el benchmark del flujo de estudio sobre una base de datos desechable'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--usuarios', type=int, default=2000, help='Usuarios sintéticos (por defecto 2000)')
+        parser.add_argument('--barajas', type=int, default=3, help='Barajas por usuario (por defecto 3)')
+        parser.add_argument('--tarjetas', type=int, default=100, help='Tarjetas por baraja (por defecto 100)')
+        parser.add_argument(
+            '--respuestas', type=int, default=2_000_000,
+            help='Filas de historial de respuestas (por defecto 2000000)'
+        )
+        parser.add_argument('--sesiones', type=int, default=200, help='Sesiones de estudio a ejecutar (por defecto 200)')
+        parser.add_argument(
+            '--calificaciones', type=int, default=20,
+            help='Tarjetas calificadas en cada sesión (por defecto 20)'
+        )
+        parser.add_argument('--concurrencia', type=int, default=1, help='Hilos que ejecutan sesiones a la vez')
+        parser.add_argument('--semilla', type=int, default=0, help='Semilla de los datos y de las sesiones')
+        parser.add_argument('--salida', help='Archivo JSON donde guardar los resultados')
+        parser.add_argument(
+            '--conservar-bd', action='store_true',
+            help='Reutilizar la base de datos de una ejecución anterior y no borrarla al terminar'
+        )
+
+    def handle(self, *args, **options):
+        # Permite el host "testserver" del cliente de pruebas
+        setup_test_environment()
+        nombre_original = connection.settings_dict['NAME']
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False, keepdb=options['conservar_bd']
+        )
+        # Las réplicas leen de la base de datos desechable, como con TEST MIRROR
+        # (también en settings: los hilos del benchmark abren sus propias conexiones)
+        nombres_replicas = {alias: settings.DATABASES[alias]['NAME'] for alias in alias_replicas()}
+        for alias in nombres_replicas:
+            connections[alias].close()
+            settings.DATABASES[alias]['NAME'] = connections[alias].settings_dict['NAME'] = connection.settings_dict['NAME']
+        try:
+            if options['conservar_bd'] and Baraja.objects.exists():
+                self.stdout.write('Usando los datos de la ejecución anterior')
+                datos = None
+            else:
+                self.stdout.write('Poblando la base de datos...')
+                datos = benchmark.poblar(
+                    options['usuarios'], options['barajas'], options['tarjetas'],
+                    options['respuestas'], semilla=options['semilla']
+                )
+                self.stdout.write(', '.join(f'{tabla}: {filas}' for tabla, filas in datos.items()))
+
+            self.stdout.write('Ejecutando sesiones de estudio...')
+            mediciones, segundos = benchmark.ejecutar_estudio(
+                options['sesiones'], options['calificaciones'],
+                concurrencia=max(options['concurrencia'], 1), semilla=options['semilla']
+            )
+            # El historial se escribe en segundo plano: terminar antes de borrar la base de datos
+            escritor.detener()
+        finally:
+            for alias, nombre in nombres_replicas.items():
+                connections[alias].close()
+                settings.DATABASES[alias]['NAME'] = connections[alias].settings_dict['NAME'] = nombre
+            if not options['conservar_bd']:
+                connection.creation.destroy_test_db(nombre_original, verbosity=0)
+            teardown_test_environment()
+
+        resumen = benchmark.resumir(mediciones, segundos)
+        for vista, metricas in resumen.items():
+            self.stdout.write(
+                f"{vista:<22} {metricas['peticiones']:>6} pet. {metricas['peticiones_por_segundo']:>8} pet/s  "
+                f"p50 {metricas['latencia_p50_ms']:>7} ms  p95 {metricas['latencia_p95_ms']:>7} ms  "
+                f"p99 {metricas['latencia_p99_ms']:>7} ms  {metricas['consultas_media']:>5} consultas  "
+                f"{metricas['errores']} errores"
+            )
+
+        if options['salida']:
+            with open(options['salida'], 'w', encoding='utf-8') as archivo:
+                json.dump({
+                    'parametros': {
+                        clave: options[clave] for clave in (
+                            'usuarios', 'barajas', 'tarjetas', 'respuestas',
+                            'sesiones', 'calificaciones', 'concurrencia', 'semilla'
+                        )
+                    },
+                    'datos': datos,
+                    'segundos': round(segundos, 3),
+                    'vistas': resumen,
+                }, archivo, indent=2, ensure_ascii=False)
+            self.stdout.write(self.style.SUCCESS(f'Resultados guardados en {options["salida"]}'))
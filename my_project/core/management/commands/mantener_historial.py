@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from core.historial import DIAS_RETENCION, compactar_historial, crear_particiones
+
+
+class Command(BaseCommand):
+    """
+    Mantenimiento del historial de respuestas: crea las particiones de los
+    próximos meses y compacta en HistorialDiario los meses más antiguos que
+    la retención configurada. Pensado para ejecutarse cada noche desde un cron.
+    """
+    help = 'Crea las particiones del historial y compacta las respuestas antiguas'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dias-retencion', type=int, default=DIAS_RETENCION,
+            help=f'Días de respuestas que se conservan sin compactar (por defecto {DIAS_RETENCION})'
+        )
+    
+    def handle(self, *args, **options):
+        for mes in crear_particiones():
+            self.stdout.write(f'Partición creada: {mes:%Y-%m}')
+        
+        for mes in compactar_historial(dias_retencion=options['dias_retencion']):
+            self.stdout.write(f'Mes compactado: {mes:%Y-%m}')
@@ -0,0 +1,71 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+from core.instrumentacion import registro
+
+
+class Command(BaseCommand):
+    """
+    Pide las rutas indicadas con el cliente de pruebas de Django, como el
+    usuario indicado, midiendo todas las peticiones con
+    InstrumentacionMiddleware, e imprime consultas y tiempos por vista.
+    Sirve para encontrar N+1 antes de producción, por ejemplo sobre una copia
+    de la base de datos:
+
+        python manage.py perfilar_vistas --usuario docente /clases/ /clases/3/progreso/
+
+    Con --consultas-max termina con error si alguna vista lo supera (para CI).
+    Solo hace peticiones GET.
+    """
+    help = 'Mide consultas y tiempos de las vistas en las rutas indicadas'
+
+    def add_arguments(self, parser):
+        parser.add_argument('rutas', nargs='+', help='Rutas a pedir, por ejemplo /clases/')
+        parser.add_argument('--usuario', required=True, help='Nombre del usuario con el que se piden las rutas')
+        parser.add_argument(
+            '--repeticiones', type=int, default=5,
+            help='Veces que se pide cada ruta (por defecto 5)'
+        )
+        parser.add_argument(
+            '--consultas-max', type=int,
+            help='Terminar con error si alguna vista hace más consultas que esto'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            usuario = User.objects.get(username=options['usuario'])
+        except User.DoesNotExist:
+            raise CommandError(f'No existe el usuario "{options["usuario"]}"')
+
+        # Medir todas las peticiones, sin warnings, y aceptar el host "testserver" del cliente de pruebas
+        with override_settings(
+            INSTRUMENTACION_MUESTREO=1, INSTRUMENTACION_UMBRAL_CONSULTAS=None, INSTRUMENTACION_UMBRAL_MS=None,
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']
+        ):
+            registro.limpiar()
+            cliente = Client()
+            cliente.force_login(usuario)
+            for ruta in options['rutas']:
+                for _ in range(max(options['repeticiones'], 1)):
+                    respuesta = cliente.get(ruta)
+                if respuesta.status_code >= 400:
+                    self.stderr.write(f'{ruta}: respuesta {respuesta.status_code}')
+
+        resumen = registro.resumen()
+        if not resumen:
+            raise CommandError('No hay mediciones: ¿está InstrumentacionMiddleware en MIDDLEWARE?')
+
+        for fila in resumen:
+            self.stdout.write(
+                f"{fila['vista']:<30} {fila['peticiones']:>4} pet.  {fila['consultas_media']:>6} consultas "
+                f"(máx. {fila['consultas_max']})  BD {fila['bd_ms_media']:>8} ms  "
+                f"plantillas {fila['plantillas_ms_media']:>8} ms  total {fila['total_ms_media']:>8} ms"
+            )
+
+        if options['consultas_max'] is not None:
+            excedidas = [fila['vista'] for fila in resumen if fila['consultas_max'] > options['consultas_max']]
+            if excedidas:
+                raise CommandError(
+                    f'Vistas con más de {options["consultas_max"]} consultas: {", ".join(excedidas)}'
+                )
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from core.models import ImportacionCSV
+from core.importador import procesar_importacion
+
+
+class Command(BaseCommand):
+    """
+    Procesa las importaciones CSV que quedaron pendientes.
+    Útil si el servidor se reinició antes de que terminara el hilo en segundo plano,
+    o para procesar las importaciones desde un cron/worker aparte.
+    """
+    help = 'Procesa las importaciones CSV pendientes'
+    
+    def handle(self, *args, **options):
+        pendientes = ImportacionCSV.objects.filter(estado='pendiente').order_by('fecha_creacion')
+        
+        for importacion_id in pendientes.values_list('id', flat=True):
+            procesar_importacion(importacion_id)
+            importacion = ImportacionCSV.objects.get(pk=importacion_id)
+            self.stdout.write(
+                f'Importación {importacion_id}: {importacion.get_estado_display()} '
+                f'({importacion.tarjetas_creadas} tarjetas)'
+            )
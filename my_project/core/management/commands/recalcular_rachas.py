@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from core.rachas import recalcular_rachas
+
+
+class Command(BaseCommand):
+    """
+    Calcula la racha y el último día de estudio de todos los usuarios a partir
+    de su historial de respuestas, en una sola consulta. Para cargar las rachas
+    la primera vez o corregirlas; después se mantienen solas al responder.
+    """
+    help = 'Recalcula las rachas de estudio de todos los usuarios desde el historial'
+    
+    def handle(self, *args, **options):
+        filas = recalcular_rachas()
+        self.stdout.write(f'Rachas recalculadas: {filas} usuarios con respuestas')
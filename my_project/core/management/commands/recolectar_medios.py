@@ -0,0 +1,55 @@
+import os
+from django.core.management.base import BaseCommand
+from core.almacenamiento import almacenamiento_medios
+from core import medios
+
+# Carpetas de los upload_to de Tarjeta y Baraja
+CARPETAS = ['tarjetas', 'audios', 'portadas']
+
+
+class Command(BaseCommand):
+    """
+    Revisa todos los archivos de medios y borra los que ya no usa ninguna
+    tarjeta ni baraja (con sus derivados), y los derivados cuyo original ya
+    no existe. Al borrar tarjetas y barajas esto se hace solo para sus
+    archivos; este comando encuentra el resto (por ejemplo, la imagen vieja
+    de una tarjeta editada). Pensado para ejecutarse cada noche desde un cron.
+    """
+    help = 'Borra los archivos de medios que ya no se usan'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--gracia', type=int, default=medios.GRACIA_RECOLECCION,
+            help='No borrar archivos escritos hace menos de estos segundos'
+        )
+
+    def _archivos(self, carpeta):
+        if not almacenamiento_medios.exists(carpeta):
+            return
+        subcarpetas, archivos = almacenamiento_medios.listdir(carpeta)
+        for archivo in archivos:
+            yield os.path.join(carpeta, archivo)
+        for subcarpeta in subcarpetas:
+            yield from self._archivos(os.path.join(carpeta, subcarpeta))
+
+    def handle(self, *args, **options):
+        archivos = {nombre for carpeta in CARPETAS for nombre in self._archivos(carpeta)}
+        # Los derivados de los originales subidos antes de nombrarlos por contenido
+        # no tienen un nombre reconocible: son los que corresponden a otro archivo
+        de_otro = {
+            derivado for nombre in archivos if not medios.es_derivado(nombre)
+            for derivado in medios.nombres_derivados(nombre)
+        }
+        derivados = [nombre for nombre in archivos if medios.es_derivado(nombre) or nombre in de_otro]
+        originales = archivos.difference(derivados)
+
+        borrados = medios.recolectar(originales, gracia=options['gracia'])
+
+        huerfanos = 0
+        esperados = {derivado for nombre in originales for derivado in medios.nombres_derivados(nombre)}
+        for derivado in derivados:
+            if derivado not in esperados:
+                almacenamiento_medios.delete(derivado)
+                huerfanos += 1
+
+        self.stdout.write(f'Archivos borrados: {borrados} (y {huerfanos} derivados sin original)')
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from core.pendientes import reconstruir_pendientes
+
+
+class Command(BaseCommand):
+    """
+    Recalcula el resumen de tarjetas pendientes del día para todos los usuarios
+    y borra los de días anteriores. Pensado para ejecutarse cada noche, después
+    de la medianoche, desde un cron.
+    """
+    help = 'Recalcula las tarjetas pendientes de hoy por usuario y baraja'
+    
+    def handle(self, *args, **options):
+        filas = reconstruir_pendientes()
+        self.stdout.write(f'Pendientes recalculados: {filas} filas')
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from core.rachas import reiniciar_rachas
+
+
+class Command(BaseCommand):
+    """
+    Pone en 0 las rachas de los usuarios que no estudiaron ni hoy ni ayer en
+    su zona horaria. Pensado para ejecutarse cada noche desde un cron (o cada
+    hora, si hay usuarios en zonas horarias muy distintas).
+    """
+    help = 'Reinicia las rachas de estudio cortadas'
+    
+    def handle(self, *args, **options):
+        filas = reiniciar_rachas()
+        self.stdout.write(f'Rachas reiniciadas: {filas}')
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from core.sesiones import sesionizar
+
+
+class Command(BaseCommand):
+    """
+    Agrupa en sesiones las respuestas del historial guardadas desde la corrida
+    anterior (la primera vez, todo el historial). Pensado para ejecutarse cada
+    pocos minutos desde un cron, con SESIONES_AL_CALIFICAR o sin él.
+    """
+    help = 'Agrupa en sesiones de estudio las respuestas nuevas del historial'
+    
+    def handle(self, *args, **options):
+        respuestas = sesionizar()
+        self.stdout.write(f'Respuestas agrupadas en sesiones: {respuestas}')
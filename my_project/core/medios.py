@@ -0,0 +1,399 @@
+"""
+Variantes reducidas de las imágenes y audios subidos (derivados).
+
+Las imágenes de tarjetas y portadas se sirven en varios anchos (ANCHOS_IMAGEN),
+recomprimidas en WebP y en JPEG (para navegadores sin WebP), y los audios
+normalizados en volumen y comprimidos en MP3 mono (si ffmpeg está instalado).
+Los derivados se guardan junto al original, en el mismo almacenamiento:
+
+    tarjetas/foto.jpg -> tarjetas/foto.320w.webp, tarjetas/foto.320w.jpg, ...
+    audios/clip.wav   -> audios/clip.normalizado.mp3
+
+Se generan en segundo plano: al subir un archivo (señales post_save) y, para
+los que ya existían, la primera vez que se muestran. Mientras no están listos
+se sirve el original. El estado de cada archivo (listo, pendiente o fallido)
+se guarda en caché, así que mostrar una imagen solo lee la fecha del original
+(no busca sus derivados). Esa fecha es parte de la clave: si el archivo se
+borra y se vuelve a subir, ningún proceso sigue creyendo que sus derivados
+existen. Al terminar se cambia la versión de la baraja para que los
+fragmentos en caché (core/fragmentos.py) pasen a usar los derivados.
+
+Los originales se guardan una sola vez por contenido (core/almacenamiento.py)
+y varias filas pueden compartirlos: recolectar() borra un archivo y sus
+derivados cuando ya ninguna tarjeta ni baraja lo usa. Se llama al borrar
+tarjetas y barajas (señales); el comando recolectar_medios revisa todo el
+almacenamiento (por ejemplo, archivos reemplazados al editar una tarjeta).
+"""
+import atexit
+import hashlib
+import io
+import logging
+import os
+import queue
+import re
+import shutil
+import subprocess
+import threading
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, connection, transaction
+from PIL import Image, ImageOps
+from .almacenamiento import almacenamiento_medios
+from .models import Baraja, Tarjeta
+from . import fragmentos
+
+logger = logging.getLogger(__name__)
+
+# Anchos (px) de las variantes de imagen; una imagen más angosta no se agranda
+ANCHOS_IMAGEN = getattr(settings, 'MEDIOS_ANCHOS_IMAGEN', (320, 640, 1280))
+
+# Formato de Pillow y opciones de guardado por extensión de las variantes
+FORMATOS_IMAGEN = {
+    'webp': ('WEBP', {'quality': 75, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 80, 'optimize': True, 'progressive': True}),
+}
+
+# Ejecutable de ffmpeg para los audios (None: los audios se sirven como se subieron)
+FFMPEG = getattr(settings, 'MEDIOS_FFMPEG', None) or shutil.which('ffmpeg')
+
+# Segundos máximos de ffmpeg por archivo
+FFMPEG_TIEMPO_MAX = 120
+
+# Estados en caché de los derivados de un archivo
+LISTO = 'listo'
+PENDIENTE = 'pendiente'
+FALLIDO = 'fallido'
+
+# Cuánto duran en caché los estados: un pendiente que se perdió (por ejemplo,
+# al reiniciar el proceso) y un fallido se vuelven a intentar después
+SEGUNDOS_ESTADO = {LISTO: 30 * 24 * 60 * 60, PENDIENTE: 10 * 60, FALLIDO: 24 * 60 * 60}
+
+# Un archivo escrito o vuelto a subir hace menos de esto (segundos) no se recolecta:
+# la fila que lo va a usar puede no estar guardada todavía
+GRACIA_RECOLECCION = getattr(settings, 'MEDIOS_GRACIA_RECOLECCION', 15 * 60)
+
+# Nombres por consulta al buscar referencias
+TAMANO_LOTE_RECOLECCION = 1000
+
+# Nombre de un derivado en el almacenamiento por contenido (hash SHA-256 del original)
+PATRON_DERIVADO = re.compile(r'[0-9a-f]{64}\.(\d+w\.(%s)|normalizado\.mp3)' % '|'.join(FORMATOS_IMAGEN))
+
+
+def nombre_variante(nombre, ancho, extension):
+    base, _ = os.path.splitext(nombre)
+    return f'{base}.{ancho}w.{extension}'
+
+
+def nombre_audio_normalizado(nombre):
+    base, _ = os.path.splitext(nombre)
+    return f'{base}.normalizado.mp3'
+
+
+def _es_audio(nombre):
+    return nombre.startswith('audios/')
+
+
+def nombres_derivados(nombre):
+    if _es_audio(nombre):
+        return [nombre_audio_normalizado(nombre)]
+    return [nombre_variante(nombre, ancho, extension) for ancho in ANCHOS_IMAGEN for extension in FORMATOS_IMAGEN]
+
+
+def es_derivado(nombre):
+    """
+    True si el nombre es el de un derivado de un original nombrado por su
+    contenido. Los originales subidos antes (por ejemplo, foto.640w.jpg) no lo son.
+    """
+    return PATRON_DERIVADO.fullmatch(os.path.basename(nombre)) is not None
+
+
+def _ultimo_derivado(nombre):
+    """
+    Nombre del último derivado que se guarda: si existe, están todos.
+    """
+    if _es_audio(nombre):
+        return nombre_audio_normalizado(nombre)
+    return nombre_variante(nombre, ANCHOS_IMAGEN[-1], 'webp')
+
+
+def _clave(nombre):
+    """
+    Clave del estado del archivo: su nombre y la fecha en que se escribió el
+    original. Lanza FileNotFoundError si el original no existe.
+    """
+    version = almacenamiento_medios.get_modified_time(nombre).timestamp()
+    # Los nombres de archivo pueden tener espacios y ser largos (memcached no los acepta como clave)
+    return f'medios:{hashlib.md5(nombre.encode()).hexdigest()}:{version}'
+
+
+def _baraja_id(campo):
+    """
+    Baraja cuyos fragmentos muestran el archivo (el de una tarjeta o la portada de una baraja).
+    """
+    instancia = campo.instance
+    return getattr(instancia, 'baraja_id', None) or instancia.pk
+
+
+def estado(campo):
+    """
+    Retorna: LISTO si los derivados del archivo ya existen. Si no (y no se
+    están generando ni fallaron hace poco), encola su generación.
+    """
+    nombre = campo.name
+    try:
+        clave = _clave(nombre)
+    except FileNotFoundError:
+        # Sin original no hay derivados que generar (se sirve su URL, como siempre)
+        return FALLIDO
+    valor = cache.get(clave)
+    if valor is not None:
+        return valor
+
+    if campo.storage.exists(_ultimo_derivado(nombre)):
+        valor = LISTO
+    else:
+        valor = PENDIENTE
+        if _es_audio(nombre) and not FFMPEG:
+            valor = FALLIDO
+        else:
+            generador.agregar(nombre, _baraja_id(campo))
+    cache.set(clave, valor, SEGUNDOS_ESTADO[valor])
+    return valor
+
+
+def url_imagen(campo, ancho, extension='jpg'):
+    """
+    Retorna: URL de la variante más chica de al menos ancho px (o la más grande
+    si ninguna alcanza), o la del original si los derivados no están listos.
+    None si no hay imagen.
+    """
+    if not campo:
+        return None
+    if estado(campo) != LISTO:
+        return campo.url
+    elegido = next((a for a in ANCHOS_IMAGEN if a >= ancho), ANCHOS_IMAGEN[-1])
+    return campo.storage.url(nombre_variante(campo.name, elegido, extension))
+
+
+def srcset_imagen(campo, extension='webp'):
+    """
+    Retorna: atributo srcset con todas las variantes ("url 320w, url 640w, ...")
+    para que el navegador elija la más chica que le sirve, o None si no están listas.
+    """
+    if not campo or estado(campo) != LISTO:
+        return None
+    return ', '.join(
+        f'{campo.storage.url(nombre_variante(campo.name, ancho, extension))} {ancho}w'
+        for ancho in ANCHOS_IMAGEN
+    )
+
+
+def url_audio(campo):
+    """
+    Retorna: URL del audio normalizado, la del original si no está listo, o None si no hay audio.
+    """
+    if not campo:
+        return None
+    if estado(campo) != LISTO:
+        return campo.url
+    return campo.storage.url(nombre_audio_normalizado(campo.name))
+
+
+def _guardar(storage, nombre, contenido):
+    # Con el nombre que le corresponde al derivado (no el de su contenido), reemplazando uno viejo
+    storage.guardar_con_nombre(nombre, ContentFile(contenido))
+
+
+def generar_imagen(nombre, storage=almacenamiento_medios):
+    """
+    Guarda las variantes de la imagen: cada ancho en cada formato de FORMATOS_IMAGEN.
+    """
+    with storage.open(nombre, 'rb') as archivo:
+        original = Image.open(archivo)
+        original.load()
+    # Respetar la orientación de las fotos de celulares (EXIF)
+    original = ImageOps.exif_transpose(original)
+    if original.mode not in ('RGB', 'RGBA'):
+        original = original.convert('RGBA' if 'transparency' in original.info or original.mode in ('LA', 'PA') else 'RGB')
+
+    opaca = original
+    if original.mode == 'RGBA':
+        # JPEG no tiene transparencia: se pone fondo blanco
+        opaca = Image.new('RGB', original.size, 'white')
+        opaca.paste(original, mask=original.getchannel('A'))
+
+    # El último derivado de _ultimo_derivado (el más ancho en WebP) se guarda al final
+    for ancho in ANCHOS_IMAGEN:
+        for extension in sorted(FORMATOS_IMAGEN, key=lambda e: e == 'webp'):
+            formato, opciones = FORMATOS_IMAGEN[extension]
+            variante = (opaca if formato == 'JPEG' else original).copy()
+            variante.thumbnail((ancho, variante.height), Image.Resampling.LANCZOS)
+            salida = io.BytesIO()
+            variante.save(salida, formato, **opciones)
+            _guardar(storage, nombre_variante(nombre, ancho, extension), salida.getvalue())
+
+
+def generar_audio(nombre, storage=almacenamiento_medios):
+    """
+    Guarda el audio normalizado en volumen (EBU R128), mono y en MP3 de 64 kbps.
+    """
+    with storage.open(nombre, 'rb') as archivo:
+        contenido = archivo.read()
+    resultado = subprocess.run(
+        [FFMPEG, '-hide_banner', '-loglevel', 'error', '-i', 'pipe:0',
+         '-vn', '-af', 'loudnorm', '-ac', '1', '-c:a', 'libmp3lame', '-b:a', '64k', '-f', 'mp3', 'pipe:1'],
+        input=contenido, capture_output=True, timeout=FFMPEG_TIEMPO_MAX, check=True
+    )
+    _guardar(storage, nombre_audio_normalizado(nombre), resultado.stdout)
+
+
+def referenciados(nombres):
+    """
+    Retorna: los nombres (de la lista nombres) que alguna tarjeta o baraja todavía usa.
+    """
+    usados = set()
+    for campo, modelo in (('imagen', Tarjeta), ('audio', Tarjeta), ('portada', Baraja)):
+        usados.update(modelo.objects.filter(**{f'{campo}__in': nombres}).values_list(campo, flat=True))
+    return usados
+
+
+def borrar(nombre):
+    """
+    Borra un archivo y sus derivados. Su estado en caché no se borra: la
+    clave incluye la fecha del original, así que si se vuelve a subir es otra.
+    """
+    for archivo in [nombre, *nombres_derivados(nombre)]:
+        almacenamiento_medios.delete(archivo)
+
+
+def recolectar(nombres, gracia=GRACIA_RECOLECCION):
+    """
+    Borra los archivos de nombres que ya no usa ninguna fila (y sus derivados),
+    salvo los escritos hace menos de gracia segundos.
+    Retorna: cantidad de archivos borrados
+    """
+    nombres = sorted({nombre for nombre in nombres if nombre})
+    borrados = 0
+    for i in range(0, len(nombres), TAMANO_LOTE_RECOLECCION):
+        lote = nombres[i:i + TAMANO_LOTE_RECOLECCION]
+        for nombre in set(lote) - referenciados(lote):
+            if almacenamiento_medios.exists(nombre) and almacenamiento_medios.antiguedad(nombre) < gracia:
+                continue
+            borrar(nombre)
+            borrados += 1
+    return borrados
+
+
+# Archivos de filas borradas en la transacción actual de cada hilo
+_por_recolectar = threading.local()
+
+
+def programar_recoleccion(nombres):
+    """
+    Recolecta los archivos de nombres cuando se confirme la transacción actual.
+    Los de muchas filas borradas juntas (por ejemplo, en cascada) se revisan juntos.
+    """
+    pendientes = _por_recolectar.__dict__.setdefault('nombres', set())
+    pendientes.update(nombre for nombre in nombres if nombre)
+    if pendientes:
+        transaction.on_commit(_recolectar_pendientes)
+
+
+def _recolectar_pendientes():
+    nombres = getattr(_por_recolectar, 'nombres', None)
+    if not nombres:
+        return
+    # Si la transacción se revirtió, sus nombres se revisan en la siguiente (siguen en uso: no se borran)
+    _por_recolectar.nombres = set()
+    try:
+        recolectar(nombres)
+    except Exception:
+        logger.exception('No se pudieron recolectar %d archivos', len(nombres))
+
+
+class GeneradorDerivados:
+    """
+    Cola de archivos sin derivados y el hilo que los genera, de a uno.
+    """
+    def __init__(self):
+        self._cola = queue.SimpleQueue()
+        self._hilo = None
+        self._candado_hilo = threading.Lock()
+        self._candado_generacion = threading.Lock()
+
+    def agregar(self, nombre, baraja_id):
+        """
+        Encola un archivo (por su nombre en el almacenamiento) de la baraja baraja_id.
+        """
+        self._cola.put((nombre, baraja_id))
+        # Sin segundo plano (por ejemplo, en pruebas) se generan solo al llamar a vaciar()
+        if not getattr(settings, 'MEDIOS_DERIVADOS_EN_SEGUNDO_PLANO', True):
+            return
+        if self._hilo is None or not self._hilo.is_alive():
+            self._iniciar()
+
+    def _iniciar(self):
+        with self._candado_hilo:
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._ejecutar, name='generador-derivados', daemon=True)
+                self._hilo.start()
+
+    def _ejecutar(self):
+        try:
+            while True:
+                trabajo = self._cola.get()
+                if trabajo is None:
+                    break
+                close_old_connections()
+                self._generar(*trabajo)
+        finally:
+            connection.close()
+
+    def _generar(self, nombre, baraja_id):
+        with self._candado_generacion:
+            try:
+                clave = _clave(nombre)
+            except FileNotFoundError:
+                # El original se borró después de encolarlo
+                return
+            try:
+                if _es_audio(nombre):
+                    generar_audio(nombre)
+                else:
+                    generar_imagen(nombre)
+            except Exception:
+                logger.exception('No se pudieron generar los derivados de %s', nombre)
+                cache.set(clave, FALLIDO, SEGUNDOS_ESTADO[FALLIDO])
+                return
+            cache.set(clave, LISTO, SEGUNDOS_ESTADO[LISTO])
+            # Los fragmentos de la baraja guardan URLs: que pasen a usar los derivados
+            fragmentos.tocar_baraja(baraja_id)
+
+    def vaciar(self):
+        """
+        Genera todo lo que esté en la cola, en el hilo actual.
+        """
+        while True:
+            try:
+                trabajo = self._cola.get_nowait()
+            except queue.Empty:
+                break
+            if trabajo is not None:
+                self._generar(*trabajo)
+
+    def detener(self):
+        """
+        Detiene el hilo después del archivo que esté generando. Lo que quede en la
+        cola se pierde: su estado pendiente vence y se vuelve a encolar al mostrarse.
+        """
+        hilo = self._hilo
+        if hilo is not None and hilo.is_alive():
+            self._cola.put(None)
+            hilo.join()
+
+
+# Generador compartido por todo el proceso
+generador = GeneradorDerivados()
+
+atexit.register(generador.detener)
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.7 on 2026-10-17 10:12
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def asignar_propietario(apps, schema_editor):
+    """
+    Las programaciones existentes pasan a pertenecer al propietario de la baraja,
+    que era el único usuario que podía haberlas generado.
+    """
+    Programacion = apps.get_model('core', 'Programacion')
+    Tarjeta = apps.get_model('core', 'Tarjeta')
+
+    propietario = Tarjeta.objects.filter(
+        pk=models.OuterRef('tarjeta_id')
+    ).values('baraja__propietario_id')[:1]
+
+    Programacion.objects.filter(usuario__isnull=True).update(
+        usuario_id=models.Subquery(propietario)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_clase_historialrespuesta_perfilusuario_tarea'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='programacion',
+            name='usuario',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='programaciones', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='programacion',
+            name='tarjeta',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='programaciones', to='core.tarjeta'),
+        ),
+        migrations.RunPython(asignar_propietario, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.7 on 2026-10-17 10:12
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Separada de 0003: PostgreSQL no permite alterar la tabla en la misma
+    # transacción en que se actualizaron sus filas (pending trigger events).
+
+    dependencies = [
+        ('core', '0003_programacion_por_usuario'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='programacion',
+            name='usuario',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='programaciones', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='programacion',
+            constraint=models.UniqueConstraint(fields=('usuario', 'tarjeta'), name='programacion_usuario_tarjeta_unica'),
+        ),
+        migrations.AddIndex(
+            model_name='programacion',
+            index=models.Index(fields=['usuario', 'proximo_estudio'], name='programacion_usuario_fecha'),
+        ),
+    ]
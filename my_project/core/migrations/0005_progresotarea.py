@@ -0,0 +1,63 @@
+# Generated by Django 5.2.7 on 2026-10-17 11:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def materializar_progreso(apps, schema_editor):
+    """
+    Calcula el progreso de todas las clases existentes con una consulta agrupada.
+    """
+    Tarea = apps.get_model('core', 'Tarea')
+    HistorialRespuesta = apps.get_model('core', 'HistorialRespuesta')
+    ProgresoTarea = apps.get_model('core', 'ProgresoTarea')
+    
+    conteos = {
+        (alumno_id, tarea_id): estudiadas
+        for alumno_id, tarea_id, estudiadas in HistorialRespuesta.objects.filter(
+            usuario__clases_alumno__tareas=models.F('tarjeta__baraja__tareas'),
+            fecha_respuesta__gte=models.F('tarjeta__baraja__tareas__fecha_creacion')
+        ).values_list('usuario_id', 'tarjeta__baraja__tareas').annotate(
+            estudiadas=models.Count('tarjeta', distinct=True)
+        ).order_by()
+    }
+    
+    celdas = (
+        ProgresoTarea(
+            tarea_id=tarea_id,
+            alumno_id=alumno_id,
+            tarjetas_estudiadas=conteos.get((alumno_id, tarea_id), 0)
+        )
+        for tarea_id, alumno_id in Tarea.objects.filter(
+            clase__alumnos__isnull=False
+        ).values_list('id', 'clase__alumnos')
+    )
+    ProgresoTarea.objects.bulk_create(celdas, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_programacion_usuario_indices'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+    
+    operations = [
+        migrations.CreateModel(
+            name='ProgresoTarea',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tarjetas_estudiadas', models.IntegerField(default=0)),
+                ('fecha_actualizacion', models.DateTimeField(auto_now=True)),
+                ('alumno', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='progresos_tarea', to=settings.AUTH_USER_MODEL)),
+                ('tarea', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='progresos', to='core.tarea')),
+            ],
+            options={
+                'verbose_name': 'Progreso de Tarea',
+                'verbose_name_plural': 'Progresos de Tareas',
+                'constraints': [models.UniqueConstraint(fields=('tarea', 'alumno'), name='progreso_tarea_alumno_unico')],
+            },
+        ),
+        migrations.RunPython(materializar_progreso, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.7 on 2026-10-17 12:25
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_progresotarea'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportacionCSV',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('archivo', models.FileField(upload_to='importaciones/')),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('procesando', 'Procesando'), ('completada', 'Completada'), ('error', 'Error')], default='pendiente', max_length=20)),
+                ('tamano_bytes', models.BigIntegerField(default=0)),
+                ('bytes_procesados', models.BigIntegerField(default=0)),
+                ('filas_procesadas', models.IntegerField(default=0)),
+                ('tarjetas_creadas', models.IntegerField(default=0)),
+                ('errores', models.JSONField(blank=True, default=list)),
+                ('mensaje_error', models.TextField(blank=True)),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('fecha_actualizacion', models.DateTimeField(auto_now=True)),
+                ('baraja', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='importaciones', to='core.baraja')),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='importaciones', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Importación CSV',
+                'verbose_name_plural': 'Importaciones CSV',
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.7 on 2026-10-17 13:05
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_importacioncsv'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tarjeta',
+            name='busqueda',
+            field=models.GeneratedField(db_persist=True, expression=django.contrib.postgres.search.CombinedSearchVector(django.contrib.postgres.search.CombinedSearchVector(django.contrib.postgres.search.SearchVector('anverso', config='spanish', weight='A'), '||', django.contrib.postgres.search.SearchVector('reverso', config='spanish', weight='B'), django.contrib.postgres.search.SearchConfig('spanish')), '||', django.contrib.postgres.search.SearchVector('etiquetas', config='spanish', weight='C'), django.contrib.postgres.search.SearchConfig('spanish')), output_field=django.contrib.postgres.search.SearchVectorField()),
+        ),
+        migrations.AddIndex(
+            model_name='tarjeta',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['busqueda'], name='tarjeta_busqueda_gin'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.7 on 2026-10-17 13:50
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_tarjeta_busqueda'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tarjeta',
+            name='lista_etiquetas',
+            field=models.GeneratedField(db_persist=True, expression=models.Func(models.Func(django.db.models.functions.text.Lower(django.db.models.functions.text.Trim('etiquetas')), models.Value('\\s*,\\s*'), function='regexp_split_to_array'), models.Value(''), function='array_remove'), output_field=django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=500), size=None)),
+        ),
+        migrations.AddIndex(
+            model_name='tarjeta',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['lista_etiquetas'], name='tarjeta_etiquetas_gin'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.7 on 2026-10-17 19:14
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_tarjeta_lista_etiquetas'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendientesDiarios',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('pendientes', models.IntegerField(default=0)),
+                ('baraja', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pendientes_diarios', to='core.baraja')),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pendientes_diarios', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Pendientes Diarios',
+                'verbose_name_plural': 'Pendientes Diarios',
+                'constraints': [models.UniqueConstraint(fields=('usuario', 'fecha', 'baraja'), name='pendientes_usuario_fecha_baraja_unico')],
+            },
+        ),
+    ]
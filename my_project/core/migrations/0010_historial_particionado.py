@@ -0,0 +1,189 @@
+# Generated by Django 5.2.7 on 2026-10-17 19:16
+
+import django.db.models.deletion
+from datetime import date
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+TABLA = 'core_historialrespuesta'
+
+# Meses futuros con partición creada desde el inicio (después lo hace mantener_historial)
+MESES_ADELANTE = 3
+
+
+def _sumar_meses(mes, cantidad):
+    indice = mes.year * 12 + mes.month - 1 + cantidad
+    return date(indice // 12, indice % 12 + 1, 1)
+
+
+def particionar_historial(apps, schema_editor):
+    """
+    Convierte core_historialrespuesta en una tabla particionada por mes de
+    fecha_respuesta, copiando las filas existentes.
+
+    PostgreSQL exige que la clave primaria incluya la columna de partición,
+    así que pasa a ser (id, fecha_respuesta); para Django id sigue siendo la
+    clave primaria (la identidad garantiza que es única).
+    """
+    ejecutar = schema_editor.execute
+
+    # Apartar la tabla actual (y los nombres de su clave primaria y secuencia)
+    ejecutar(f'ALTER TABLE {TABLA} RENAME TO {TABLA}_antigua')
+    ejecutar(f'ALTER TABLE {TABLA}_antigua RENAME CONSTRAINT {TABLA}_pkey TO {TABLA}_antigua_pkey')
+    ejecutar(f'ALTER TABLE {TABLA}_antigua ALTER COLUMN id DROP IDENTITY')
+
+    ejecutar(f"""
+        CREATE TABLE {TABLA} (
+            id bigint GENERATED BY DEFAULT AS IDENTITY,
+            calificacion integer NOT NULL,
+            fecha_respuesta timestamp with time zone NOT NULL,
+            tiempo_respuesta_segundos integer NOT NULL,
+            tarjeta_id bigint NOT NULL,
+            usuario_id integer NOT NULL,
+            PRIMARY KEY (id, fecha_respuesta)
+        ) PARTITION BY RANGE (fecha_respuesta)
+    """)
+
+    # Una partición por mes, desde la respuesta más antigua hasta unos meses adelante
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'SELECT min(fecha_respuesta) FROM {TABLA}_antigua')
+        primera = cursor.fetchone()[0]
+
+    actual = timezone.now().date().replace(day=1)
+    mes = min(primera.date().replace(day=1), actual) if primera else actual
+    ultimo = _sumar_meses(actual, MESES_ADELANTE)
+    while mes <= ultimo:
+        siguiente = _sumar_meses(mes, 1)
+        ejecutar(
+            f"CREATE TABLE {TABLA}_p{mes.year:04d}_{mes.month:02d} PARTITION OF {TABLA} "
+            f"FOR VALUES FROM ('{mes.isoformat()} 00:00+00') TO ('{siguiente.isoformat()} 00:00+00')"
+        )
+        mes = siguiente
+    ejecutar(f'CREATE TABLE {TABLA}_default PARTITION OF {TABLA} DEFAULT')
+
+    ejecutar(f"""
+        INSERT INTO {TABLA} (id, calificacion, fecha_respuesta, tiempo_respuesta_segundos, tarjeta_id, usuario_id)
+        SELECT id, calificacion, fecha_respuesta, tiempo_respuesta_segundos, tarjeta_id, usuario_id
+        FROM {TABLA}_antigua
+    """)
+    ejecutar(
+        f"SELECT setval(pg_get_serial_sequence('{TABLA}', 'id'), coalesce(max(id), 0) + 1, false) FROM {TABLA}"
+    )
+    ejecutar(f'DROP TABLE {TABLA}_antigua')
+
+    # Índices compuestos, después de copiar los datos (se crean en cada partición automáticamente)
+    ejecutar(f'CREATE INDEX historial_usuario_fecha ON {TABLA} (usuario_id, fecha_respuesta)')
+    ejecutar(f'CREATE INDEX historial_tarjeta_usuario ON {TABLA} (tarjeta_id, usuario_id)')
+
+    # Las llaves foráneas se agregan al final: validarlas de una vez es más rápido
+    # que fila por fila, y sus triggers diferidos impedirían crear los índices
+    ejecutar(
+        f'ALTER TABLE {TABLA} ADD CONSTRAINT {TABLA}_tarjeta_id_fk_core_tarjeta_id '
+        'FOREIGN KEY (tarjeta_id) REFERENCES core_tarjeta (id) DEFERRABLE INITIALLY DEFERRED'
+    )
+    ejecutar(
+        f'ALTER TABLE {TABLA} ADD CONSTRAINT {TABLA}_usuario_id_fk_auth_user_id '
+        'FOREIGN KEY (usuario_id) REFERENCES auth_user (id) DEFERRABLE INITIALLY DEFERRED'
+    )
+
+
+def deshacer_particion(apps, schema_editor):
+    """
+    Vuelve a una tabla normal con las filas de todas las particiones, la clave
+    primaria id y los índices que Django creaba para las llaves foráneas.
+    """
+    ejecutar = schema_editor.execute
+
+    ejecutar(f'ALTER TABLE {TABLA} RENAME TO {TABLA}_particionada')
+    ejecutar(f'ALTER TABLE {TABLA}_particionada RENAME CONSTRAINT {TABLA}_pkey TO {TABLA}_particionada_pkey')
+    ejecutar(f'ALTER TABLE {TABLA}_particionada ALTER COLUMN id DROP IDENTITY')
+    ejecutar(f"""
+        CREATE TABLE {TABLA} (
+            id bigint GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            calificacion integer NOT NULL,
+            fecha_respuesta timestamp with time zone NOT NULL,
+            tiempo_respuesta_segundos integer NOT NULL,
+            tarjeta_id bigint NOT NULL,
+            usuario_id integer NOT NULL
+        )
+    """)
+    ejecutar(f"""
+        INSERT INTO {TABLA} (id, calificacion, fecha_respuesta, tiempo_respuesta_segundos, tarjeta_id, usuario_id)
+        SELECT id, calificacion, fecha_respuesta, tiempo_respuesta_segundos, tarjeta_id, usuario_id
+        FROM {TABLA}_particionada
+    """)
+    ejecutar(
+        f"SELECT setval(pg_get_serial_sequence('{TABLA}', 'id'), coalesce(max(id), 0) + 1, false) FROM {TABLA}"
+    )
+    # Borra también todas las particiones y sus índices
+    ejecutar(f'DROP TABLE {TABLA}_particionada')
+
+    ejecutar(f'CREATE INDEX {TABLA}_tarjeta_id_3e827d40 ON {TABLA} (tarjeta_id)')
+    ejecutar(f'CREATE INDEX {TABLA}_usuario_id_cd35ef5c ON {TABLA} (usuario_id)')
+    ejecutar(
+        f'ALTER TABLE {TABLA} ADD CONSTRAINT {TABLA}_tarjeta_id_fk_core_tarjeta_id '
+        'FOREIGN KEY (tarjeta_id) REFERENCES core_tarjeta (id) DEFERRABLE INITIALLY DEFERRED'
+    )
+    ejecutar(
+        f'ALTER TABLE {TABLA} ADD CONSTRAINT {TABLA}_usuario_id_fk_auth_user_id '
+        'FOREIGN KEY (usuario_id) REFERENCES auth_user (id) DEFERRABLE INITIALLY DEFERRED'
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_pendientesdiarios'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HistorialDiario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('respuestas', models.IntegerField(default=0)),
+                ('otra_vez', models.IntegerField(default=0)),
+                ('dificil', models.IntegerField(default=0)),
+                ('bien', models.IntegerField(default=0)),
+                ('facil', models.IntegerField(default=0)),
+                ('tiempo_total_segundos', models.IntegerField(default=0)),
+                ('tarjeta', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='historial_diario', to='core.tarjeta')),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='historial_diario', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Historial Diario',
+                'verbose_name_plural': 'Historial Diario',
+                'constraints': [models.UniqueConstraint(fields=('usuario', 'fecha', 'tarjeta'), name='historial_diario_usuario_fecha_tarjeta_unico')],
+            },
+        ),
+        # Django no sabe crear tablas particionadas: el estado se declara aquí
+        # y la tabla se rehace con SQL en particionar_historial
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='historialrespuesta',
+                    name='tarjeta',
+                    field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='historial', to='core.tarjeta'),
+                ),
+                migrations.AlterField(
+                    model_name='historialrespuesta',
+                    name='usuario',
+                    field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='historial', to=settings.AUTH_USER_MODEL),
+                ),
+                migrations.AddIndex(
+                    model_name='historialrespuesta',
+                    index=models.Index(fields=['usuario', 'fecha_respuesta'], name='historial_usuario_fecha'),
+                ),
+                migrations.AddIndex(
+                    model_name='historialrespuesta',
+                    index=models.Index(fields=['tarjeta', 'usuario'], name='historial_tarjeta_usuario'),
+                ),
+            ],
+            database_operations=[
+                migrations.RunPython(particionar_historial, deshacer_particion),
+            ],
+        ),
+    ]
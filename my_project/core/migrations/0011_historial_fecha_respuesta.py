@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-17 19:19
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_historial_particionado'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='historialrespuesta',
+            name='fecha_respuesta',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
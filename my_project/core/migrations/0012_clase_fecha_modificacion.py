@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-17 19:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_historial_fecha_respuesta'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='clase',
+            name='fecha_modificacion',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.7 on 2026-10-17 19:32
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def marcar_repasadas(apps, schema_editor):
+    """
+    Marca como ya repasadas las programaciones que no están en su estado
+    inicial (alguna calificación cambia ease_factor, intervalo o repeticiones).
+    La fecha exacta del primer repaso no se conoce: se usa la del último,
+    proximo_estudio - intervalo, que basta para los límites diarios.
+    """
+    Programacion = apps.get_model('core', 'Programacion')
+    ultimo_repaso = models.ExpressionWrapper(
+        models.F('proximo_estudio') - models.F('intervalo'), output_field=models.DateField()
+    )
+    Programacion.objects.filter(
+        models.Q(repeticiones__gt=0) | ~models.Q(ease_factor=2.5) | ~models.Q(intervalo=1)
+    ).update(fecha_primer_repaso=ultimo_repaso, fecha_ultimo_repaso=ultimo_repaso)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_clase_fecha_modificacion'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='perfilusuario',
+            name='limite_nuevas_diarias',
+            field=models.PositiveIntegerField(default=20),
+        ),
+        migrations.AddField(
+            model_name='perfilusuario',
+            name='limite_repasos_diarios',
+            field=models.PositiveIntegerField(default=200),
+        ),
+        migrations.AddField(
+            model_name='programacion',
+            name='fecha_primer_repaso',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='programacion',
+            name='fecha_ultimo_repaso',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.RunPython(marcar_repasadas, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='programacion',
+            index=models.Index(fields=['usuario', 'fecha_ultimo_repaso'], name='programacion_usuario_repaso'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.7 on 2026-10-17 19:42
+
+import core.almacenamiento
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_limites_diarios'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='baraja',
+            name='portada',
+            field=models.ImageField(blank=True, null=True, storage=core.almacenamiento.AlmacenamientoPorContenido(), upload_to='portadas/'),
+        ),
+        migrations.AlterField(
+            model_name='tarjeta',
+            name='audio',
+            field=models.FileField(blank=True, null=True, storage=core.almacenamiento.AlmacenamientoPorContenido(), upload_to='audios/'),
+        ),
+        migrations.AlterField(
+            model_name='tarjeta',
+            name='imagen',
+            field=models.ImageField(blank=True, null=True, storage=core.almacenamiento.AlmacenamientoPorContenido(), upload_to='tarjetas/'),
+        ),
+        migrations.AddIndex(
+            model_name='baraja',
+            index=models.Index(fields=['portada'], name='baraja_portada'),
+        ),
+        migrations.AddIndex(
+            model_name='tarjeta',
+            index=models.Index(fields=['imagen'], name='tarjeta_imagen'),
+        ),
+        migrations.AddIndex(
+            model_name='tarjeta',
+            index=models.Index(fields=['audio'], name='tarjeta_audio'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.7 on 2026-10-17 19:48
+
+import core.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_medios_por_contenido'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='perfilusuario',
+            name='fecha_ultimo_estudio',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='perfilusuario',
+            name='zona_horaria',
+            field=models.CharField(default='UTC', max_length=64, validators=[core.models.validar_zona_horaria]),
+        ),
+    ]
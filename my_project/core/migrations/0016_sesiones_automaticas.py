@@ -0,0 +1,64 @@
+# Generated by Django 5.2.7 on 2026-10-17 19:53
+
+import django.utils.timezone
+from datetime import timedelta
+from django.conf import settings
+from django.db import migrations, models
+
+
+def calcular_fecha_fin(apps, schema_editor):
+    """
+    Las sesiones que ya existían terminan duracion_minutos después de empezar.
+    """
+    Sesion = apps.get_model('core', 'Sesion')
+    duracion = models.ExpressionWrapper(
+        models.F('duracion_minutos') * timedelta(minutes=1), output_field=models.DurationField()
+    )
+    Sesion.objects.update(fecha_fin=models.F('fecha_inicio') + duracion)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_rachas'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MarcaProceso',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=50, unique=True)),
+                ('fecha', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Marca de Proceso',
+                'verbose_name_plural': 'Marcas de Proceso',
+            },
+        ),
+        migrations.AddField(
+            model_name='perfilusuario',
+            name='sesiones_hasta',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='sesion',
+            name='fecha_fin',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='sesion',
+            name='fecha_inicio',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(calcular_fecha_fin, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='sesion',
+            index=models.Index(fields=['usuario', '-fecha_inicio'], name='sesion_usuario_inicio'),
+        ),
+        migrations.AddIndex(
+            model_name='sesion',
+            index=models.Index(fields=['usuario', 'baraja', 'fecha_fin'], name='sesion_usuario_baraja_fin'),
+        ),
+    ]
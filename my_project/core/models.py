@@ -1,6 +1,18 @@
+import zoneinfo
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.contrib.auth.models import User
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.db.models.functions import Lower, Trim
 from django.utils import timezone
+from .almacenamiento import almacenamiento_medios
+
+def validar_zona_horaria(valor):
+    if valor not in zoneinfo.available_timezones():
+        raise ValidationError(f'"{valor}" no es una zona horaria válida')
+
 
 # Modelo de Baraja
 class Baraja(models.Model):
@@ -14,7 +26,7 @@ class Baraja(models.Model):
     titulo = models.CharField(max_length=200)
     descripcion = models.TextField(blank=True)
     visibilidad = models.CharField(max_length=10, choices=VISIBILIDAD_CHOICES, default='privada')
-    portada = models.ImageField(upload_to='portadas/', blank=True, null=True)
+    portada = models.ImageField(upload_to='portadas/', storage=almacenamiento_medios, blank=True, null=True)
     fecha_creacion = models.DateTimeField(auto_now_add=True)
     fecha_modificacion = models.DateTimeField(auto_now=True)
     
@@ -24,6 +36,14 @@ class Baraja(models.Model):
     class Meta:
         verbose_name = 'Baraja'
         verbose_name_plural = 'Barajas'
+        indexes = [
+            # Para saber si un archivo compartido todavía se usa (ver medios.recolectar)
+            models.Index(fields=['portada'], name='baraja_portada'),
+        ]
+
+
+# Configuración de idioma de PostgreSQL para la búsqueda de texto completo
+CONFIGURACION_BUSQUEDA = 'spanish'
 
 
 # Modelo de Tarjeta
@@ -41,10 +61,35 @@ class Tarjeta(models.Model):
     anverso = models.TextField()
     reverso = models.TextField()
     extra = models.TextField(blank=True)
-    imagen = models.ImageField(upload_to='tarjetas/', blank=True, null=True)
-    audio = models.FileField(upload_to='audios/', blank=True, null=True)
+    imagen = models.ImageField(upload_to='tarjetas/', storage=almacenamiento_medios, blank=True, null=True)
+    audio = models.FileField(upload_to='audios/', storage=almacenamiento_medios, blank=True, null=True)
     etiquetas = models.CharField(max_length=500, blank=True, help_text='Separadas por comas')
     fecha_creacion = models.DateTimeField(auto_now_add=True)
+    # Vector de búsqueda de texto completo, calculado por PostgreSQL al guardar la fila
+    busqueda = models.GeneratedField(
+        expression=(
+            SearchVector('anverso', weight='A', config=CONFIGURACION_BUSQUEDA)
+            + SearchVector('reverso', weight='B', config=CONFIGURACION_BUSQUEDA)
+            + SearchVector('etiquetas', weight='C', config=CONFIGURACION_BUSQUEDA)
+        ),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
+    # Etiquetas normalizadas (minúsculas, sin espacios ni vacías), calculadas por PostgreSQL
+    # a partir de "etiquetas": 'Verbos, Básico' -> {'verbos', 'básico'}
+    lista_etiquetas = models.GeneratedField(
+        expression=models.Func(
+            models.Func(
+                Lower(Trim('etiquetas')),
+                models.Value(r'\s*,\s*'),
+                function='regexp_split_to_array'
+            ),
+            models.Value(''),
+            function='array_remove'
+        ),
+        output_field=ArrayField(models.CharField(max_length=500)),
+        db_persist=True,
+    )
     
     def __str__(self):
         return f"{self.baraja.titulo} - {self.anverso[:50]}"
@@ -52,15 +97,26 @@ class Tarjeta(models.Model):
     class Meta:
         verbose_name = 'Tarjeta'
         verbose_name_plural = 'Tarjetas'
+        indexes = [
+            GinIndex(fields=['busqueda'], name='tarjeta_busqueda_gin'),  # Índice de búsqueda de texto completo
+            GinIndex(fields=['lista_etiquetas'], name='tarjeta_etiquetas_gin'),  # Filtros por etiqueta
+            # Para saber si un archivo compartido todavía se usa (ver medios.recolectar)
+            models.Index(fields=['imagen'], name='tarjeta_imagen'),
+            models.Index(fields=['audio'], name='tarjeta_audio'),
+        ]
 
 
-# Modelo de Programación (Scheduler SM-2)
+# Modelo de Programación (Scheduler SM-2) - estado de repaso de cada usuario por tarjeta
 class Programacion(models.Model):
-    tarjeta = models.OneToOneField(Tarjeta, on_delete=models.CASCADE, related_name='programacion')
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='programaciones')  # Usuario que estudia
+    tarjeta = models.ForeignKey(Tarjeta, on_delete=models.CASCADE, related_name='programaciones')
     ease_factor = models.FloatField(default=2.5)  # Factor de facilidad
     intervalo = models.IntegerField(default=1)  # Días hasta próxima revisión
     repeticiones = models.IntegerField(default=0)
     proximo_estudio = models.DateField(default=timezone.now)
+    # Sin primer repaso la tarjeta es nueva para el usuario (cuenta en el límite de nuevas por día)
+    fecha_primer_repaso = models.DateField(null=True, blank=True)
+    fecha_ultimo_repaso = models.DateField(null=True, blank=True)
     
     def __str__(self):
         return f"Programación: {self.tarjeta.anverso[:30]}"
@@ -68,13 +124,24 @@ class Programacion(models.Model):
     class Meta:
         verbose_name = 'Programación'
         verbose_name_plural = 'Programaciones'
+        constraints = [
+            # Una sola programación por usuario y tarjeta
+            models.UniqueConstraint(fields=['usuario', 'tarjeta'], name='programacion_usuario_tarjeta_unica'),
+        ]
+        indexes = [
+            # Índice para buscar las tarjetas pendientes de un usuario por fecha
+            models.Index(fields=['usuario', 'proximo_estudio'], name='programacion_usuario_fecha'),
+            # Índice para contar los repasos y tarjetas nuevas del día (límites diarios)
+            models.Index(fields=['usuario', 'fecha_ultimo_repaso'], name='programacion_usuario_repaso'),
+        ]
 
 
 # Modelo de Sesión de Estudio
 class Sesion(models.Model):
     usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sesiones')
     baraja = models.ForeignKey(Baraja, on_delete=models.CASCADE, related_name='sesiones')
-    fecha_inicio = models.DateTimeField(auto_now_add=True)
+    fecha_inicio = models.DateTimeField(default=timezone.now)  # Primera respuesta (ver core/sesiones.py)
+    fecha_fin = models.DateTimeField(default=timezone.now)  # Última respuesta
     duracion_minutos = models.IntegerField(default=0)
     tarjetas_estudiadas = models.IntegerField(default=0)
     
@@ -84,6 +151,12 @@ class Sesion(models.Model):
     class Meta:
         verbose_name = 'Sesión'
         verbose_name_plural = 'Sesiones'
+        indexes = [
+            # Sesiones recientes del usuario (dashboard)
+            models.Index(fields=['usuario', '-fecha_inicio'], name='sesion_usuario_inicio'),
+            # Última sesión del usuario en una baraja, para seguirla con nuevas respuestas
+            models.Index(fields=['usuario', 'baraja', 'fecha_fin'], name='sesion_usuario_baraja_fin'),
+        ]
 
 # Modelo de Perfil de Usuario (extiende el User de Django)
 class PerfilUsuario(models.Model):
@@ -99,11 +172,45 @@ class PerfilUsuario(models.Model):
     rol = models.CharField(max_length=20, choices=ROL_CHOICES, default='estudiante')
     idioma = models.CharField(max_length=10, default='es')  # Idioma preferido
     modo_oscuro = models.BooleanField(default=False)  # Preferencia de tema
-    racha_dias = models.IntegerField(default=0)  # Días consecutivos estudiando
+    racha_dias = models.IntegerField(default=0)  # Días consecutivos estudiando (ver core/rachas.py)
+    fecha_ultimo_estudio = models.DateField(null=True, blank=True)  # Último día (local) con respuestas
+    # Zona horaria del usuario: define cuándo empieza su día para la racha
+    zona_horaria = models.CharField(max_length=64, default='UTC', validators=[validar_zona_horaria])
+    limite_nuevas_diarias = models.PositiveIntegerField(default=20)  # Tarjetas nuevas por día
+    limite_repasos_diarios = models.PositiveIntegerField(default=200)  # Repasos por día
+    # Fecha de la última respuesta ya agrupada en sesiones (ver core/sesiones.py)
+    sesiones_hasta = models.DateTimeField(null=True, blank=True)
     
     def __str__(self):
         return f"{self.usuario.username} - {self.rol}"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Valores tal como están en la base de datos, para saber si algo cambió
+        instance._valores_guardados = dict(zip(field_names, values))
+        return instance
+    
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._valores_guardados = {
+            campo.attname: getattr(self, campo.attname) for campo in self._meta.concrete_fields
+        }
+    
+    def campos_modificados(self):
+        """
+        Retorna los nombres de los campos que cambiaron desde que se leyó o guardó el perfil.
+        """
+        guardados = getattr(self, '_valores_guardados', None)
+        if guardados is None:
+            # Perfil que nunca se leyó ni se guardó: todo es nuevo
+            return [campo.attname for campo in self._meta.concrete_fields if not campo.primary_key]
+        
+        return [
+            nombre for nombre, valor in guardados.items()
+            if nombre != 'id' and valor is not models.DEFERRED and getattr(self, nombre) != valor
+        ]
+    
     class Meta:
         verbose_name = 'Perfil de Usuario'
         verbose_name_plural = 'Perfiles de Usuario'
@@ -116,6 +223,8 @@ class Clase(models.Model):
     docente = models.ForeignKey(User, on_delete=models.CASCADE, related_name='clases_docente')  # Profesor que crea la clase
     alumnos = models.ManyToManyField(User, related_name='clases_alumno', blank=True)  # Estudiantes inscritos
     fecha_creacion = models.DateTimeField(auto_now_add=True)
+    # También cambia al cambiar sus alumnos o tareas: es la versión de sus fragmentos en caché
+    fecha_modificacion = models.DateTimeField(auto_now=True)
     codigo_invitacion = models.CharField(max_length=10, unique=True, blank=True)  # Código para unirse a la clase
     
     def __str__(self):
@@ -159,10 +268,11 @@ class HistorialRespuesta(models.Model):
         (4, 'Fácil'),
     ]
     
-    usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='historial')  # Usuario que estudió
-    tarjeta = models.ForeignKey(Tarjeta, on_delete=models.CASCADE, related_name='historial')  # Tarjeta estudiada
+    # Sin índice propio: los índices compuestos de Meta empiezan por estas columnas
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='historial', db_index=False)  # Usuario que estudió
+    tarjeta = models.ForeignKey(Tarjeta, on_delete=models.CASCADE, related_name='historial', db_index=False)  # Tarjeta estudiada
     calificacion = models.IntegerField(choices=CALIFICACION_CHOICES)  # Qué tan bien recordó (1-4)
-    fecha_respuesta = models.DateTimeField(auto_now_add=True)  # Cuándo respondió
+    fecha_respuesta = models.DateTimeField(default=timezone.now)  # Cuándo respondió (clave de partición; se fija al responder aunque se guarde después)
     tiempo_respuesta_segundos = models.IntegerField(default=0)  # Cuánto tardó en responder
     
     def __str__(self):
@@ -171,4 +281,123 @@ class HistorialRespuesta(models.Model):
     class Meta:
         verbose_name = 'Historial de Respuesta'
         verbose_name_plural = 'Historial de Respuestas'
-        ordering = ['-fecha_respuesta']  # Ordenar por más reciente primero
\ No newline at end of file
+        ordering = ['-fecha_respuesta']  # Ordenar por más reciente primero
+        # La tabla está particionada por mes en PostgreSQL (ver core/historial.py);
+        # su clave primaria real es (id, fecha_respuesta)
+        indexes = [
+            # Respuestas de un usuario por rango de fechas (dashboard, rachas)
+            models.Index(fields=['usuario', 'fecha_respuesta'], name='historial_usuario_fecha'),
+            # Respuestas de una tarjeta por usuario (progreso de tareas)
+            models.Index(fields=['tarjeta', 'usuario'], name='historial_tarjeta_usuario'),
+        ]
+
+
+# Modelo de Historial Diario (respuestas antiguas compactadas por usuario, tarjeta y día)
+class HistorialDiario(models.Model):
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='historial_diario')
+    tarjeta = models.ForeignKey(Tarjeta, on_delete=models.CASCADE, related_name='historial_diario')
+    fecha = models.DateField()  # Día de las respuestas
+    respuestas = models.IntegerField(default=0)  # Total de respuestas del día
+    otra_vez = models.IntegerField(default=0)  # Respuestas por calificación
+    dificil = models.IntegerField(default=0)
+    bien = models.IntegerField(default=0)
+    facil = models.IntegerField(default=0)
+    tiempo_total_segundos = models.IntegerField(default=0)  # Suma de tiempo_respuesta_segundos
+    
+    def __str__(self):
+        return f"{self.usuario.username} - {self.tarjeta.anverso[:30]} - {self.fecha}: {self.respuestas}"
+    
+    class Meta:
+        verbose_name = 'Historial Diario'
+        verbose_name_plural = 'Historial Diario'
+        constraints = [
+            models.UniqueConstraint(fields=['usuario', 'fecha', 'tarjeta'], name='historial_diario_usuario_fecha_tarjeta_unico'),
+        ]
+
+
+# Modelo de Progreso de Tarea (reporte materializado de progreso_clase)
+class ProgresoTarea(models.Model):
+    tarea = models.ForeignKey(Tarea, on_delete=models.CASCADE, related_name='progresos')  # Tarea asignada
+    alumno = models.ForeignKey(User, on_delete=models.CASCADE, related_name='progresos_tarea')  # Alumno de la clase
+    tarjetas_estudiadas = models.IntegerField(default=0)  # Tarjetas distintas estudiadas desde que se asignó la tarea
+    fecha_actualizacion = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.alumno.username} - {self.tarea.titulo} - {self.tarjetas_estudiadas}"
+    
+    class Meta:
+        verbose_name = 'Progreso de Tarea'
+        verbose_name_plural = 'Progresos de Tareas'
+        constraints = [
+            models.UniqueConstraint(fields=['tarea', 'alumno'], name='progreso_tarea_alumno_unico'),
+        ]
+
+
+# Modelo de Importación CSV (importaciones grandes procesadas en segundo plano)
+class ImportacionCSV(models.Model):
+    ESTADO_CHOICES = [
+        ('pendiente', 'Pendiente'),
+        ('procesando', 'Procesando'),
+        ('completada', 'Completada'),
+        ('error', 'Error'),
+    ]
+    
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='importaciones')  # Quién importa
+    baraja = models.ForeignKey(Baraja, on_delete=models.CASCADE, related_name='importaciones')  # Baraja de destino
+    archivo = models.FileField(upload_to='importaciones/')
+    estado = models.CharField(max_length=20, choices=ESTADO_CHOICES, default='pendiente')
+    tamano_bytes = models.BigIntegerField(default=0)  # Tamaño del archivo, para calcular el avance
+    bytes_procesados = models.BigIntegerField(default=0)
+    filas_procesadas = models.IntegerField(default=0)
+    tarjetas_creadas = models.IntegerField(default=0)
+    errores = models.JSONField(default=list, blank=True)  # Errores de validación por fila
+    mensaje_error = models.TextField(blank=True)  # Error que detuvo la importación
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    fecha_actualizacion = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.usuario.username} - {self.baraja.titulo} - {self.get_estado_display()}"
+    
+    @property
+    def porcentaje(self):
+        if self.estado == 'completada':
+            return 100
+        if not self.tamano_bytes:
+            return 0
+        return min(round(self.bytes_procesados / self.tamano_bytes * 100, 1), 99.9)
+    
+    class Meta:
+        verbose_name = 'Importación CSV'
+        verbose_name_plural = 'Importaciones CSV'
+
+
+# Modelo de Pendientes Diarios (tarjetas pendientes por usuario, baraja y día)
+class PendientesDiarios(models.Model):
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='pendientes_diarios')
+    baraja = models.ForeignKey(Baraja, on_delete=models.CASCADE, related_name='pendientes_diarios')
+    fecha = models.DateField()  # Día al que corresponde el conteo
+    pendientes = models.IntegerField(default=0)  # Programaciones con proximo_estudio <= fecha
+    
+    def __str__(self):
+        return f"{self.usuario.username} - {self.baraja.titulo} - {self.fecha}: {self.pendientes}"
+    
+    class Meta:
+        verbose_name = 'Pendientes Diarios'
+        verbose_name_plural = 'Pendientes Diarios'
+        constraints = [
+            # Una fila por usuario, día y baraja (el orden sirve para leer todas las barajas de un día)
+            models.UniqueConstraint(fields=['usuario', 'fecha', 'baraja'], name='pendientes_usuario_fecha_baraja_unico'),
+        ]
+
+
+# Modelo de Marca de Proceso (hasta dónde llegó un proceso incremental)
+class MarcaProceso(models.Model):
+    nombre = models.CharField(max_length=50, unique=True)  # Proceso, por ejemplo 'sesiones'
+    fecha = models.DateTimeField(null=True, blank=True)  # Hasta dónde procesó (None: nunca corrió)
+    
+    def __str__(self):
+        return f"{self.nombre}: {self.fecha}"
+    
+    class Meta:
+        verbose_name = 'Marca de Proceso'
+        verbose_name_plural = 'Marcas de Proceso'
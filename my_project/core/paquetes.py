@@ -0,0 +1,181 @@
+"""
+Paquetes de estudio sin conexión y sincronización por diferencias.
+
+El cliente descarga una vez el paquete de una baraja (tarjetas, su
+programación SM-2 y lo que queda de los límites diarios), estudia sin red
+aplicando SM-2 localmente y al terminar la sesión envía todas sus respuestas
+en una sola petición de sincronización. La respuesta solo trae lo que cambió
+desde la versión que tenía el cliente:
+- las tarjetas, completas, solo si la baraja cambió (Baraja.fecha_modificacion
+  es la versión de su contenido, ver core/fragmentos.py)
+- la programación de las tarjetas repasadas desde el día de esa versión
+  (fecha_ultimo_repaso), incluidas las que acaba de enviar, con el valor que
+  calculó el servidor
+
+Cada respuesta puede traer la fecha en que se dio sin conexión: con ella se
+calculan las fechas de SM-2, el historial, la racha y las sesiones. Se acota
+entre la versión del paquete y el momento de la sincronización.
+
+La versión es el instante en que el servidor armó la respuesta, firmado
+(django.core.signing): el cliente no puede inventar una versión vieja para
+atrasar sus respuestas. Los paquetes se envían en JSON o, si el cliente lo pide y el paquete msgpack está
+instalado, en MessagePack (más compacto).
+"""
+import json
+from datetime import datetime
+from django.core import signing
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+from .models import Programacion
+from .scheduler import SchedulerSM2
+from . import fragmentos
+
+try:
+    import msgpack
+except ImportError:  # MessagePack es opcional: sin él solo se usa JSON
+    msgpack = None
+
+TIPO_MSGPACK = 'application/msgpack'
+
+# Columnas de cada fila de programación del paquete (filas como listas, sin repetir las claves)
+CAMPOS_PROGRAMACION = ['tarjeta_id', 'ease_factor', 'intervalo', 'repeticiones', 'proximo_estudio', 'nueva']
+
+
+_firmador_version = signing.Signer(salt='core.paquetes.version')
+
+
+def nueva_version(momento=None):
+    """
+    Retorna: la versión (firmada) del instante momento, por defecto ahora.
+    """
+    return _firmador_version.sign((momento or timezone.now()).isoformat())
+
+
+def leer_fecha(texto):
+    """
+    Retorna: datetime de una fecha ISO 8601 con zona horaria. Lanza ValueError si es inválida.
+    """
+    fecha = datetime.fromisoformat(texto)
+    if timezone.is_naive(fecha):
+        raise ValueError('La fecha debe incluir la zona horaria')
+    return fecha
+
+
+def leer_version(texto):
+    """
+    Retorna: datetime de una versión de nueva_version(). Lanza ValueError si es
+    inválida o su firma no es del servidor.
+    """
+    try:
+        return leer_fecha(_firmador_version.unsign(texto))
+    except signing.BadSignature:
+        raise ValueError('Versión con firma inválida')
+
+
+def _programacion(usuario, baraja, desde=None):
+    """
+    Filas de programación del usuario en la baraja (las repasadas desde la fecha desde, si se indica).
+    """
+    programaciones = Programacion.objects.filter(usuario=usuario, tarjeta__baraja=baraja)
+    if desde is not None:
+        programaciones = programaciones.filter(fecha_ultimo_repaso__gte=desde)
+
+    return {
+        'campos': CAMPOS_PROGRAMACION,
+        'filas': [
+            [tarjeta_id, ease, intervalo, repeticiones, proximo.isoformat(), primer_repaso is None]
+            for tarjeta_id, ease, intervalo, repeticiones, proximo, primer_repaso in programaciones.values_list(
+                'tarjeta_id', 'ease_factor', 'intervalo', 'repeticiones', 'proximo_estudio', 'fecha_primer_repaso'
+            ).order_by('tarjeta_id')
+        ],
+    }
+
+
+def _tarjetas(baraja):
+    """
+    Todas las tarjetas de la baraja serializadas (desde la caché compartida de fragmentos).
+    """
+    tarjeta_ids = list(baraja.tarjetas.order_by('id').values_list('id', flat=True))
+    return fragmentos.tarjetas_estudio(baraja, tarjeta_ids)
+
+
+def _limites(usuario):
+    repasos, nuevas = SchedulerSM2.limites_restantes(usuario)
+    return {'repasos': repasos, 'nuevas': nuevas}
+
+
+def armar_paquete(usuario, baraja):
+    """
+    Retorna: dict con el paquete completo de la baraja para estudiar sin conexión
+    """
+    # La versión se fija antes de leer: lo que cambie mientras tanto llega en la próxima sincronización
+    version = nueva_version()
+    return {
+        'version': version,
+        'baraja': {
+            'id': baraja.id,
+            'titulo': baraja.titulo,
+            'descripcion': baraja.descripcion,
+            'version': baraja.fecha_modificacion.isoformat(),
+        },
+        'tarjetas': _tarjetas(baraja),
+        'programacion': _programacion(usuario, baraja),
+        'limites': _limites(usuario),
+    }
+
+
+def armar_diferencias(usuario, baraja, desde):
+    """
+    Retorna: dict con lo que cambió desde la versión desde (un datetime).
+    'tarjetas' es None si el contenido de la baraja no cambió; si cambió trae
+    todas las tarjetas y el cliente reemplaza las suyas (así también se
+    enteran de las borradas).
+    """
+    version = nueva_version()
+    cambio_contenido = baraja.fecha_modificacion > desde
+    return {
+        'version': version,
+        'baraja': {
+            'id': baraja.id,
+            'titulo': baraja.titulo,
+            'descripcion': baraja.descripcion,
+            'version': baraja.fecha_modificacion.isoformat(),
+        } if cambio_contenido else None,
+        'tarjetas': _tarjetas(baraja) if cambio_contenido else None,
+        # Granularidad de un día: pueden repetirse filas ya enviadas, que el cliente sobrescribe
+        'programacion': _programacion(usuario, baraja, desde=timezone.localdate(desde)),
+        'limites': _limites(usuario),
+    }
+
+
+def pide_msgpack(request):
+    """
+    True si el cliente pide MessagePack (?formato=msgpack o Accept) y está disponible.
+    """
+    pedido = request.GET.get('formato') == 'msgpack' or TIPO_MSGPACK in request.headers.get('Accept', '')
+    return pedido and msgpack is not None
+
+
+def leer_cuerpo(request):
+    """
+    Decodifica el cuerpo de la petición (JSON, o MessagePack según su Content-Type).
+    Lanza ValueError si no se puede decodificar.
+    """
+    if request.content_type == TIPO_MSGPACK:
+        if msgpack is None:
+            raise ValueError('MessagePack no está disponible en el servidor')
+        try:
+            return msgpack.unpackb(request.body)
+        except Exception as error:  # msgpack lanza varias excepciones propias
+            raise ValueError(str(error))
+
+    return json.loads(request.body)
+
+
+def responder(request, datos, status=200):
+    """
+    Respuesta en MessagePack si el cliente lo pide, o en JSON.
+    """
+    if pide_msgpack(request):
+        return HttpResponse(msgpack.packb(datos), content_type=TIPO_MSGPACK, status=status)
+    return JsonResponse(datos, status=status)
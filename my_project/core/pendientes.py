@@ -0,0 +1,164 @@
+"""
+Conteo diario de tarjetas pendientes por usuario y baraja.
+
+PendientesDiarios guarda, para cada usuario y día, cuántas de sus
+programaciones de cada baraja están pendientes (proximo_estudio <= ese día).
+El dashboard y la lista de barajas leen una fila por baraja en lugar de
+recorrer todas las programaciones.
+
+Las filas del día se mantienen de forma incremental: calificar una tarjeta
+pendiente la resta (SM-2 siempre la programa para mañana o después) e
+importar tarjetas las suma. El comando reconstruir_pendientes recalcula
+todo cada noche; si a un usuario le faltan las filas del día, se calculan
+al leerlas. Un usuario sin programaciones no tiene filas: que no tenga
+pendientes se recuerda en la caché hasta que se invalide o cambie el día.
+"""
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+from .models import PendientesDiarios, Programacion
+from .replicas import usar_replica
+
+# Filas que se insertan en cada bulk_create de la reconstrucción
+TAMANO_LOTE = 2000
+
+# Un día: la clave incluye la fecha
+SIN_PENDIENTES_SEGUNDOS = 24 * 60 * 60
+
+
+def _clave_sin_pendientes(usuario_id, hoy):
+    return f'pendientes:vacio:{usuario_id}:{hoy.isoformat()}'
+
+
+def calcular_pendientes(hoy, usuario_id=None):
+    """
+    Cuenta las programaciones pendientes de cada usuario en cada baraja con
+    una consulta agrupada. Incluye los ceros de las barajas con programaciones.
+
+    Retorna: lista de PendientesDiarios sin guardar
+    """
+    programaciones = Programacion.objects.all()
+    if usuario_id is not None:
+        programaciones = programaciones.filter(usuario_id=usuario_id)
+
+    filas = programaciones.values_list('usuario_id', 'tarjeta__baraja_id').annotate(
+        pendientes=Count('id', filter=Q(proximo_estudio__lte=hoy))
+    ).order_by()
+
+    return [
+        PendientesDiarios(usuario_id=uid, baraja_id=baraja_id, fecha=hoy, pendientes=pendientes)
+        for uid, baraja_id, pendientes in filas
+    ]
+
+
+def _guardar(filas):
+    PendientesDiarios.objects.bulk_create(
+        filas,
+        batch_size=TAMANO_LOTE,
+        update_conflicts=True,
+        unique_fields=['usuario', 'fecha', 'baraja'],
+        update_fields=['pendientes']
+    )
+
+
+def reconstruir_pendientes(hoy=None):
+    """
+    Recalcula las filas del día para todos los usuarios y borra las de días anteriores.
+
+    Retorna: cantidad de filas guardadas
+    """
+    hoy = hoy or timezone.localdate()
+    filas = calcular_pendientes(hoy)
+
+    with transaction.atomic():
+        PendientesDiarios.objects.filter(fecha__lt=hoy).delete()
+        # Las barajas que ya no tienen programaciones no deben quedar con un conteo viejo
+        PendientesDiarios.objects.filter(fecha=hoy).delete()
+        _guardar(filas)
+
+    return len(filas)
+
+
+def obtener_pendientes_por_baraja(usuario):
+    """
+    Retorna: dict {baraja_id: tarjetas pendientes hoy} del usuario
+    (las barajas sin programaciones no aparecen).
+    """
+    hoy = timezone.localdate()
+    pendientes = dict(
+        PendientesDiarios.objects.filter(usuario=usuario, fecha=hoy).values_list('baraja_id', 'pendientes')
+    )
+    if pendientes or cache.get(_clave_sin_pendientes(usuario.id, hoy)):
+        return pendientes
+
+    # Aún no hay filas de hoy para el usuario (usuario nuevo, filas invalidadas
+    # o la reconstrucción no corrió): calcularlas solo para él. Desde 'default'
+    # aunque la vista lea de una réplica: lo que se guarda no puede venir atrasado
+    with usar_replica(None):
+        filas = calcular_pendientes(hoy, usuario_id=usuario.id)
+    if filas:
+        _guardar(filas)
+    else:
+        # Sin programaciones: no hay filas que guardar, así que se recuerda en la caché
+        cache.set(_clave_sin_pendientes(usuario.id, hoy), True, SIN_PENDIENTES_SEGUNDOS)
+    return {fila.baraja_id: fila.pendientes for fila in filas}
+
+
+def _sumar(usuario_id, baraja_id, delta):
+    """
+    Suma delta a la fila de hoy. Si no existe, se invalidan las filas del
+    usuario para que la próxima lectura las calcule completas.
+    """
+    actualizadas = PendientesDiarios.objects.filter(
+        usuario_id=usuario_id, fecha=timezone.localdate(), baraja_id=baraja_id
+    ).update(pendientes=F('pendientes') + delta)
+
+    if not actualizadas:
+        invalidar_pendientes([usuario_id])
+
+
+def registrar_respuestas(usuario, pendientes_resueltas):
+    """
+    Resta las tarjetas pendientes que el usuario acaba de calificar.
+
+    Parámetros:
+    - pendientes_resueltas: dict {baraja_id: tarjetas que estaban pendientes hoy}
+    """
+    for baraja_id, cantidad in pendientes_resueltas.items():
+        if cantidad:
+            _sumar(usuario.id, baraja_id, -cantidad)
+
+
+def registrar_importacion(usuario, baraja, pendientes_creadas):
+    """
+    Suma las programaciones pendientes creadas al importar tarjetas.
+    """
+    if pendientes_creadas:
+        _sumar(usuario.id, baraja.id, pendientes_creadas)
+
+
+def invalidar_pendientes(usuario_ids):
+    """
+    Borra las filas de hoy de los usuarios para que se recalculen al leerlas.
+    """
+    hoy = timezone.localdate()
+    PendientesDiarios.objects.filter(usuario_id__in=usuario_ids, fecha=hoy).delete()
+    cache.delete_many([_clave_sin_pendientes(usuario_id, hoy) for usuario_id in usuario_ids])
+
+
+def invalidar_baraja(baraja_id):
+    """
+    Invalida las filas de hoy de todos los usuarios que tienen conteo en la baraja.
+
+    Retorna: lista con los ids de esos usuarios, cuyas estadísticas en caché
+    también quedan viejas
+    """
+    hoy = timezone.localdate()
+    usuario_ids = list(
+        PendientesDiarios.objects.filter(baraja_id=baraja_id, fecha=hoy)
+        .values_list('usuario_id', flat=True).distinct()
+    )
+    if usuario_ids:
+        PendientesDiarios.objects.filter(fecha=hoy, usuario_id__in=usuario_ids).delete()
+    return usuario_ids
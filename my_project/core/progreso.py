@@ -0,0 +1,122 @@
+"""
+Reporte de progreso de las clases.
+
+El progreso de cada alumno en cada tarea (tarjetas distintas de la baraja
+estudiadas desde que se asignó la tarea) se guarda materializado en
+ProgresoTarea, una fila por tarea y alumno, y obtener_progreso_clase solo
+lee esas filas. Se recalcula con una sola consulta agrupada, y solo para las
+celdas afectadas:
+
+- al guardar una tarea (señal post_save de Tarea), para todos sus alumnos;
+- cuando alguien se une a la clase (señal m2m de alumnos); al salir, sus
+  filas se borran;
+- cuando un alumno responde tarjetas (registrar_respuestas): calificar_lote
+  y sincronizar_estudio lo hacen en la misma petición, y las respuestas de
+  calificar_respuesta cuando el escritor del historial guarda su lote (el
+  conteo sale del historial, así que antes no estarían).
+"""
+from django.db.models import Count, F
+from .models import HistorialRespuesta, ProgresoTarea, Tarea
+
+
+def calcular_progreso(tareas, alumno_ids):
+    """
+    Cuenta las tarjetas distintas estudiadas por cada alumno en cada tarea.
+    
+    Retorna: dict {(alumno_id, tarea_id): tarjetas_estudiadas} (solo celdas con respuestas)
+    """
+    filas = HistorialRespuesta.objects.filter(
+        usuario_id__in=alumno_ids,
+        tarjeta__baraja__tareas__in=tareas,
+        fecha_respuesta__gte=F('tarjeta__baraja__tareas__fecha_creacion')  # Misma tarea que el filtro anterior
+    ).values_list('usuario_id', 'tarjeta__baraja__tareas').annotate(
+        estudiadas=Count('tarjeta', distinct=True)
+    ).order_by()
+    
+    return {(alumno_id, tarea_id): estudiadas for alumno_id, tarea_id, estudiadas in filas}
+
+
+def recalcular_progreso(tareas, alumno_ids):
+    """
+    Recalcula y guarda el progreso de los alumnos indicados en las tareas indicadas.
+    Todos los alumnos deben pertenecer a la clase de cada tarea.
+    """
+    tareas = list(tareas)
+    alumno_ids = list(alumno_ids)
+    if not tareas or not alumno_ids:
+        return
+    
+    conteos = calcular_progreso(tareas, alumno_ids)
+    
+    # Se guardan también los ceros para que el reporte tenga todas las celdas
+    ProgresoTarea.objects.bulk_create(
+        [
+            ProgresoTarea(
+                tarea=tarea,
+                alumno_id=alumno_id,
+                tarjetas_estudiadas=conteos.get((alumno_id, tarea.id), 0)
+            )
+            for tarea in tareas
+            for alumno_id in alumno_ids
+        ],
+        update_conflicts=True,
+        unique_fields=['tarea', 'alumno'],
+        update_fields=['tarjetas_estudiadas', 'fecha_actualizacion']
+    )
+
+
+def registrar_respuestas(usuario, tarjeta_ids):
+    """
+    Actualiza el progreso de un alumno después de responder tarjetas.
+    Si las tarjetas no pertenecen a ninguna tarea de sus clases solo cuesta una consulta.
+    """
+    tareas = Tarea.objects.filter(
+        clase__alumnos=usuario,
+        baraja__tarjetas__id__in=tarjeta_ids
+    ).distinct()
+    
+    recalcular_progreso(tareas, [usuario.id])
+
+
+def obtener_progreso_clase(clase):
+    """
+    Lee el reporte materializado de una clase.
+    
+    Retorna: (tareas con total_tarjetas anotado, lista de alumnos con su progreso por tarea)
+    """
+    # Tamaño de cada baraja calculado una sola vez por tarea
+    tareas = list(
+        Tarea.objects.filter(clase=clase)
+        .select_related('baraja')
+        .annotate(total_tarjetas=Count('baraja__tarjetas'))
+        .order_by('id')
+    )
+    
+    progreso = {
+        (alumno_id, tarea_id): estudiadas
+        for alumno_id, tarea_id, estudiadas in ProgresoTarea.objects.filter(
+            tarea__clase=clase
+        ).values_list('alumno_id', 'tarea_id', 'tarjetas_estudiadas')
+    }
+    
+    alumnos_progreso = []
+    for alumno in clase.alumnos.all():
+        progreso_tareas = []
+        for tarea in tareas:
+            estudiadas = progreso.get((alumno.id, tarea.id), 0)
+            total = tarea.total_tarjetas
+            porcentaje = (estudiadas / total * 100) if total > 0 else 0
+            
+            progreso_tareas.append({
+                'tarea': tarea,
+                'estudiadas': estudiadas,
+                'total': total,
+                'porcentaje': round(porcentaje, 1)
+            })
+        
+        alumnos_progreso.append({
+            'alumno': alumno,
+            'progreso_tareas': progreso_tareas
+        })
+    
+    return tareas, alumnos_progreso
@@ -0,0 +1,196 @@
+"""
+Racha de estudio de cada usuario (PerfilUsuario.racha_dias).
+
+La racha se mantiene de forma incremental: la primera respuesta del día
+(local, según PerfilUsuario.zona_horaria) hace un solo UPDATE que la suma
+uno si el último día de estudio fue ayer o la deja en 1 si no, y guarda el
+día en fecha_ultimo_estudio. Las demás respuestas del día no consultan la
+base de datos: la zona horaria y el día ya registrado quedan en caché.
+
+Si el usuario deja de estudiar nadie lo actualiza, así que:
+- racha_vigente() da 0 al leer una racha cuyo último día fue antes de ayer
+- reiniciar_rachas() (comando reiniciar_rachas, cada noche) pone en 0 todas
+  las rachas cortadas con un solo UPDATE
+- recalcular_rachas() (comando recalcular_rachas) calcula todas las rachas
+  desde el historial, en una consulta, para la carga inicial o para corregirlas
+"""
+import zoneinfo
+from datetime import timedelta
+from itertools import islice
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import DateField, ExpressionWrapper, F, Func, Value
+from django.db.models.functions import Cast
+from django.utils import timezone
+from .models import HistorialDiario, HistorialRespuesta, PerfilUsuario
+
+# Dura más que un día en cualquier zona horaria
+CACHE_SEGUNDOS = 2 * 24 * 60 * 60
+
+# Claves de caché borradas por vez al recalcular
+TAMANO_LOTE = 1000
+
+
+def _clave(usuario_id):
+    return f'racha:{usuario_id}'
+
+
+def invalidar_racha(usuario_id):
+    """
+    Borra la caché de la racha (por ejemplo, si cambia la zona horaria del perfil).
+    """
+    cache.delete(_clave(usuario_id))
+
+
+def dia_local(zona_horaria, momento=None):
+    """
+    Retorna: la fecha de momento (por defecto, ahora) en la zona horaria indicada.
+    """
+    return (momento or timezone.now()).astimezone(zoneinfo.ZoneInfo(zona_horaria)).date()
+
+
+def registrar_estudio(usuario_id, momento=None):
+    """
+    Actualiza la racha del usuario al responder una tarjeta. Solo la primera
+    respuesta de cada día escribe (un UPDATE); las demás solo leen la caché.
+    """
+    momento = momento or timezone.now()
+    guardado = cache.get(_clave(usuario_id))
+    if guardado is not None:
+        zona, dia_registrado = guardado
+        if dia_registrado == dia_local(zona, momento):
+            return
+
+    # Un solo UPDATE calcula el día en la zona horaria del perfil y la devuelve para la caché.
+    # Si el día ya estaba registrado (otro proceso) la fila queda igual
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            UPDATE "{PerfilUsuario._meta.db_table}" SET
+                racha_dias = CASE
+                    WHEN fecha_ultimo_estudio >= (timezone(zona_horaria, %s))::date THEN racha_dias
+                    WHEN fecha_ultimo_estudio = (timezone(zona_horaria, %s))::date - 1 THEN racha_dias + 1
+                    ELSE 1
+                END,
+                fecha_ultimo_estudio = greatest(fecha_ultimo_estudio, (timezone(zona_horaria, %s))::date)
+            WHERE usuario_id = %s
+            RETURNING zona_horaria, fecha_ultimo_estudio
+            """,
+            [momento, momento, momento, usuario_id]
+        )
+        fila = cursor.fetchone()
+    if fila is not None:
+        cache.set(_clave(usuario_id), fila, CACHE_SEGUNDOS)
+
+
+def registrar_estudios(usuario_id, momentos):
+    """
+    registrar_estudio para respuestas de distintos momentos (las de una
+    sincronización sin conexión pueden ser de días anteriores): registra cada
+    día una sola vez, del más antiguo al más reciente, para que los días
+    seguidos sumen a la racha.
+    """
+    momentos = sorted(momentos)
+    if not momentos:
+        return
+    registrar_estudio(usuario_id, momentos[0])
+    guardado = cache.get(_clave(usuario_id))
+    if guardado is None:  # Usuario sin perfil
+        return
+
+    zona = guardado[0]
+    dia_anterior = dia_local(zona, momentos[0])
+    for momento in momentos[1:]:
+        dia = dia_local(zona, momento)
+        if dia != dia_anterior:
+            registrar_estudio(usuario_id, momento)
+            dia_anterior = dia
+
+
+def racha_vigente(perfil, momento=None):
+    """
+    Retorna: la racha del perfil, o 0 si se cortó y todavía no pasó reiniciar_rachas().
+    """
+    if perfil.fecha_ultimo_estudio is None:
+        return 0
+    if perfil.fecha_ultimo_estudio < dia_local(perfil.zona_horaria, momento) - timedelta(days=1):
+        return 0
+    return perfil.racha_dias
+
+
+def _hoy_en_zona(momento):
+    """
+    Expresión con el día de momento en la zona horaria de cada perfil.
+    """
+    return Cast(
+        Func(F('zona_horaria'), Value(momento), function='timezone'),
+        output_field=DateField(),
+    )
+
+
+def reiniciar_rachas(momento=None):
+    """
+    Pone en 0 las rachas de los usuarios que no estudiaron ni hoy ni ayer (en su
+    zona horaria), con un solo UPDATE.
+    Retorna: cantidad de rachas reiniciadas
+    """
+    ayer = ExpressionWrapper(_hoy_en_zona(momento or timezone.now()) - timedelta(days=1), output_field=DateField())
+    return PerfilUsuario.objects.filter(racha_dias__gt=0, fecha_ultimo_estudio__lt=ayer).update(racha_dias=0)
+
+
+def recalcular_rachas(momento=None):
+    """
+    Calcula la racha y el último día de estudio de todos los usuarios a partir
+    del historial (el reciente y el compactado por día), en una sola consulta:
+    los días seguidos de cada usuario forman un grupo (día menos su número de
+    orden) y la racha es el tamaño del último grupo, si terminó hoy o ayer.
+    Retorna: cantidad de perfiles actualizados
+    """
+    momento = momento or timezone.now()
+    perfil = PerfilUsuario._meta.db_table
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            WITH dias AS (
+                SELECT h.usuario_id, (h.fecha_respuesta AT TIME ZONE p.zona_horaria)::date AS dia
+                FROM "{HistorialRespuesta._meta.db_table}" h
+                JOIN "{perfil}" p ON p.usuario_id = h.usuario_id
+                UNION
+                SELECT usuario_id, fecha FROM "{HistorialDiario._meta.db_table}"
+            ),
+            grupos AS (
+                SELECT usuario_id, dia,
+                       dia - (row_number() OVER (PARTITION BY usuario_id ORDER BY dia))::int AS grupo
+                FROM dias
+            ),
+            ultimas AS (
+                SELECT DISTINCT ON (usuario_id) usuario_id, max(dia) AS ultimo, count(*) AS racha
+                FROM grupos
+                GROUP BY usuario_id, grupo
+                ORDER BY usuario_id, max(dia) DESC
+            )
+            UPDATE "{perfil}" p
+            SET fecha_ultimo_estudio = u.ultimo,
+                racha_dias = CASE
+                    WHEN u.ultimo >= (%s::timestamptz AT TIME ZONE p.zona_horaria)::date - 1 THEN u.racha
+                    ELSE 0
+                END
+            FROM ultimas u
+            WHERE p.usuario_id = u.usuario_id
+            """,
+            [momento]
+        )
+        actualizados = cursor.rowcount
+        # Usuarios sin respuestas
+        PerfilUsuario.objects.exclude(
+            usuario_id__in=HistorialRespuesta.objects.values('usuario_id')
+        ).exclude(
+            usuario_id__in=HistorialDiario.objects.values('usuario_id')
+        ).update(racha_dias=0, fecha_ultimo_estudio=None)
+
+    # El día en caché puede no estar en el historial todavía (escritor en segundo plano):
+    # la próxima respuesta vuelve a registrar el día sobre la racha recalculada
+    usuario_ids = PerfilUsuario.objects.values_list('usuario_id', flat=True).iterator(chunk_size=TAMANO_LOTE)
+    while lote := list(islice(usuario_ids, TAMANO_LOTE)):
+        cache.delete_many([_clave(usuario_id) for usuario_id in lote])
+    return actualizados
@@ -0,0 +1,163 @@
+"""
+Lecturas en réplicas de la base de datos.
+
+Las vistas de solo lectura más pesadas (reportes, búsqueda, exportación) se
+marcan con el decorador lectura_en_replica (core/decorators.py): durante esa
+petición RouterReplicas manda sus lecturas a una de las réplicas de
+DATABASES_REPLICAS, elegida al azar una vez por petición. Todo lo demás, y
+siempre las escrituras, va a 'default'.
+
+Las réplicas van un poco atrasadas: para que un usuario vea enseguida lo que
+acaba de hacer, FijarPrimariaMiddleware lo fija a 'default' durante
+REPLICAS_FIJAR_PRIMARIA_SEGUNDOS después de cada petición que puede escribir
+(POST, PUT, PATCH, DELETE). La marca está en la caché, que tiene que ser
+compartida por todos los procesos (check --deploy da un error si no, ver
+core/checks.py). Las lecturas dentro de una transacción también van a
+'default' (pueden ser un select_for_update o leer lo que la propia
+transacción escribió), y lo que se guarda a partir de lo leído (los
+pendientes y las estadísticas en caché) se calcula desde 'default'.
+"""
+import random
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Segundos que un usuario lee de 'default' después de escribir
+FIJAR_PRIMARIA_SEGUNDOS = getattr(settings, 'REPLICAS_FIJAR_PRIMARIA_SEGUNDOS', 10)
+
+# Métodos HTTP que no escriben
+METODOS_SEGUROS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+# Réplica de la petición actual (None: todo a 'default')
+_replica_actual = ContextVar('replica_actual', default=None)
+
+
+def alias_replicas():
+    """
+    Retorna: los alias de DATABASES_REPLICAS que están configurados en DATABASES.
+    """
+    return [alias for alias in getattr(settings, 'DATABASES_REPLICAS', []) if alias in settings.DATABASES]
+
+
+def _clave_fijado(usuario_id):
+    return f'replicas:fijado:{usuario_id}'
+
+
+def fijar_primaria(usuario_id):
+    """
+    Manda las lecturas del usuario a 'default' durante FIJAR_PRIMARIA_SEGUNDOS.
+    """
+    cache.set(_clave_fijado(usuario_id), True, FIJAR_PRIMARIA_SEGUNDOS)
+
+
+async def afijar_primaria(usuario_id):
+    await cache.aset(_clave_fijado(usuario_id), True, FIJAR_PRIMARIA_SEGUNDOS)
+
+
+def esta_fijado(usuario_id):
+    return cache.get(_clave_fijado(usuario_id), False)
+
+
+def elegir_replica(request):
+    """
+    Retorna: alias de la réplica para las lecturas de la petición, o None si
+    no hay réplicas o el usuario escribió hace poco.
+    """
+    replicas = alias_replicas()
+    if not replicas:
+        return None
+    if request.user.is_authenticated and esta_fijado(request.user.id):
+        return None
+    return random.choice(replicas)
+
+
+class usar_replica:
+    """
+    Context manager: las lecturas dentro del bloque van a la réplica alias (None: a 'default').
+    """
+    def __init__(self, alias):
+        self.alias = alias
+
+    def __enter__(self):
+        self._token = _replica_actual.set(self.alias)
+
+    def __exit__(self, *exc):
+        _replica_actual.reset(self._token)
+
+
+def iterar_en_replica(alias, contenido):
+    """
+    Recorre contenido (por ejemplo, el de una StreamingHttpResponse, que se
+    genera después de que la vista terminó) leyendo de la réplica alias.
+    """
+    iterador = iter(contenido)
+    while True:
+        # Cada parte puede generarse en otro contexto (con ASGI, en otro hilo)
+        with usar_replica(alias):
+            try:
+                parte = next(iterador)
+            except StopIteration:
+                return
+        yield parte
+
+
+class RouterReplicas:
+    """
+    Router de base de datos (DATABASE_ROUTERS) para las lecturas en réplicas.
+    """
+    def db_for_read(self, model, **hints):
+        alias = _replica_actual.get()
+        if alias is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        # Explícito: si no, Django escribiría un objeto en la base de datos de la que se leyó
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Las réplicas tienen los mismos datos que 'default'
+        bases = {DEFAULT_DB_ALIAS, *alias_replicas()}
+        if obj1._state.db in bases and obj2._state.db in bases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Las réplicas se actualizan desde 'default'
+        if db in alias_replicas():
+            return False
+        return None
+
+
+class FijarPrimariaMiddleware:
+    """
+    Fija a 'default' las lecturas de un usuario después de una petición que
+    puede escribir. Es sync y async (con ASGI no obliga a adaptar la cadena).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.es_async = iscoroutinefunction(get_response)
+        if self.es_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.es_async:
+            return self._acall(request)
+        response = self.get_response(request)
+        if request.method not in METODOS_SEGUROS and alias_replicas() and request.user.is_authenticated:
+            fijar_primaria(request.user.id)
+        return response
+
+    async def _acall(self, request):
+        response = await self.get_response(request)
+        if request.method not in METODOS_SEGUROS and alias_replicas():
+            # auser(): request.user consultaría la base de datos desde el contexto async
+            usuario = await request.auser()
+            if usuario.is_authenticated:
+                await afijar_primaria(usuario.id)
+        return response
@@ -0,0 +1,58 @@
+"""
+Caché del rol de cada usuario.
+
+rol_requerido necesita el rol en cada petición protegida y el rol casi nunca
+cambia. Se guarda en dos niveles: en la propia petición (varias consultas
+dentro de la misma petición no repiten el trabajo) y en la caché de Django.
+Las señales de PerfilUsuario borran la entrada cuando el perfil se guarda o se
+borra (cambiar_rol, registro o el admin).
+
+La caché tiene que ser compartida por todos los procesos (CACHES en
+settings.py): con una caché por proceso, un docente al que se le quita el rol
+seguiría entrando a las vistas de docente en los demás procesos. Por eso
+check --deploy da un error si la caché es LocMemCache (ver core/checks.py).
+"""
+from django.core.cache import cache
+from .models import PerfilUsuario
+
+# Tiempo máximo que un rol puede quedar en caché (por si se cambia con update())
+ROL_CACHE_SEGUNDOS = 5 * 60
+
+# Se guarda en caché para recordar también a los usuarios sin perfil
+SIN_PERFIL = ''
+
+
+def _clave(usuario_id):
+    return f'rol:{usuario_id}'
+
+
+def obtener_rol_usuario(usuario_id):
+    """
+    Retorna el rol del usuario, o None si no tiene perfil.
+    Solo consulta la base de datos si el rol no está en caché.
+    """
+    rol = cache.get(_clave(usuario_id))
+    if rol is None:
+        rol = PerfilUsuario.objects.filter(
+            usuario_id=usuario_id
+        ).values_list('rol', flat=True).first() or SIN_PERFIL
+        cache.set(_clave(usuario_id), rol, ROL_CACHE_SEGUNDOS)
+    
+    return rol or None
+
+
+def obtener_rol(request):
+    """
+    Retorna el rol del usuario de la petición (None si no tiene perfil),
+    calculado una sola vez por petición.
+    """
+    if not hasattr(request, '_rol_usuario'):
+        request._rol_usuario = obtener_rol_usuario(request.user.id)
+    return request._rol_usuario
+
+
+def invalidar_rol(usuario_id):
+    """
+    Borra el rol en caché para que la siguiente petición lo lea de la base de datos.
+    """
+    cache.delete(_clave(usuario_id))
@@ -1,5 +1,33 @@
-from datetime import date, timedelta
-from .models import Programacion
+from collections import namedtuple
+from datetime import date
+from django.db import transaction
+from django.db.models import Count, DateField, Exists, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .etiquetas import filtrar_por_etiquetas
+from .models import PerfilUsuario, Programacion, HistorialRespuesta
+from . import sm2
+
+# Campos que escribe reprogramar (los únicos que escribe guardar_programaciones)
+CAMPOS_SM2 = [
+    'ease_factor', 'intervalo', 'repeticiones', 'proximo_estudio', 'fecha_primer_repaso', 'fecha_ultimo_repaso'
+]
+
+# Límites diarios del perfil, en el orden (repasos, nuevas)
+CAMPOS_LIMITES = ['limite_repasos_diarios', 'limite_nuevas_diarias']
+
+# Límites de los usuarios sin perfil: los valores por defecto del modelo
+LIMITES_POR_DEFECTO = tuple(PerfilUsuario._meta.get_field(campo).default for campo in CAMPOS_LIMITES)
+
+# Posición en la cola de estudio entre un lote y el siguiente: el último repaso
+# entregado (proximo_estudio, ease_factor, tarjeta_id), la última tarjeta nueva
+# entregada y cuánto queda de cada límite diario
+CursorCola = namedtuple(
+    'CursorCola', ['fecha', 'ease', 'repaso_id', 'nueva_id', 'repasos_restantes', 'nuevas_restantes']
+)
+
+# Filas por cada UPDATE de bulk_update al persistir lotes grandes
+TAMANO_LOTE_GUARDADO = 1000
 
 class SchedulerSM2:
     """
@@ -9,78 +37,374 @@ class SchedulerSM2:
     """
     
     @staticmethod
-    def calcular_siguiente_revision(programacion, calificacion):
+    def calcular_siguiente_revision(programacion, calificacion, guardar=True):
         """
         Calcula la próxima fecha de revisión basada en la calificación del usuario.
         
         Parámetros:
         - programacion: objeto Programacion de la tarjeta
         - calificacion: int (1=Otra vez, 2=Difícil, 3=Bien, 4=Fácil)
+        - guardar: si es False solo se actualiza el objeto en memoria (para lotes)
         
         Retorna: objeto Programacion actualizado
         """
+        # Mismo núcleo que los lotes, con un lote de una sola tarjeta
+        SchedulerSM2.reprogramar([programacion], [calificacion])
         
-        # Si la calificación es "Otra vez" (1), reiniciar
-        if calificacion == 1:
-            programacion.repeticiones = 0
-            programacion.intervalo = 1  # Volver a mostrar mañana
-            programacion.ease_factor = max(1.3, programacion.ease_factor - 0.2)  # Reducir facilidad (min 1.3)
-        
-        # Si es "Difícil" (2)
-        elif calificacion == 2:
-            programacion.repeticiones = max(0, programacion.repeticiones - 1)  # Retroceder una repetición
-            programacion.intervalo = max(1, int(programacion.intervalo * 0.5))  # Reducir intervalo a la mitad
-            programacion.ease_factor = max(1.3, programacion.ease_factor - 0.15)  # Reducir facilidad un poco
-        
-        # Si es "Bien" (3) - respuesta correcta con esfuerzo normal
-        elif calificacion == 3:
-            if programacion.repeticiones == 0:
-                programacion.intervalo = 1  # Primera vez: 1 día
-            elif programacion.repeticiones == 1:
-                programacion.intervalo = 6  # Segunda vez: 6 días
-            else:
-                # A partir de la tercera vez: intervalo anterior × ease_factor
-                programacion.intervalo = int(programacion.intervalo * programacion.ease_factor)
+        # Guardar cambios en la base de datos
+        if guardar:
+            programacion.save()
+        
+        return programacion
+    
+    @staticmethod
+    def reprogramar(programaciones, calificaciones, hoy=None):
+        """
+        Aplica SM-2 en memoria a muchas programaciones a la vez (núcleo vectorizado).
+        
+        Parámetros:
+        - programaciones: lista de objetos Programacion (sin repetir)
+        - calificaciones: lista de calificaciones, una por programación y en el mismo orden
+        - hoy: fecha desde la que se cuentan los intervalos (por defecto, hoy)
+        
+        No guarda nada; usar guardar_programaciones para persistir.
+        
+        Retorna: la misma lista de programaciones, actualizadas
+        """
+        if not programaciones:
+            return programaciones
+        
+        ease_factor, intervalo, repeticiones = sm2.calcular_sm2(
+            [p.ease_factor for p in programaciones],
+            [p.intervalo for p in programaciones],
+            [p.repeticiones for p in programaciones],
+            calificaciones
+        )
+        fechas = sm2.calcular_fechas(intervalo, hoy)
+        
+        hoy = hoy or date.today()
+        
+        # tolist() devuelve tipos de Python (float/int), no escalares de NumPy
+        for programacion, ease, dias, reps, fecha in zip(
+            programaciones, ease_factor.tolist(), intervalo.tolist(), repeticiones.tolist(), fechas
+        ):
+            programacion.ease_factor = ease
+            programacion.intervalo = dias
+            programacion.repeticiones = reps
+            programacion.proximo_estudio = fecha
+            # Desde el primer repaso la tarjeta deja de ser nueva (límites diarios)
+            programacion.fecha_primer_repaso = programacion.fecha_primer_repaso or hoy
+            programacion.fecha_ultimo_repaso = hoy
+        
+        return programaciones
+    
+    @staticmethod
+    def guardar_programaciones(programaciones, batch_size=TAMANO_LOTE_GUARDADO):
+        """
+        Persiste con bulk_update el resultado de reprogramar (solo los campos de SM-2).
+        """
+        Programacion.objects.bulk_update(
+            programaciones, CAMPOS_SM2, batch_size=batch_size
+        )
+    
+    @staticmethod
+    def calificar_lote(usuario, respuestas):
+        """
+        Aplica muchas calificaciones SM-2 en una sola transacción.
+        
+        Parámetros:
+        - usuario: User que respondió las tarjetas
+        - respuestas: lista de tuplas (tarjeta_id, calificacion, tiempo_segundos)
+          o (tarjeta_id, calificacion, tiempo_segundos, fecha) de tarjetas que ya
+          se validó que existen. fecha es el datetime en que se respondió (las
+          respuestas dadas sin conexión); sin ella, o si es None, se usa ahora
+        
+        Carga todas las programaciones con una consulta, ejecuta SM-2 vectorizado
+        en memoria y persiste con bulk_create/bulk_update. Los intervalos de cada
+        respuesta se cuentan desde el día en que se dio, y esa es la fecha que
+        queda en el historial.
+        
+        Retorna: (dict {tarjeta_id: Programacion} con el estado final de cada tarjeta,
+                  dict {baraja_id: cantidad de esas tarjetas que estaban pendientes para hoy})
+        """
+        hoy = date.today()
+        ahora = timezone.now()
+        respuestas = [
+            (r[0], r[1], r[2], r[3] if len(r) > 3 and r[3] is not None else ahora)
+            for r in respuestas
+        ]
+        tarjeta_ids = {r[0] for r in respuestas}
+        
+        with transaction.atomic():
+            # Una sola consulta para todas las programaciones del lote (bloqueadas hasta el commit)
+            programaciones = {
+                p.tarjeta_id: p
+                for p in Programacion.objects.select_for_update(of=('self',)).filter(
+                    usuario=usuario, tarjeta_id__in=tarjeta_ids
+                ).annotate(baraja_id=F('tarjeta__baraja_id'))
+            }
+            pendientes_resueltas = {}
+            for p in programaciones.values():
+                if p.proximo_estudio <= hoy:
+                    pendientes_resueltas[p.baraja_id] = pendientes_resueltas.get(p.baraja_id, 0) + 1
             
-            programacion.repeticiones += 1
-            # Mantener ease_factor igual (no cambia con "Bien")
-        
-        # Si es "Fácil" (4) - respuesta muy fácil
-        elif calificacion == 4:
-            if programacion.repeticiones == 0:
-                programacion.intervalo = 4  # Primera vez fácil: 4 días
-            elif programacion.repeticiones == 1:
-                programacion.intervalo = 10  # Segunda vez fácil: 10 días
-            else:
-                # Aumentar intervalo × (ease_factor + bonus)
-                programacion.intervalo = int(programacion.intervalo * (programacion.ease_factor + 0.5))
+            # Crear de golpe las programaciones que aún no existen
+            nuevas = [
+                Programacion(usuario=usuario, tarjeta_id=tarjeta_id, proximo_estudio=hoy)
+                for tarjeta_id in tarjeta_ids
+                if tarjeta_id not in programaciones
+            ]
+            if nuevas:
+                # PostgreSQL devuelve los ids generados, necesarios para el bulk_update
+                Programacion.objects.bulk_create(nuevas)
+                programaciones.update((p.tarjeta_id, p) for p in nuevas)
             
-            programacion.repeticiones += 1
-            programacion.ease_factor = min(3.5, programacion.ease_factor + 0.15)  # Aumentar facilidad (max 2.5)
+            # Ejecutar SM-2 en memoria por rondas: si una tarjeta se respondió
+            # varias veces, la ronda k aplica su k-ésima respuesta (respeta el orden).
+            # Dentro de cada ronda, un lote por día de respuesta
+            rondas = []
+            veces = {}
+            for tarjeta_id, calificacion, _, fecha in respuestas:
+                ronda = veces.get(tarjeta_id, 0)
+                veces[tarjeta_id] = ronda + 1
+                if ronda == len(rondas):
+                    rondas.append({})
+                lote, calificaciones = rondas[ronda].setdefault(timezone.localdate(fecha), ([], []))
+                lote.append(programaciones[tarjeta_id])
+                calificaciones.append(calificacion)
+            
+            for por_dia in rondas:
+                for dia, (lote, calificaciones) in por_dia.items():
+                    SchedulerSM2.reprogramar(lote, calificaciones, dia)
+            
+            SchedulerSM2.guardar_programaciones(list(programaciones.values()))
+            HistorialRespuesta.objects.bulk_create([
+                HistorialRespuesta(
+                    usuario=usuario,
+                    tarjeta_id=tarjeta_id,
+                    calificacion=calificacion,
+                    tiempo_respuesta_segundos=tiempo,
+                    fecha_respuesta=fecha
+                )
+                for tarjeta_id, calificacion, tiempo, fecha in respuestas
+            ])
+        
+        return programaciones, pendientes_resueltas
+    
+    @staticmethod
+    def obtener_tarjetas_pendientes(usuario, baraja, etiquetas=None):
+        """
+        Obtiene las tarjetas que deben estudiarse hoy para una baraja específica.
         
-        # Calcular la próxima fecha de estudio
-        programacion.proximo_estudio = date.today() + timedelta(days=programacion.intervalo)
+        Cada usuario tiene su propia programación: son pendientes las tarjetas
+        cuyo próximo_estudio <= hoy y las que el usuario nunca ha estudiado
+        (estas se consideran con fecha de hoy).
+        Con etiquetas, solo se incluyen las tarjetas que las tienen todas.
         
-        # Guardar cambios en la base de datos
-        programacion.save()
+        Retorna: tarjetas anotadas con proximo_estudio, ordenadas por (proximo_estudio, id)
+        """
+        from .models import Tarjeta
         
-        return programacion
+        hoy = date.today()
+        
+        # Fecha de la programación del usuario para cada tarjeta (usa el índice único usuario+tarjeta)
+        proximo_usuario = Programacion.objects.filter(
+            usuario=usuario, tarjeta=OuterRef('pk')
+        ).values('proximo_estudio')[:1]
+        
+        tarjetas_pendientes = Tarjeta.objects.filter(baraja=baraja).annotate(
+            proximo_estudio=Coalesce(Subquery(proximo_usuario), Value(hoy, output_field=DateField()))
+        ).filter(
+            proximo_estudio__lte=hoy  # Fecha <= hoy
+        ).order_by('proximo_estudio', 'id')
+        
+        return filtrar_por_etiquetas(tarjetas_pendientes, etiquetas)
     
     @staticmethod
-    def obtener_tarjetas_pendientes(usuario, baraja):
+    def limites_restantes(usuario, hoy=None):
         """
-        Obtiene las tarjetas que deben estudiarse hoy para una baraja específica.
+        Retorna: (repasos, nuevas) que el usuario aún puede estudiar hoy según
+        los límites diarios de su perfil
+        """
+        hoy = hoy or date.today()
+        limites = PerfilUsuario.objects.filter(usuario=usuario).values_list(*CAMPOS_LIMITES).first()
+        hechos = Programacion.objects.filter(usuario=usuario, fecha_ultimo_repaso=hoy).aggregate(**_conteos_hoy(hoy))
+        return _restar_limites(limites, hechos)
+    
+    @staticmethod
+    async def alimites_restantes(usuario, hoy=None):
+        """
+        Versión async de limites_restantes.
+        """
+        hoy = hoy or date.today()
+        limites = await PerfilUsuario.objects.filter(usuario=usuario).values_list(*CAMPOS_LIMITES).afirst()
+        hechos = await Programacion.objects.filter(
+            usuario=usuario, fecha_ultimo_repaso=hoy
+        ).aaggregate(**_conteos_hoy(hoy))
+        return _restar_limites(limites, hechos)
+    
+    @staticmethod
+    def obtener_lote_pendientes(usuario, baraja, cursor=None, limite=20, etiquetas=None, campos=None):
+        """
+        Obtiene un lote de la cola de estudio de hoy, usando paginación por clave (keyset).
         
-        Retorna: lista de tarjetas cuyo próximo_estudio <= hoy
+        La cola tiene dos partes, cada una con su límite diario del perfil:
+        - repasos: tarjetas ya estudiadas con próximo_estudio <= hoy, de la más
+          atrasada a la menos, y a igual fecha primero las de menor ease_factor
+        - nuevas: tarjetas que el usuario nunca ha repasado, por orden de creación
+        Las nuevas se intercalan entre los repasos del lote. El orden y el límite
+        los aplica la base de datos (ORDER BY ... LIMIT): solo se cargan las
+        filas del lote.
+        
+        Parámetros:
+        - cursor: CursorCola devuelto por el lote anterior (lleva la posición en
+          cada parte y cuánto queda de cada límite), o None para el primer lote.
+          Lo que queda de cada límite nunca pasa de lo que limites_restantes da
+          para hoy: el cursor viene del cliente y puede estar modificado
+        - limite: cantidad máxima de tarjetas del lote
+        - etiquetas: lista opcional de etiquetas normalizadas para estudiar solo esas tarjetas
+        - campos: lista opcional de campos de Tarjeta a cargar (por defecto todos)
+        
+        Retorna: (lista de tarjetas, cursor del siguiente lote o None si no hay más)
+        """
+        cursor = _limitar_cursor(cursor, SchedulerSM2.limites_restantes(usuario))
+        
+        repasos, nuevas = SchedulerSM2._consultas_cola(usuario, baraja, cursor, limite, etiquetas, campos)
+        return SchedulerSM2._armar_lote(
+            list(repasos) if repasos is not None else [],
+            list(nuevas) if nuevas is not None else [],
+            cursor, limite
+        )
+    
+    @staticmethod
+    async def aobtener_lote_pendientes(usuario, baraja, cursor=None, limite=20, etiquetas=None, campos=None):
+        """
+        Versión async de obtener_lote_pendientes (ORM async, sin ocupar un hilo).
+        """
+        cursor = _limitar_cursor(cursor, await SchedulerSM2.alimites_restantes(usuario))
+        
+        repasos, nuevas = SchedulerSM2._consultas_cola(usuario, baraja, cursor, limite, etiquetas, campos)
+        return SchedulerSM2._armar_lote(
+            [t async for t in repasos] if repasos is not None else [],
+            [t async for t in nuevas] if nuevas is not None else [],
+            cursor, limite
+        )
+    
+    @staticmethod
+    def _consultas_cola(usuario, baraja, cursor, limite, etiquetas, campos):
+        """
+        Retorna: (consulta de repasos, consulta de tarjetas nuevas) del lote,
+        o None en la parte cuyo límite diario ya se alcanzó
         """
         from .models import Tarjeta
         
         hoy = date.today()
+        repasos = nuevas = None
+        
+        if cursor.repasos_restantes > 0:
+            # El filtro y las anotaciones usan el mismo JOIN con la programación del usuario
+            repasos = Tarjeta.objects.filter(
+                baraja=baraja,
+                programaciones__usuario=usuario,
+                programaciones__fecha_primer_repaso__isnull=False,
+                programaciones__proximo_estudio__lte=hoy,
+            ).annotate(
+                proximo_estudio=F('programaciones__proximo_estudio'),
+                ease_factor=F('programaciones__ease_factor'),
+            ).order_by('proximo_estudio', 'ease_factor', 'id')
+            
+            if cursor.fecha is not None:
+                fecha, ease, tarjeta_id = cursor.fecha, cursor.ease, cursor.repaso_id
+                repasos = repasos.filter(
+                    Q(proximo_estudio__gt=fecha)
+                    | Q(proximo_estudio=fecha, ease_factor__gt=ease)
+                    | Q(proximo_estudio=fecha, ease_factor=ease, id__gt=tarjeta_id)
+                )
+            
+            repasos = filtrar_por_etiquetas(repasos, etiquetas)
+            if campos:
+                repasos = repasos.only(*campos)
+            # Una tarjeta de más para saber si existe un lote siguiente
+            repasos = repasos[:min(limite, cursor.repasos_restantes) + 1]
+        
+        if cursor.nuevas_restantes > 0:
+            repasada = Programacion.objects.filter(
+                usuario=usuario, tarjeta=OuterRef('pk'), fecha_primer_repaso__isnull=False
+            )
+            nuevas = Tarjeta.objects.filter(baraja=baraja).filter(~Exists(repasada)).order_by('id')
+            
+            if cursor.nueva_id is not None:
+                nuevas = nuevas.filter(id__gt=cursor.nueva_id)
+            
+            nuevas = filtrar_por_etiquetas(nuevas, etiquetas)
+            if campos:
+                nuevas = nuevas.only(*campos)
+            nuevas = nuevas[:min(limite, cursor.nuevas_restantes) + 1]
+        
+        return repasos, nuevas
+    
+    @staticmethod
+    def _armar_lote(repasos, nuevas, cursor, limite):
+        """
+        Intercala las tarjetas nuevas entre los repasos (una cada tantos repasos
+        como haya por cada nueva) y calcula el cursor del siguiente lote.
+        """
+        repasos = repasos[:cursor.repasos_restantes]
+        nuevas = nuevas[:cursor.nuevas_restantes]
+        cada = max(len(repasos) // len(nuevas), 1) if nuevas else 0
         
-        # Obtener tarjetas de la baraja que tienen programación y están listas para hoy
-        tarjetas_pendientes = Tarjeta.objects.filter(
-            baraja=baraja,
-            programacion__proximo_estudio__lte=hoy  # Fecha <= hoy
-        ).select_related('programacion')  # Optimización: cargar programación en la misma consulta
+        lote = []
+        tomados_repasos = tomadas_nuevas = 0
+        while len(lote) < limite and (tomados_repasos < len(repasos) or tomadas_nuevas < len(nuevas)):
+            toca_nueva = tomadas_nuevas < len(nuevas) and (
+                tomados_repasos >= len(repasos) or tomados_repasos >= (tomadas_nuevas + 1) * cada
+            )
+            if toca_nueva:
+                lote.append(nuevas[tomadas_nuevas])
+                tomadas_nuevas += 1
+            else:
+                lote.append(repasos[tomados_repasos])
+                tomados_repasos += 1
+        
+        if tomados_repasos == len(repasos) and tomadas_nuevas == len(nuevas):
+            return lote, None
         
-        return tarjetas_pendientes
\ No newline at end of file
+        ultimo_repaso = repasos[tomados_repasos - 1] if tomados_repasos else None
+        siguiente = CursorCola(
+            fecha=ultimo_repaso.proximo_estudio if ultimo_repaso else cursor.fecha,
+            ease=ultimo_repaso.ease_factor if ultimo_repaso else cursor.ease,
+            repaso_id=ultimo_repaso.id if ultimo_repaso else cursor.repaso_id,
+            nueva_id=nuevas[tomadas_nuevas - 1].id if tomadas_nuevas else cursor.nueva_id,
+            repasos_restantes=cursor.repasos_restantes - tomados_repasos,
+            nuevas_restantes=cursor.nuevas_restantes - tomadas_nuevas,
+        )
+        return lote, siguiente
+
+
+def _conteos_hoy(hoy):
+    """
+    Agregados de las programaciones repasadas hoy: repasos y tarjetas nuevas.
+    """
+    return {
+        'repasos': Count('id', filter=Q(fecha_primer_repaso__lt=hoy)),
+        'nuevas': Count('id', filter=Q(fecha_primer_repaso=hoy)),
+    }
+
+
+def _limitar_cursor(cursor, limites):
+    """
+    Retorna: el cursor (o uno nuevo, si es None) con lo que queda de cada límite
+    acotado a limites, los (repasos, nuevas) que el usuario aún puede estudiar hoy.
+    """
+    repasos, nuevas = limites
+    if cursor is None:
+        return CursorCola(None, None, None, None, repasos, nuevas)
+    return cursor._replace(
+        repasos_restantes=min(cursor.repasos_restantes, repasos),
+        nuevas_restantes=min(cursor.nuevas_restantes, nuevas),
+    )
+
+
+def _restar_limites(limites, hechos):
+    repasos_max, nuevas_max = limites or LIMITES_POR_DEFECTO
+    return max(repasos_max - hechos['repasos'], 0), max(nuevas_max - hechos['nuevas'], 0)
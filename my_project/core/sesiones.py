@@ -0,0 +1,166 @@
+"""
+Sesiones de estudio a partir del historial de respuestas.
+
+Las respuestas de un usuario en una misma baraja forman una Sesion mientras
+no pasen más de INACTIVIDAD entre una y la siguiente; después de una pausa
+más larga empieza otra sesión. La sesión guarda su primera y última
+respuesta (fecha_inicio, fecha_fin), la duración entre ellas y cuántas
+respuestas tuvo.
+
+Nunca se recorre todo el historial: solo se leen las sesiones de cada
+baraja cercanas a las respuestas nuevas. Hay dos formas de alimentarlo, que
+se pueden usar juntas:
+- al calificar (SESIONES_AL_CALIFICAR): el escritor del historial y
+  calificar_lote pasan sus respuestas a registrar_respuestas() o a
+  agrupar_respuestas(), una sola vez cada una
+- en lote (comando sesionizar): sesionizar() lee del historial las
+  respuestas posteriores a la marca del proceso (MarcaProceso 'sesiones')
+
+Al calificar las respuestas pueden llegar desordenadas (las que el escritor
+del historial tenía en cola, las dadas sin conexión): una respuesta anterior
+a otras ya agrupadas se suma a la sesión de su baraja que la rodea, o forma
+una nueva. PerfilUsuario.sesiones_hasta es la fecha de la respuesta más
+reciente del usuario ya agrupada; el lote, que vuelve a leer respuestas que
+pueden haberse agrupado al calificar, ignora las anteriores a ella.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from itertools import groupby
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import HistorialRespuesta, MarcaProceso, PerfilUsuario, Sesion, Tarjeta
+
+# Agrupar las respuestas al calificar (si no, solo el comando sesionizar)
+AL_CALIFICAR = getattr(settings, 'SESIONES_AL_CALIFICAR', True)
+
+# Pausa máxima entre dos respuestas de la misma sesión
+INACTIVIDAD = timedelta(minutes=getattr(settings, 'SESIONES_INACTIVIDAD_MINUTOS', 30))
+
+# El lote no agrupa las respuestas más recientes que esto: el escritor del
+# historial las guarda unos segundos después de su fecha
+RETRASO = timedelta(minutes=1)
+
+# El lote vuelve a leer este tiempo antes de la marca, por las respuestas
+# guardadas después de la corrida anterior con una fecha anterior a ella
+MARGEN = timedelta(minutes=10)
+
+NOMBRE_MARCA = 'sesiones'
+
+# Respuestas leídas por vez del historial
+TAMANO_LOTE = 2000
+
+CAMPOS_SESION = ['fecha_inicio', 'fecha_fin', 'duracion_minutos', 'tarjetas_estudiadas']
+
+
+def agrupar_respuestas(usuario_id, respuestas, desde_marca=False):
+    """
+    Agrega a las sesiones del usuario sus respuestas [(fecha, baraja_id), ...] ordenadas por fecha.
+    Con desde_marca solo se agrupan las posteriores a sesiones_hasta (las
+    demás ya se agruparon); sin él, todas (son respuestas recién guardadas).
+    Retorna: cantidad de respuestas agrupadas
+    """
+    with transaction.atomic():
+        # Bloquear el perfil: las respuestas de un usuario se agrupan de a una llamada por vez
+        perfiles = PerfilUsuario.objects.select_for_update().filter(usuario_id=usuario_id)
+        marcas = list(perfiles.values_list('sesiones_hasta', flat=True))
+        if not marcas:
+            return 0
+        marca = marcas[0]
+        if desde_marca and marca is not None:
+            respuestas = [r for r in respuestas if r[0] > marca]
+        if not respuestas:
+            return 0
+
+        # Las sesiones de cada baraja que pueden recibir alguna respuesta (una consulta)
+        por_baraja = defaultdict(list)
+        for sesion in Sesion.objects.filter(
+            usuario_id=usuario_id,
+            baraja_id__in={baraja_id for _, baraja_id in respuestas},
+            fecha_fin__gte=respuestas[0][0] - INACTIVIDAD,
+            fecha_inicio__lte=respuestas[-1][0] + INACTIVIDAD,
+        ).order_by('fecha_inicio'):
+            por_baraja[sesion.baraja_id].append(sesion)
+
+        nuevas, modificadas = [], {}
+        for fecha, baraja_id in respuestas:
+            # La sesión a menos de INACTIVIDAD de la respuesta, antes o después (llegó tarde)
+            sesion = next((
+                sesion for sesion in por_baraja[baraja_id]
+                if sesion.fecha_inicio - INACTIVIDAD <= fecha <= sesion.fecha_fin + INACTIVIDAD
+            ), None)
+            if sesion is not None:
+                sesion.fecha_inicio = min(sesion.fecha_inicio, fecha)
+                sesion.fecha_fin = max(sesion.fecha_fin, fecha)
+                sesion.tarjetas_estudiadas += 1
+                if sesion.pk is not None:
+                    modificadas[sesion.pk] = sesion
+            else:
+                sesion = Sesion(
+                    usuario_id=usuario_id, baraja_id=baraja_id,
+                    fecha_inicio=fecha, fecha_fin=fecha, tarjetas_estudiadas=1
+                )
+                nuevas.append(sesion)
+                por_baraja[baraja_id].append(sesion)
+            sesion.duracion_minutos = round((sesion.fecha_fin - sesion.fecha_inicio).total_seconds() / 60)
+
+        if nuevas:
+            Sesion.objects.bulk_create(nuevas)
+        if modificadas:
+            Sesion.objects.bulk_update(modificadas.values(), CAMPOS_SESION)
+        # La marca no retrocede por una respuesta que llegó tarde.
+        # update() y no save(): las señales del perfil borrarían el rol y la racha en caché
+        if marca is None or respuestas[-1][0] > marca:
+            perfiles.update(sesiones_hasta=respuestas[-1][0])
+    return len(respuestas)
+
+
+def registrar_respuestas(respuestas):
+    """
+    Agrupa en sesiones respuestas recién guardadas.
+    respuestas: lista de tuplas (usuario_id, tarjeta_id, fecha_respuesta)
+    Retorna: cantidad de respuestas agrupadas
+    """
+    if not respuestas:
+        return 0
+    # La baraja de cada tarjeta (una consulta); las tarjetas borradas se ignoran
+    barajas = dict(
+        Tarjeta.objects.filter(id__in={tarjeta_id for _, tarjeta_id, _ in respuestas}).values_list('id', 'baraja_id')
+    )
+    por_usuario = defaultdict(list)
+    for usuario_id, tarjeta_id, fecha in respuestas:
+        if tarjeta_id in barajas:
+            por_usuario[usuario_id].append((fecha, barajas[tarjeta_id]))
+
+    return sum(
+        agrupar_respuestas(usuario_id, sorted(lista, key=lambda r: r[0]))
+        for usuario_id, lista in por_usuario.items()
+    )
+
+
+def sesionizar(hasta=None):
+    """
+    Agrupa en sesiones las respuestas del historial guardadas desde la corrida
+    anterior (la primera vez, todo el historial) hasta hasta (por defecto, hace RETRASO).
+    Retorna: cantidad de respuestas agrupadas
+    """
+    hasta = hasta or timezone.now() - RETRASO
+    marca, _ = MarcaProceso.objects.get_or_create(nombre=NOMBRE_MARCA)
+
+    respuestas = HistorialRespuesta.objects.filter(fecha_respuesta__lte=hasta)
+    if marca.fecha is not None:
+        # Con la fecha acotada solo se leen las particiones recientes
+        respuestas = respuestas.filter(fecha_respuesta__gt=marca.fecha - MARGEN)
+    filas = respuestas.order_by('usuario_id', 'fecha_respuesta').values_list(
+        'usuario_id', 'fecha_respuesta', 'tarjeta__baraja_id'
+    ).iterator(chunk_size=TAMANO_LOTE)
+
+    agrupadas = 0
+    for usuario_id, filas_usuario in groupby(filas, key=lambda fila: fila[0]):
+        agrupadas += agrupar_respuestas(
+            usuario_id, [(fecha, baraja_id) for _, fecha, baraja_id in filas_usuario], desde_marca=True
+        )
+
+    marca.fecha = hasta
+    marca.save(update_fields=['fecha'])
+    return agrupadas
@@ -1,7 +1,16 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import PerfilUsuario
+from django.db import transaction
+from django.db.models import QuerySet
+from .models import PerfilUsuario, Baraja, Tarjeta, Clase, Tarea, ProgresoTarea
+from .estadisticas import invalidar_estadisticas
+from .fragmentos import tocar_baraja, tocar_clase
+from .medios import estado as estado_derivados, programar_recoleccion
+from .pendientes import invalidar_baraja
+from .rachas import invalidar_racha
+from .progreso import recalcular_progreso
+from .roles import invalidar_rol
 
 @receiver(post_save, sender=User)
 def crear_perfil_usuario(sender, instance, created, **kwargs):
@@ -18,7 +27,172 @@ def crear_perfil_usuario(sender, instance, created, **kwargs):
 @receiver(post_save, sender=User)
 def guardar_perfil_usuario(sender, instance, **kwargs):
     """
-    Guarda el perfil cuando se guarda el usuario.
+    Guarda el perfil cuando se guarda el usuario, solo si el perfil ya estaba
+    cargado y tiene cambios (el last_login de cada inicio de sesión no lo toca).
     """
-    if hasattr(instance, 'perfil'):
-        instance.perfil.save()
\ No newline at end of file
+    # get_cached_value no consulta la base de datos, a diferencia de hasattr
+    perfil = User.perfil.related.get_cached_value(instance, None)
+    if perfil is None or perfil.pk is None:
+        return
+    
+    campos = perfil.campos_modificados()
+    if campos:
+        perfil.save(update_fields=campos)
+
+def _borrado_en_cascada(sender, origin):
+    """
+    True si la fila se borra porque se borró otra (por ejemplo, las tarjetas de
+    una baraja borrada): lo que depende del padre (versión, estadísticas,
+    pendientes) lo actualiza una sola vez la señal del padre.
+    """
+    if isinstance(origin, QuerySet):
+        return origin.model is not sender
+    return origin is not None and not isinstance(origin, sender)
+
+@receiver(post_delete, sender=PerfilUsuario)
+@receiver(post_save, sender=PerfilUsuario)
+def invalidar_rol_perfil(sender, instance, **kwargs):
+    """
+    Borra el rol en caché cuando cambia o se borra un perfil (cambiar_rol, admin, registro).
+    """
+    invalidar_rol(instance.usuario_id)
+
+@receiver(post_save, sender=PerfilUsuario)
+def invalidar_racha_perfil(sender, instance, **kwargs):
+    """
+    Borra la zona horaria y el día registrado en caché de la racha (pueden haber cambiado).
+    """
+    invalidar_racha(instance.usuario_id)
+
+@receiver(post_delete, sender=Baraja)
+@receiver(post_save, sender=Baraja)
+def invalidar_estadisticas_baraja(sender, instance, **kwargs):
+    """
+    Recalcula las estadísticas del propietario cuando se crea o borra una baraja.
+    """
+    if kwargs.get('created', True):
+        invalidar_estadisticas(instance.propietario_id)
+
+@receiver(post_delete, sender=Tarjeta)
+@receiver(post_save, sender=Tarjeta)
+def invalidar_estadisticas_tarjeta(sender, instance, **kwargs):
+    """
+    Recalcula las estadísticas del propietario cuando se crea o borra una tarjeta
+    fuera de la importación CSV (que actualiza la caché por su cuenta).
+    Al borrar una baraja no se hace por cada tarjeta: lo hace una vez la señal de la baraja.
+    """
+    if not kwargs.get('created', True) or _borrado_en_cascada(sender, kwargs.get('origin')):
+        return
+    # Sin instance.baraja, que consultaría la baraja entera si no está cargada
+    baraja = Tarjeta.baraja.field.get_cached_value(instance, None)
+    if baraja is not None:
+        propietario_id = baraja.propietario_id
+    else:
+        propietario_id = Baraja.objects.filter(pk=instance.baraja_id).values_list('propietario_id', flat=True).first()
+    if propietario_id is not None:
+        invalidar_estadisticas(propietario_id)
+
+@receiver(pre_delete, sender=Tarjeta)
+def invalidar_pendientes_tarjeta(sender, instance, **kwargs):
+    """
+    Al borrar una tarjeta se borran sus programaciones: los usuarios con
+    pendientes en esa baraja los recalculan en la próxima lectura.
+    Al borrar la baraja entera no hace falta: sus filas de PendientesDiarios
+    se borran con ella y las de las demás barajas siguen valiendo.
+    Las estadísticas en caché de esos usuarios (no solo del propietario)
+    incluyen los pendientes borrados, así que también se invalidan.
+    """
+    if not _borrado_en_cascada(sender, kwargs.get('origin')):
+        for usuario_id in invalidar_baraja(instance.baraja_id):
+            invalidar_estadisticas(usuario_id)
+
+@receiver(post_save, sender=Tarea)
+def calcular_progreso_tarea(sender, instance, **kwargs):
+    """
+    Calcula el progreso de todos los alumnos cuando se crea o modifica una tarea.
+    """
+    recalcular_progreso([instance], instance.clase.alumnos.values_list('id', flat=True))
+
+@receiver(m2m_changed, sender=Clase.alumnos.through)
+def actualizar_progreso_alumnos(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Mantiene el reporte de progreso cuando cambian los alumnos de una clase.
+    """
+    if action == 'post_add':
+        if reverse:
+            # user.clases_alumno.add(...): instance es el alumno, pk_set son clases
+            recalcular_progreso(Tarea.objects.filter(clase_id__in=pk_set), [instance.id])
+        else:
+            recalcular_progreso(instance.tareas.all(), pk_set)
+    
+    elif action == 'post_remove':
+        if reverse:
+            ProgresoTarea.objects.filter(alumno=instance, tarea__clase_id__in=pk_set).delete()
+        else:
+            ProgresoTarea.objects.filter(tarea__clase=instance, alumno_id__in=pk_set).delete()
+    
+    elif action == 'pre_clear':
+        # En post_clear ya no se sabe qué filas afectaba, por eso se borra antes
+        if reverse:
+            ProgresoTarea.objects.filter(alumno=instance).delete()
+        else:
+            ProgresoTarea.objects.filter(tarea__clase=instance).delete()
+
+@receiver(post_delete, sender=Tarjeta)
+@receiver(post_save, sender=Tarjeta)
+def versionar_baraja_tarjeta(sender, instance, **kwargs):
+    """
+    Cambia la versión de la baraja cuando se crea, modifica o borra una de sus
+    tarjetas: los fragmentos en caché de la baraja y de sus tarjetas dejan de usarse.
+    """
+    if not _borrado_en_cascada(sender, kwargs.get('origin')):
+        tocar_baraja(instance.baraja_id)
+
+@receiver(post_delete, sender=Tarea)
+@receiver(post_save, sender=Tarea)
+def versionar_clase_tarea(sender, instance, **kwargs):
+    """
+    Cambia la versión de la clase cuando se crea, modifica o borra una de sus tareas.
+    """
+    if not _borrado_en_cascada(sender, kwargs.get('origin')):
+        tocar_clase(instance.clase_id)
+
+@receiver(m2m_changed, sender=Clase.alumnos.through)
+def versionar_clase_alumnos(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Cambia la versión de las clases cuyos alumnos cambian.
+    """
+    if action in ('post_add', 'post_remove'):
+        tocar_clase(pk_set if reverse else instance.id)
+    elif action == 'pre_clear' and reverse:
+        # user.clases_alumno.clear(): después ya no se sabe de qué clases era alumno
+        tocar_clase(list(instance.clases_alumno.values_list('id', flat=True)))
+    elif action == 'post_clear' and not reverse:
+        tocar_clase(instance.id)
+
+@receiver(post_save, sender=Baraja)
+@receiver(post_save, sender=Tarjeta)
+def generar_derivados_medios(sender, instance, **kwargs):
+    """
+    Encola las variantes reducidas de la imagen, el audio o la portada subidos
+    (ver core/medios.py). Los archivos que ya tienen derivados no se vuelven a encolar.
+    """
+    nombres = ['portada'] if sender is Baraja else ['imagen', 'audio']
+    update_fields = kwargs.get('update_fields')
+    if update_fields is not None:
+        nombres = [nombre for nombre in nombres if nombre in update_fields]
+    for campo in (getattr(instance, nombre) for nombre in nombres):
+        if campo:
+            # Cuando el archivo y la fila ya están guardados
+            transaction.on_commit(lambda campo=campo: estado_derivados(campo))
+
+@receiver(post_delete, sender=Baraja)
+@receiver(post_delete, sender=Tarjeta)
+def recolectar_medios(sender, instance, **kwargs):
+    """
+    Borra los archivos de la fila borrada si ya no los usa ninguna otra (al confirmar la transacción).
+    """
+    if sender is Baraja:
+        programar_recoleccion([instance.portada.name])
+    else:
+        programar_recoleccion([instance.imagen.name, instance.audio.name])
@@ -0,0 +1,81 @@
+"""
+Núcleo vectorizado del algoritmo SM-2.
+
+Trabaja sobre arreglos de NumPy en lugar de una Programacion a la vez, para
+reprogramar miles de tarjetas de golpe (por ejemplo, una baraja entera o la
+repetición de un historial). SchedulerSM2 usa estas mismas funciones tanto
+para una tarjeta como para un lote, así que las reglas están en un solo lugar.
+"""
+from datetime import date
+import numpy as np
+
+# Límites del factor de facilidad
+EASE_MINIMO = 1.3
+EASE_MAXIMO = 3.5
+
+# Calificaciones
+OTRA_VEZ, DIFICIL, BIEN, FACIL = 1, 2, 3, 4
+
+
+def calcular_sm2(ease_factor, intervalo, repeticiones, calificacion):
+    """
+    Aplica una calificación SM-2 a cada posición de los arreglos.
+
+    Parámetros (secuencias del mismo largo):
+    - ease_factor: factores de facilidad actuales
+    - intervalo: intervalos actuales en días
+    - repeticiones: repeticiones correctas seguidas
+    - calificacion: 1=Otra vez, 2=Difícil, 3=Bien, 4=Fácil (otro valor no cambia nada)
+
+    Retorna: (ease_factor, intervalo, repeticiones) nuevos, como arreglos de NumPy
+    """
+    ease = np.asarray(ease_factor, dtype=np.float64)
+    intervalo = np.asarray(intervalo, dtype=np.int64)
+    repeticiones = np.asarray(repeticiones, dtype=np.int64)
+    calificacion = np.asarray(calificacion, dtype=np.int64)
+
+    otra_vez = calificacion == OTRA_VEZ
+    dificil = calificacion == DIFICIL
+    bien = calificacion == BIEN
+    facil = calificacion == FACIL
+
+    # Intervalo de las respuestas correctas: 1.ª vez, 2.ª vez y a partir de la 3.ª
+    # (floor equivale a int() porque los valores son positivos)
+    intervalo_bien = np.select(
+        [repeticiones == 0, repeticiones == 1],
+        [1, 6],
+        np.floor(intervalo * ease).astype(np.int64)
+    )
+    intervalo_facil = np.select(
+        [repeticiones == 0, repeticiones == 1],
+        [4, 10],
+        np.floor(intervalo * (ease + 0.5)).astype(np.int64)
+    )
+
+    nuevo_intervalo = np.select(
+        [otra_vez, dificil, bien, facil],
+        [1, np.maximum(1, np.floor(intervalo * 0.5).astype(np.int64)), intervalo_bien, intervalo_facil],
+        intervalo
+    )
+    nuevas_repeticiones = np.select(
+        [otra_vez, dificil, bien | facil],
+        [0, np.maximum(0, repeticiones - 1), repeticiones + 1],
+        repeticiones
+    )
+    nuevo_ease = np.select(
+        [otra_vez, dificil, facil],
+        [np.maximum(EASE_MINIMO, ease - 0.2), np.maximum(EASE_MINIMO, ease - 0.15), np.minimum(EASE_MAXIMO, ease + 0.15)],
+        ease  # "Bien" mantiene el ease_factor
+    )
+
+    return nuevo_ease, nuevo_intervalo, nuevas_repeticiones
+
+
+def calcular_fechas(intervalo, hoy=None):
+    """
+    Calcula la próxima fecha de estudio (hoy + intervalo) de cada posición.
+
+    Retorna: lista de objetos date
+    """
+    hoy = np.datetime64(hoy or date.today(), 'D')
+    return (hoy + np.asarray(intervalo, dtype='timedelta64[D]')).tolist()
@@ -0,0 +1,28 @@
+from django import template
+from django.utils.html import format_html, format_html_join
+from core import medios
+
+register = template.Library()
+
+
+@register.simple_tag
+def imagen_reducida(campo, ancho, sizes=None, **atributos):
+    """
+    <picture> con las variantes WebP de la imagen (el navegador elige la más
+    chica que le sirve) y, como respaldo, la variante JPEG de al menos ancho px.
+    Mientras los derivados no están listos es un <img> con el original.
+    
+    Uso: {% imagen_reducida baraja.portada 480 class="card-img-top" alt=baraja.titulo %}
+    """
+    if not campo:
+        return ''
+    
+    extra = format_html_join('', ' {}="{}"', atributos.items())
+    srcset = medios.srcset_imagen(campo)
+    img = format_html('<img src="{}"{} loading="lazy">', medios.url_imagen(campo, ancho), extra)
+    if srcset is None:
+        return img
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}">{}</picture>',
+        srcset, sizes or f'{ancho}px', img
+    )
@@ -1,3 +1,1028 @@
-from django.test import TestCase
+import io
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from itertools import product
+from unittest import mock
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.contrib.auth.models import User
+from django.core import signing
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import connection, connections, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+from .almacenamiento import almacenamiento_medios
+from .escritor_historial import EscritorHistorial
+from .estadisticas import obtener_estadisticas
+from .models import Baraja, Clase, HistorialDiario, HistorialRespuesta, ImportacionCSV, PerfilUsuario, Programacion, Sesion, Tarea, Tarjeta
+from .replicas import FijarPrimariaMiddleware, RouterReplicas, esta_fijado, usar_replica
+from .scheduler import CursorCola, SchedulerSM2
+from .views import _cursor_a_texto, _texto_a_cursor
+from . import escritor_historial, historial, importador, medios, paquetes, rachas, sesiones, sm2, views
 
-# Create your tests here.
+
+class ConsultasClasesTests(TestCase):
+    """
+    La cantidad de consultas de mis_clases y detalle_clase no debe depender de
+    cuántos alumnos, tareas o tarjetas tenga una clase (sin N+1).
+    """
+    def setUp(self):
+        self.docente = User.objects.create_user('docente', password='clave')
+        self.alumno = User.objects.create_user('alumno', password='clave')
+        self.clase = Clase.objects.create(nombre='Clase', docente=self.docente, codigo_invitacion='CLASE1')
+        self.clase.alumnos.add(self.alumno)
+        self.baraja = Baraja.objects.create(propietario=self.docente, titulo='Baraja')
+        Tarjeta.objects.create(baraja=self.baraja, anverso='a', reverso='b')
+        Tarea.objects.create(clase=self.clase, baraja=self.baraja, titulo='Tarea', fecha_limite=date.today())
+
+    def _agrandar_clase(self):
+        """
+        Agrega alumnos, tareas con barajas distintas, tarjetas y otra clase de la que el alumno es parte.
+        """
+        alumnos = [User.objects.create_user(f'alumno{i}', password='clave') for i in range(15)]
+        self.clase.alumnos.add(*alumnos)
+        for i in range(5):
+            baraja = Baraja.objects.create(propietario=self.docente, titulo=f'Baraja {i}')
+            Tarjeta.objects.bulk_create(Tarjeta(baraja=baraja, anverso=str(j), reverso='r') for j in range(3))
+            Tarea.objects.create(clase=self.clase, baraja=baraja, titulo=f'Tarea {i}', fecha_limite=date.today())
+        otro_docente = User.objects.create_user('otro_docente', password='clave')
+        otra_clase = Clase.objects.create(nombre='Otra', docente=otro_docente, codigo_invitacion='CLASE2')
+        otra_clase.alumnos.add(self.alumno, *alumnos)
+        Clase.objects.create(nombre='Propia', docente=self.docente, codigo_invitacion='CLASE3')
+
+    def _consultas(self, usuario, url):
+        # Sin fragmentos en caché: se mide el peor caso, con todo el HTML renderizado
+        cache.clear()
+        self.client.force_login(usuario)
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self.client.get(url)
+        self.assertEqual(respuesta.status_code, 200)
+        return len(consultas)
+
+    def _paginas(self):
+        detalle = reverse('core:detalle_clase', args=[self.clase.id])
+        return [
+            (self.docente, reverse('core:mis_clases')),
+            (self.alumno, reverse('core:mis_clases')),
+            (self.docente, detalle),
+            (self.alumno, detalle),
+        ]
+
+    def test_consultas_constantes(self):
+        antes = [self._consultas(usuario, url) for usuario, url in self._paginas()]
+        self._agrandar_clase()
+        despues = [self._consultas(usuario, url) for usuario, url in self._paginas()]
+        self.assertEqual(antes, despues)
+
+    def test_detalle_clase_muestra_conteos(self):
+        self._agrandar_clase()
+        self.client.force_login(self.docente)
+        respuesta = self.client.get(reverse('core:detalle_clase', args=[self.clase.id]))
+        self.assertEqual(respuesta.context['clase'].total_alumnos, 16)
+        self.assertEqual(respuesta.context['clase'].total_tareas, 6)
+        self.assertEqual(
+            sorted(tarea.total_tarjetas for tarea in respuesta.context['tareas']), [1, 3, 3, 3, 3, 3]
+        )
+
+    def test_detalle_clase_sin_acceso(self):
+        extrano = User.objects.create_user('extrano', password='clave')
+        self.client.force_login(extrano)
+        respuesta = self.client.get(reverse('core:detalle_clase', args=[self.clase.id]))
+        self.assertEqual(respuesta.status_code, 403)
+
+
+class ReplicasTests(TransactionTestCase):
+    """
+    Las vistas con @lectura_en_replica leen de la réplica ('replica', que en las
+    pruebas es otra conexión a la misma base de datos) salvo después de escribir.
+    TransactionTestCase: dentro de una transacción todo se lee de 'default'.
+    """
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        cache.clear()
+        self.usuario = User.objects.create_user('usuario', password='clave')
+        self.baraja = Baraja.objects.create(propietario=self.usuario, titulo='Baraja')
+        self.tarjeta = Tarjeta.objects.create(baraja=self.baraja, anverso='a', reverso='b')
+        self.client.force_login(self.usuario)
+
+    def _consultas_replica(self, pedir):
+        with CaptureQueriesContext(connections['replica']) as consultas:
+            respuesta = pedir()
+            if respuesta.streaming:
+                b''.join(respuesta.streaming_content)
+        self.assertEqual(respuesta.status_code, 200)
+        return len(consultas)
+
+    def test_vistas_de_lectura_usan_la_replica(self):
+        self.assertGreater(self._consultas_replica(lambda: self.client.get(reverse('core:dashboard'))), 0)
+        # El CSV se genera mientras se envía, después de que la vista terminó
+        exportar = reverse('core:exportar_csv', args=[self.baraja.id])
+        self.assertGreater(self._consultas_replica(lambda: self.client.get(exportar)), 0)
+        # Las demás vistas no
+        self.assertEqual(self._consultas_replica(lambda: self.client.get(reverse('core:lista_barajas'))), 0)
+
+    def test_despues_de_escribir_lee_de_default(self):
+        respuesta = self.client.post(
+            reverse('core:calificar_lote'),
+            {'respuestas': [{'tarjeta_id': self.tarjeta.id, 'calificacion': 3}]},
+            content_type='application/json'
+        )
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(self._consultas_replica(lambda: self.client.get(reverse('core:dashboard'))), 0)
+
+    def test_recalculos_desde_default(self):
+        # Sin caché ni filas de pendientes: el dashboard las recalcula y las guarda
+        Programacion.objects.create(usuario=self.usuario, tarjeta=self.tarjeta, proximo_estudio=date.today())
+        with CaptureQueriesContext(connections['replica']) as consultas:
+            respuesta = self.client.get(reverse('core:dashboard'))
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.context['tarjetas_pendientes'], 1)
+        tablas = (Programacion._meta.db_table, HistorialRespuesta._meta.db_table)
+        self.assertFalse([c['sql'] for c in consultas if any(tabla in c['sql'] for tabla in tablas)])
+
+    def test_fijar_primaria_async(self):
+        async def vista(request):
+            return HttpResponse()
+
+        middleware = FijarPrimariaMiddleware(vista)
+        self.assertTrue(iscoroutinefunction(middleware))
+        request = RequestFactory().post('/')
+
+        async def auser():
+            return self.usuario
+
+        request.auser = auser
+        async_to_sync(middleware)(request)
+        self.assertTrue(esta_fijado(self.usuario.id))
+
+    def test_escrituras_y_transacciones_van_a_default(self):
+        router = RouterReplicas()
+        with usar_replica('replica'):
+            self.assertEqual(router.db_for_read(Tarjeta), 'replica')
+            self.assertEqual(router.db_for_write(Tarjeta), 'default')
+            with transaction.atomic():
+                self.assertEqual(router.db_for_read(Tarjeta), 'default')
+        self.assertEqual(router.db_for_read(Tarjeta), 'default')
+
+
+def sm2_escalar(ease_factor, intervalo, repeticiones, calificacion):
+    """
+    SM-2 de una tarjeta tal como lo calculaba SchedulerSM2.calcular_siguiente_revision
+    antes del núcleo vectorizado. Retorna: (ease_factor, intervalo, repeticiones)
+    """
+    if calificacion == 1:
+        repeticiones = 0
+        intervalo = 1
+        ease_factor = max(1.3, ease_factor - 0.2)
+    elif calificacion == 2:
+        repeticiones = max(0, repeticiones - 1)
+        intervalo = max(1, int(intervalo * 0.5))
+        ease_factor = max(1.3, ease_factor - 0.15)
+    elif calificacion == 3:
+        if repeticiones == 0:
+            intervalo = 1
+        elif repeticiones == 1:
+            intervalo = 6
+        else:
+            intervalo = int(intervalo * ease_factor)
+        repeticiones += 1
+    elif calificacion == 4:
+        if repeticiones == 0:
+            intervalo = 4
+        elif repeticiones == 1:
+            intervalo = 10
+        else:
+            intervalo = int(intervalo * (ease_factor + 0.5))
+        repeticiones += 1
+        ease_factor = min(3.5, ease_factor + 0.15)
+    return ease_factor, intervalo, repeticiones
+
+
+class SM2Tests(SimpleTestCase):
+    """
+    El núcleo vectorizado (core/sm2.py) da exactamente lo mismo que la fórmula
+    escalar anterior, para todas las calificaciones.
+    """
+    # Incluye el piso (1.3) y el techo (3.5) del ease_factor y valores pegados a ellos
+    EASES = [1.3, 1.35, 1.45, 2.5, 3.4, 3.5]
+    INTERVALOS = [1, 2, 3, 7, 30, 365]
+    REPETICIONES = [0, 1, 2, 3, 8]
+    CALIFICACIONES = [1, 2, 3, 4]
+
+    def test_igual_a_la_formula_escalar(self):
+        casos = list(product(self.EASES, self.INTERVALOS, self.REPETICIONES, self.CALIFICACIONES))
+        ease, intervalo, repeticiones = sm2.calcular_sm2(*zip(*casos))
+        for caso, resultado in zip(casos, zip(ease.tolist(), intervalo.tolist(), repeticiones.tolist())):
+            with self.subTest(caso=caso):
+                self.assertEqual(resultado, sm2_escalar(*caso))
+
+    def test_respuestas_seguidas(self):
+        # Varias rondas sobre el mismo estado, como al repetir un historial
+        estado = (2.5, 1, 0)
+        for calificacion in [3, 3, 4, 4, 2, 1, 1, 1, 1, 1, 1, 1, 3, 3, 3, 4, 2]:
+            ease, intervalo, repeticiones = sm2.calcular_sm2(*([valor] for valor in estado), [calificacion])
+            esperado = sm2_escalar(*estado, calificacion)
+            self.assertEqual((ease[0], intervalo[0], repeticiones[0]), esperado)
+            estado = esperado
+        self.assertEqual(estado[0], 1.3)
+
+    def test_piso_y_reinicio(self):
+        ease, intervalo, repeticiones = sm2.calcular_sm2([1.35, 1.35, 1.3], [30, 30, 1], [5, 5, 0], [1, 2, 2])
+        self.assertEqual(ease.tolist(), [1.3, 1.3, 1.3])
+        self.assertEqual(intervalo.tolist(), [1, 15, 1])
+        self.assertEqual(repeticiones.tolist(), [0, 4, 0])
+
+    def test_reprogramar_calcula_la_fecha(self):
+        hoy = date(2026, 3, 1)
+        programaciones = [
+            Programacion(ease_factor=ease, intervalo=intervalo, repeticiones=repeticiones)
+            for ease, intervalo, repeticiones, _ in product(self.EASES, self.INTERVALOS, self.REPETICIONES, [None])
+        ]
+        calificaciones = [1, 2, 3, 4] * (len(programaciones) // 4) + [3] * (len(programaciones) % 4)
+        estados = [(p.ease_factor, p.intervalo, p.repeticiones) for p in programaciones]
+        SchedulerSM2.reprogramar(programaciones, calificaciones, hoy)
+        for programacion, estado, calificacion in zip(programaciones, estados, calificaciones):
+            esperado = sm2_escalar(*estado, calificacion)
+            self.assertEqual((programacion.ease_factor, programacion.intervalo, programacion.repeticiones), esperado)
+            self.assertEqual(programacion.proximo_estudio, hoy + timedelta(days=esperado[1]))
+
+
+class ColaEstudioTests(TestCase):
+    """
+    La cola de estudio por lotes (obtener_lote_pendientes y cola_estudio):
+    cada tarjeta sale una sola vez, en orden, y nunca más de los límites diarios.
+    """
+    def setUp(self):
+        self.usuario = User.objects.create_user('usuario', password='clave')
+        PerfilUsuario.objects.filter(usuario=self.usuario).update(limite_repasos_diarios=5, limite_nuevas_diarias=3)
+        self.baraja = Baraja.objects.create(propietario=self.usuario, titulo='Baraja')
+        hoy = date.today()
+        # 6 repasos atrasados (fecha y ease distintos) y 8 tarjetas nuevas
+        self.repasos = []
+        for i, (dias, ease) in enumerate([(3, 2.5), (1, 2.5), (3, 1.3), (0, 2.0), (1, 2.5), (2, 3.0)]):
+            tarjeta = Tarjeta.objects.create(baraja=self.baraja, anverso=f'r{i}', reverso='r')
+            Programacion.objects.create(
+                usuario=self.usuario, tarjeta=tarjeta, ease_factor=ease, repeticiones=2, intervalo=6,
+                proximo_estudio=hoy - timedelta(days=dias), fecha_primer_repaso=hoy - timedelta(days=30),
+            )
+            self.repasos.append((hoy - timedelta(days=dias), ease, tarjeta.id))
+        self.nuevas = [Tarjeta.objects.create(baraja=self.baraja, anverso=f'n{i}', reverso='n').id for i in range(8)]
+        # Orden de la cola: la más atrasada primero, a igual fecha la de menor ease
+        self.repasos = [tarjeta_id for _, _, tarjeta_id in sorted(self.repasos)]
+
+    def _recorrer(self, limite):
+        """
+        Pide lotes hasta el final pasando el cursor por texto, como el navegador.
+        Retorna: lista de lotes (ids)
+        """
+        lotes, cursor = [], None
+        while True:
+            lote, siguiente = SchedulerSM2.obtener_lote_pendientes(self.usuario, self.baraja, cursor=cursor, limite=limite)
+            lotes.append([tarjeta.id for tarjeta in lote])
+            if siguiente is None:
+                return lotes
+            cursor = _texto_a_cursor(_cursor_a_texto(siguiente))
+
+    def test_paginacion_entre_lotes(self):
+        lotes = self._recorrer(limite=3)
+        ids = [tarjeta_id for lote in lotes for tarjeta_id in lote]
+        self.assertTrue(all(len(lote) <= 3 for lote in lotes))
+        self.assertEqual(len(ids), len(set(ids)))
+        # Los límites del perfil: los 5 primeros repasos y las 3 primeras nuevas, cada parte en orden
+        self.assertEqual([i for i in ids if i not in self.nuevas], self.repasos[:5])
+        self.assertEqual([i for i in ids if i in self.nuevas], self.nuevas[:3])
+
+    def test_intercalado_y_limite_a_mitad_de_lote(self):
+        lote, siguiente = SchedulerSM2.obtener_lote_pendientes(self.usuario, self.baraja, limite=20)
+        self.assertIsNone(siguiente)
+        # Una nueva cada repaso (5 // 3) hasta que se acaban las nuevas del límite
+        esperado = ['r', 'n', 'r', 'n', 'r', 'n', 'r', 'r']
+        self.assertEqual(['n' if t.id in self.nuevas else 'r' for t in lote], esperado)
+
+    def test_limite_gastado_entre_lotes(self):
+        lote, siguiente = SchedulerSM2.obtener_lote_pendientes(self.usuario, self.baraja, limite=2)
+        self.assertEqual(siguiente.nuevas_restantes, 2)
+        # Entre un lote y otro el usuario estudia nuevas en otra pestaña hasta el límite
+        SchedulerSM2.calificar_lote(self.usuario, [(tarjeta_id, 3, 1) for tarjeta_id in self.nuevas[-3:]])
+        lotes = []
+        while siguiente is not None:
+            lote, siguiente = SchedulerSM2.obtener_lote_pendientes(self.usuario, self.baraja, cursor=siguiente, limite=2)
+            lotes.extend(tarjeta.id for tarjeta in lote)
+        self.assertFalse(set(lotes) & set(self.nuevas))
+
+    def test_cursor_modificado_se_rechaza(self):
+        self.client.force_login(self.usuario)
+        url = reverse('core:cola_estudio', args=[self.baraja.id])
+        siguiente = self.client.get(url, {'limite': 2}).json()['siguiente']
+        texto, firma = siguiente.split(':')
+        partes = texto.split('_')
+        partes[4] = partes[5] = '9999'
+        respuesta = self.client.get(url, {'limite': 2, 'cursor': '_'.join(partes) + ':' + firma})
+        self.assertEqual(respuesta.status_code, 400)
+
+    def test_cursor_repetido_no_pasa_los_limites(self):
+        # Volver a pedir con el primer cursor después de estudiar no entrega más nuevas que el límite
+        self.client.force_login(self.usuario)
+        url = reverse('core:cola_estudio', args=[self.baraja.id])
+        primero = self.client.get(url, {'limite': 2}).json()['siguiente']
+        estudiadas = set()
+        for _ in range(5):
+            tarjetas = self.client.get(url, {'limite': 2, 'cursor': primero}).json()['tarjetas']
+            nuevas = [tarjeta['id'] for tarjeta in tarjetas if tarjeta['id'] in self.nuevas]
+            if nuevas:
+                SchedulerSM2.calificar_lote(self.usuario, [(tarjeta_id, 3, 1) for tarjeta_id in nuevas])
+                estudiadas.update(nuevas)
+        self.assertLessEqual(len(estudiadas), 3)
+
+    def test_cursor_ida_y_vuelta(self):
+        for cursor in [
+            CursorCola(date(2026, 3, 1), 2.3600000000000003, 15, 42, 180, 7),
+            CursorCola(None, None, None, 42, 0, 3),
+            CursorCola(date(2026, 3, 1), 1.3, 15, None, 4, 0),
+        ]:
+            with self.subTest(cursor=cursor):
+                self.assertEqual(_texto_a_cursor(_cursor_a_texto(cursor)), cursor)
+        self.assertIsNone(_cursor_a_texto(None))
+        for texto in ['', '2026-03-01_2.5_1', 'x_2.5_1_2_3_4', '2026-03-01_2.5_1_2_tres_4']:
+            with self.subTest(texto=texto), self.assertRaises(ValueError):
+                # Sin firma, y con firma pero mal formado
+                _texto_a_cursor(texto)
+            with self.subTest(texto=texto), self.assertRaises(ValueError):
+                _texto_a_cursor(signing.Signer(salt='core.cola_estudio.cursor').sign(texto))
+
+
+
+class PendientesTests(TestCase):
+    """
+    Al borrar una tarjeta se invalidan los pendientes y las estadísticas
+    en caché de todos los usuarios que la estudian, no solo del propietario.
+    """
+    def setUp(self):
+        cache.clear()
+        self.propietario = User.objects.create_user('propietario', password='clave')
+        self.alumno = User.objects.create_user('alumno', password='clave')
+        baraja = Baraja.objects.create(propietario=self.propietario, titulo='Baraja')
+        self.tarjetas = [Tarjeta.objects.create(baraja=baraja, anverso=f'a{i}', reverso='r') for i in range(2)]
+        for tarjeta in self.tarjetas:
+            Programacion.objects.create(
+                usuario=self.alumno, tarjeta=tarjeta, repeticiones=1, intervalo=1,
+                proximo_estudio=timezone.localdate() - timedelta(days=1),
+            )
+
+    def test_borrar_tarjeta_invalida_estadisticas_de_alumnos(self):
+        self.assertEqual(obtener_estadisticas(self.alumno)['tarjetas_pendientes'], 2)
+        self.tarjetas[0].delete()
+        self.assertEqual(obtener_estadisticas(self.alumno)['tarjetas_pendientes'], 1)
+
+
+@mock.patch.object(importador, 'TAMANO_LOTE', 3)
+class ImportadorTests(TestCase):
+    """
+    La importación de CSV por lotes: cada lote se confirma por separado, así
+    que un error a la mitad deja los lotes anteriores y dice hasta dónde llegó.
+    """
+    def setUp(self):
+        cache.clear()
+        self.usuario = User.objects.create_user('usuario', password='clave')
+        self.baraja = Baraja.objects.create(propietario=self.usuario, titulo='Baraja')
+        carpeta = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, carpeta)
+        ajustes = override_settings(MEDIA_ROOT=carpeta)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+    def _csv(self, filas, final=b''):
+        lineas = ['anverso,reverso,etiquetas'] + [f'{anverso},{reverso},{etiquetas}' for anverso, reverso, etiquetas in filas]
+        return '\ufeff'.encode() + '\n'.join(lineas).encode() + b'\n' + final
+
+    def test_importar_por_lotes(self):
+        filas = [(f'a{i}', f'r{i}', 'verbos') for i in range(7)]
+        filas.insert(2, ('sin reverso', '', ''))
+        avances = []
+        creadas, errores = importador.importar_archivo(
+            io.BytesIO(self._csv(filas)), self.baraja, self.usuario,
+            al_avanzar=lambda filas, creadas, errores: avances.append((filas, creadas)),
+        )
+        self.assertEqual(creadas, 7)
+        self.assertEqual(errores, ['Fila 4: Falta anverso o reverso'])
+        # Un aviso por lote de 3 y el último incompleto
+        self.assertEqual(avances, [(4, 3), (7, 6), (8, 7)])
+        self.assertEqual(
+            list(self.baraja.tarjetas.order_by('id').values_list('anverso', 'etiquetas'))[:2],
+            [('a0', 'verbos'), ('a1', 'verbos')],
+        )
+        self.assertEqual(Programacion.objects.filter(usuario=self.usuario, tarjeta__baraja=self.baraja).count(), 7)
+
+    def test_interrumpida_por_la_base_de_datos(self):
+        # El tercer lote falla: los dos primeros quedan y el tercero no
+        guardar_lote = importador._guardar_lote
+        llamadas = []
+
+        def fallar_al_tercero(baraja, usuario, tarjetas):
+            llamadas.append(len(tarjetas))
+            if len(llamadas) == 3:
+                raise RuntimeError('sin conexión')
+            guardar_lote(baraja, usuario, tarjetas)
+
+        filas = [(f'a{i}', f'r{i}', '') for i in range(10)]
+        with mock.patch.object(importador, '_guardar_lote', fallar_al_tercero):
+            with self.assertRaises(importador.ImportacionInterrumpida) as error:
+                importador.importar_archivo(io.BytesIO(self._csv(filas)), self.baraja, self.usuario)
+        self.assertEqual(error.exception.tarjetas_creadas, 6)
+        self.assertEqual(error.exception.ultima_fila, 7)
+        self.assertEqual(error.exception.filas_procesadas, 9)
+        self.assertIn('hasta la fila 7', str(error.exception))
+        self.assertEqual(
+            list(self.baraja.tarjetas.order_by('id').values_list('anverso', flat=True)),
+            [f'a{i}' for i in range(6)],
+        )
+        self.assertEqual(Programacion.objects.filter(tarjeta__baraja=self.baraja).count(), 6)
+
+    def test_interrumpida_por_la_codificacion(self):
+        # Los bytes inválidos están después del primer bloque que decodifica TextIOWrapper
+        filas = [(f'anverso {i:05d}', f'reverso {i:05d}', '') for i in range(1000)]
+        with self.assertRaises(importador.ImportacionInterrumpida) as error:
+            importador.importar_archivo(io.BytesIO(self._csv(filas, final=b'\xff\xfe,x\n')), self.baraja, self.usuario)
+        creadas = error.exception.tarjetas_creadas
+        self.assertIsInstance(error.exception.causa, UnicodeDecodeError)
+        self.assertTrue(0 < creadas < 1000)
+        self.assertEqual(creadas % 3, 0)
+        self.assertEqual(error.exception.ultima_fila, creadas + 1)
+        self.assertEqual(self.baraja.tarjetas.count(), creadas)
+
+    def test_procesar_importacion(self):
+        completa = ImportacionCSV.objects.create(
+            usuario=self.usuario, baraja=self.baraja, tamano_bytes=1,
+            archivo=ContentFile(self._csv([('a', 'r', ''), ('b', 'r', '')]), name='completa.csv'),
+        )
+        filas = [(f'anverso {i:05d}', f'reverso {i:05d}', '') for i in range(1000)]
+        interrumpida = ImportacionCSV.objects.create(
+            usuario=self.usuario, baraja=self.baraja, tamano_bytes=1,
+            archivo=ContentFile(self._csv(filas, final=b'\xff\n'), name='interrumpida.csv'),
+        )
+        for importacion in [completa, interrumpida]:
+            importador.procesar_importacion(importacion.id)
+            importacion.refresh_from_db()
+
+        self.assertEqual((completa.estado, completa.tarjetas_creadas), ('completada', 2))
+        self.assertFalse(completa.archivo.storage.exists(completa.archivo.name))
+
+        # La interrumpida informa lo que alcanzó a guardar y conserva el archivo
+        self.assertEqual(interrumpida.estado, 'error')
+        self.assertEqual(self.baraja.tarjetas.count(), 2 + interrumpida.tarjetas_creadas)
+        self.assertGreater(interrumpida.tarjetas_creadas, 0)
+        self.assertIn(f'Se importaron {interrumpida.tarjetas_creadas} tarjetas', interrumpida.mensaje_error)
+        self.assertTrue(interrumpida.archivo.storage.exists(interrumpida.archivo.name))
+
+        # Ya procesada: no se vuelve a tomar
+        importador.procesar_importacion(interrumpida.id)
+        self.assertEqual(self.baraja.tarjetas.count(), 2 + interrumpida.tarjetas_creadas)
+
+
+class CalificarRespuestaTests(TestCase):
+    """
+    calificar_respuesta (una tarjeta, async) valida la calificación antes de
+    escribir y deja el historial al escritor en segundo plano.
+    """
+    def setUp(self):
+        cache.clear()
+        self.usuario = User.objects.create_user('usuario', password='clave')
+        self.baraja = Baraja.objects.create(propietario=self.usuario, titulo='Baraja')
+        self.tarjeta = Tarjeta.objects.create(baraja=self.baraja, anverso='a', reverso='r')
+        self.client.force_login(self.usuario)
+
+    def test_historial_por_el_escritor(self):
+        docente = User.objects.create_user('docente', password='clave')
+        clase = Clase.objects.create(nombre='Clase', docente=docente, codigo_invitacion='CLASE1')
+        clase.alumnos.add(self.usuario)
+        tarea = Tarea.objects.create(clase=clase, baraja=self.baraja, titulo='Tarea', fecha_limite=date.today())
+        # Contadores ya en caché, como después de abrir el dashboard
+        obtener_estadisticas(self.usuario)
+        # Si la prueba falla a la mitad, que la respuesta no quede en la cola para las siguientes
+        self.addCleanup(escritor_historial.escritor.vaciar)
+
+        respuesta = self.client.post(
+            reverse('core:calificar_respuesta', args=[self.tarjeta.id]), {'calificacion': 4, 'tiempo': 7}
+        )
+        self.assertEqual(respuesta.status_code, 200)
+        programacion = Programacion.objects.get(usuario=self.usuario, tarjeta=self.tarjeta)
+        self.assertEqual(respuesta.json()['intervalo'], programacion.intervalo)
+        self.assertEqual(obtener_estadisticas(self.usuario)['facil'], 1)
+
+        # El historial y el progreso de la tarea esperan al escritor
+        self.assertFalse(HistorialRespuesta.objects.exists())
+        self.assertEqual(tarea.progresos.get(alumno=self.usuario).tarjetas_estudiadas, 0)
+        escritor_historial.escritor.vaciar()
+        self.assertEqual(
+            list(HistorialRespuesta.objects.values_list('usuario_id', 'tarjeta_id', 'calificacion', 'tiempo_respuesta_segundos')),
+            [(self.usuario.id, self.tarjeta.id, 4, 7)],
+        )
+        self.assertEqual(tarea.progresos.get(alumno=self.usuario).tarjetas_estudiadas, 1)
+
+    def test_calificacion_invalida(self):
+        url = reverse('core:calificar_respuesta', args=[self.tarjeta.id])
+        for datos in [{'calificacion': 5}, {'calificacion': 0}, {'calificacion': 'tres'}, {}, {'calificacion': 3, 'tiempo': 'x'}]:
+            with self.subTest(datos=datos):
+                self.assertEqual(self.client.post(url, datos).status_code, 400)
+        self.assertFalse(Programacion.objects.exists())
+        self.assertTrue(escritor_historial.escritor._cola.empty())
+
+
+class CalificarLoteTests(TestCase):
+    """
+    calificar_lote valida el lote entero antes de escribir: un lote con
+    cualquier respuesta inválida se rechaza sin aplicar ninguna.
+    """
+    def setUp(self):
+        cache.clear()
+        self.usuario = User.objects.create_user('usuario', password='clave')
+        self.baraja = Baraja.objects.create(propietario=self.usuario, titulo='Baraja')
+        self.tarjetas = [Tarjeta.objects.create(baraja=self.baraja, anverso=str(i), reverso='r').id for i in range(3)]
+        self.client.force_login(self.usuario)
+
+    def _calificar(self, cuerpo):
+        if not isinstance(cuerpo, str):
+            cuerpo = json.dumps(cuerpo)
+        return self.client.post(reverse('core:calificar_lote'), cuerpo, content_type='application/json')
+
+    def test_lote_valido(self):
+        # Una tarjeta borrada mientras el lote estaba en la cola del navegador
+        borrada = Tarjeta.objects.create(baraja=self.baraja, anverso='b', reverso='r')
+        borrada_id = borrada.id
+        borrada.delete()
+        respuesta = self._calificar({'respuestas': [
+            {'tarjeta_id': self.tarjetas[0], 'calificacion': 3, 'tiempo': 5},
+            {'tarjeta_id': self.tarjetas[1], 'calificacion': 1},
+            {'tarjeta_id': borrada_id, 'calificacion': 4},
+        ]})
+        self.assertEqual(respuesta.status_code, 200)
+        datos = respuesta.json()
+        self.assertEqual(datos['procesadas'], 2)
+        self.assertEqual(datos['no_encontradas'], [borrada_id])
+        self.assertEqual(set(datos['programaciones']), {str(self.tarjetas[0]), str(self.tarjetas[1])})
+        self.assertEqual(
+            sorted(HistorialRespuesta.objects.values_list('tarjeta_id', 'calificacion', 'tiempo_respuesta_segundos')),
+            [(self.tarjetas[0], 3, 5), (self.tarjetas[1], 1, 0)],
+        )
+
+    def test_fecha_acotada(self):
+        # Una respuesta de hace una semana queda en el límite de ANTIGUEDAD_MAXIMA_LOTE
+        antes = timezone.now()
+        respuesta = self._calificar({'respuestas': [
+            {'tarjeta_id': self.tarjetas[0], 'calificacion': 3, 'fecha': (antes - timedelta(days=7)).isoformat()},
+        ]})
+        self.assertEqual(respuesta.status_code, 200)
+        fecha = HistorialRespuesta.objects.get().fecha_respuesta
+        self.assertTrue(antes - views.ANTIGUEDAD_MAXIMA_LOTE <= fecha <= timezone.now() - views.ANTIGUEDAD_MAXIMA_LOTE)
+
+    def test_lote_rechazado(self):
+        valida = {'tarjeta_id': self.tarjetas[0], 'calificacion': 3}
+        demasiadas = [dict(valida) for _ in range(views.MAX_CALIFICACIONES_LOTE + 1)]
+        for cuerpo in [
+            'no es json',
+            {},
+            {'respuestas': 5},
+            {'respuestas': [valida, 'x']},
+            {'respuestas': [valida, {'tarjeta_id': self.tarjetas[1]}]},
+            {'respuestas': [valida, {'tarjeta_id': 'uno', 'calificacion': 3}]},
+            {'respuestas': [valida, {'tarjeta_id': self.tarjetas[1], 'calificacion': 5}]},
+            {'respuestas': [valida, {'tarjeta_id': self.tarjetas[1], 'calificacion': 0}]},
+            {'respuestas': [valida, {'tarjeta_id': self.tarjetas[1], 'calificacion': 3, 'fecha': 'ayer'}]},
+            {'respuestas': demasiadas},
+        ]:
+            with self.subTest(cuerpo=str(cuerpo)[:80]):
+                respuesta = self._calificar(cuerpo)
+                self.assertEqual(respuesta.status_code, 400)
+                self.assertFalse(respuesta.json()['success'])
+        # Ninguna respuesta válida de esos lotes llegó a aplicarse
+        self.assertFalse(Programacion.objects.exists())
+        self.assertFalse(HistorialRespuesta.objects.exists())
+
+
+class SincronizacionTests(TestCase):
+    """
+    Las respuestas dadas sin conexión se aplican con la fecha en que se dieron,
+    acotada entre la versión del paquete y el momento de la sincronización.
+    """
+    def setUp(self):
+        cache.clear()
+        self.usuario = User.objects.create_user('usuario', password='clave')
+        self.baraja = Baraja.objects.create(propietario=self.usuario, titulo='Baraja')
+        self.tarjetas = [Tarjeta.objects.create(baraja=self.baraja, anverso=str(i), reverso='r').id for i in range(3)]
+        self.client.force_login(self.usuario)
+        self.ahora = timezone.now()
+
+    def _sincronizar(self, version, respuestas, baraja=None):
+        # version: un datetime (se firma como lo haría armar_paquete) o el texto tal cual
+        if isinstance(version, datetime):
+            version = paquetes.nueva_version(version)
+        return self.client.post(
+            reverse('core:sincronizar_estudio', args=[(baraja or self.baraja).id]),
+            json.dumps({'version': version, 'respuestas': respuestas}),
+            content_type='application/json',
+        )
+
+    def test_fechas_de_las_respuestas(self):
+        version = self.ahora - timedelta(days=3)
+        anteayer, ayer = self.ahora - timedelta(days=2), self.ahora - timedelta(days=1)
+        respuesta = self._sincronizar(version, [
+            {'tarjeta_id': self.tarjetas[0], 'calificacion': 3, 'fecha': anteayer.isoformat()},
+            {'tarjeta_id': self.tarjetas[1], 'calificacion': 3, 'fecha': ayer.isoformat()},
+            # Antes de la versión y en el futuro: se acotan
+            {'tarjeta_id': self.tarjetas[2], 'calificacion': 3, 'fecha': (version - timedelta(days=9)).isoformat()},
+            {'tarjeta_id': self.tarjetas[2], 'calificacion': 3, 'fecha': (self.ahora + timedelta(days=9)).isoformat()},
+        ])
+        self.assertEqual(respuesta.status_code, 200)
+
+        fechas = list(HistorialRespuesta.objects.order_by('id').values_list('fecha_respuesta', flat=True))
+        self.assertEqual(fechas[:3], [anteayer, ayer, version])
+        self.assertTrue(self.ahora <= fechas[3] <= timezone.now())
+
+        # SM-2 cuenta los intervalos desde el día de cada respuesta
+        programacion = Programacion.objects.get(usuario=self.usuario, tarjeta_id=self.tarjetas[1])
+        self.assertEqual(programacion.fecha_ultimo_repaso, timezone.localdate(ayer))
+        self.assertEqual(programacion.proximo_estudio, timezone.localdate(ayer) + timedelta(days=1))
+
+        # Cuatro días seguidos de estudio
+        self.assertEqual(PerfilUsuario.objects.get(usuario=self.usuario).racha_dias, 4)
+
+    def test_sin_fecha_se_usa_ahora(self):
+        respuesta = self._sincronizar(self.ahora - timedelta(days=3), [{'tarjeta_id': self.tarjetas[0], 'calificacion': 4}])
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertGreaterEqual(HistorialRespuesta.objects.get().fecha_respuesta, self.ahora)
+
+    def test_fecha_invalida(self):
+        for fecha in ['ayer', '2026-03-01T10:00:00', 5]:
+            with self.subTest(fecha=fecha):
+                respuesta = self._sincronizar(self.ahora, [{'tarjeta_id': self.tarjetas[0], 'calificacion': 3, 'fecha': fecha}])
+                self.assertEqual(respuesta.status_code, 400)
+
+    def test_version_sin_firma(self):
+        # Una versión inventada atrasaría todas las respuestas
+        antigua = datetime(2000, 1, 1, tzinfo=dt_timezone.utc)
+        firmada = paquetes.nueva_version(self.ahora)
+        for version in [antigua.isoformat(), firmada.replace(self.ahora.isoformat(), antigua.isoformat())]:
+            with self.subTest(version=version):
+                respuesta = self._sincronizar(version, [
+                    {'tarjeta_id': self.tarjetas[0], 'calificacion': 3, 'fecha': antigua.isoformat()}
+                ])
+                self.assertEqual(respuesta.status_code, 400)
+        self.assertFalse(HistorialRespuesta.objects.exists())
+
+    def test_solo_barajas_accesibles(self):
+        docente = User.objects.create_user('docente', password='clave')
+        ajena = Baraja.objects.create(propietario=docente, titulo='Ajena')
+        tarjeta = Tarjeta.objects.create(baraja=ajena, anverso='a', reverso='r')
+        paquete = reverse('core:paquete_estudio', args=[ajena.id])
+        respuestas = [{'tarjeta_id': tarjeta.id, 'calificacion': 3}]
+        self.assertEqual(self.client.get(paquete).status_code, 404)
+        self.assertEqual(self._sincronizar(self.ahora, respuestas, baraja=ajena).status_code, 404)
+
+        # Asignada como tarea en una clase del alumno
+        clase = Clase.objects.create(nombre='Clase', docente=docente, codigo_invitacion='CLASE1')
+        clase.alumnos.add(self.usuario)
+        Tarea.objects.create(clase=clase, baraja=ajena, titulo='Tarea', fecha_limite=date.today())
+        self.assertEqual(self.client.get(paquete).json()['tarjetas'][0]['id'], tarjeta.id)
+        self.assertEqual(self._sincronizar(self.ahora, respuestas, baraja=ajena).json()['procesadas'], 1)
+
+
+class RecalcularRachasTests(TestCase):
+    """
+    recalcular_rachas (SQL crudo): la racha es el último grupo de días seguidos
+    del historial reciente y el compactado, en la zona horaria de cada perfil.
+    """
+    def setUp(self):
+        cache.clear()
+        self.momento = datetime(2026, 3, 10, 12, tzinfo=dt_timezone.utc)
+        self.propietario = User.objects.create_user('propietario', password='clave')
+        baraja = Baraja.objects.create(propietario=self.propietario, titulo='Baraja')
+        self.tarjeta = Tarjeta.objects.create(baraja=baraja, anverso='a', reverso='b')
+
+    def _usuario(self, nombre, zona='UTC', respuestas=(), compactados=()):
+        usuario = User.objects.create_user(nombre, password='clave')
+        PerfilUsuario.objects.filter(usuario=usuario).update(zona_horaria=zona, racha_dias=7)
+        HistorialRespuesta.objects.bulk_create(
+            HistorialRespuesta(usuario=usuario, tarjeta=self.tarjeta, calificacion=3, fecha_respuesta=fecha)
+            for fecha in respuestas
+        )
+        HistorialDiario.objects.bulk_create(
+            HistorialDiario(usuario=usuario, tarjeta=self.tarjeta, fecha=dia, respuestas=1) for dia in compactados
+        )
+        return usuario
+
+    def _perfil(self, usuario):
+        perfil = PerfilUsuario.objects.get(usuario=usuario)
+        return perfil.racha_dias, perfil.fecha_ultimo_estudio
+
+    def test_recalcular(self):
+        def utc(dia, hora=10):
+            return datetime(2026, 3, dia, hora, tzinfo=dt_timezone.utc)
+
+        # Un grupo viejo (1 y 2) y el último del 7 al 10, con días compactados y repetidos
+        seguido = self._usuario(
+            'seguido', respuestas=[utc(8), utc(9), utc(9, 20), utc(10)],
+            compactados=[date(2026, 3, 1), date(2026, 3, 2), date(2026, 3, 7), date(2026, 3, 8)],
+        )
+        # En Lima (UTC-5) las 3:00 UTC son el día anterior: estudió el 8 y el 9 (ayer)
+        lima = self._usuario('lima', zona='America/Lima', respuestas=[utc(9, 3), utc(10, 3)])
+        cortado = self._usuario('cortado', respuestas=[utc(4), utc(5)])
+        sin_respuestas = self._usuario('sin_respuestas')
+        cache.set(f'racha:{seguido.id}', ('UTC', date(2026, 3, 11)))
+
+        self.assertEqual(rachas.recalcular_rachas(self.momento), 3)
+        self.assertEqual(self._perfil(seguido), (4, date(2026, 3, 10)))
+        self.assertEqual(self._perfil(lima), (2, date(2026, 3, 9)))
+        self.assertEqual(self._perfil(cortado), (0, date(2026, 3, 5)))
+        self.assertEqual(self._perfil(sin_respuestas), (0, None))
+        self.assertEqual(self._perfil(self.propietario), (0, None))
+        self.assertIsNone(cache.get(f'racha:{seguido.id}'))
+
+    def test_igual_que_incremental(self):
+        # Registrar las respuestas una por una da lo mismo que recalcular desde el historial
+        fechas = [self.momento - timedelta(days=dias, hours=horas) for dias, horas in [(5, 0), (3, 2), (2, 0), (1, 5), (0, 1)]]
+        usuario = self._usuario('usuario', zona='Asia/Kolkata', respuestas=fechas)
+        PerfilUsuario.objects.filter(usuario=usuario).update(racha_dias=0)
+        for fecha in fechas:
+            rachas.registrar_estudio(usuario.id, fecha)
+        incremental = self._perfil(usuario)
+        rachas.recalcular_rachas(self.momento)
+        self.assertEqual(self._perfil(usuario), incremental)
+        self.assertEqual(incremental[0], 4)
+
+    def test_compactar_en_la_zona_del_perfil(self):
+        # Compactar guarda los días locales del perfil: la racha no cambia
+        lima = self._usuario('lima', zona='America/Lima', respuestas=[
+            datetime(2026, 3, 9, 3, tzinfo=dt_timezone.utc), datetime(2026, 3, 10, 3, tzinfo=dt_timezone.utc),
+        ])
+        historial.compactar_historial(hoy=date(2026, 5, 1), dias_retencion=0)
+        self.assertFalse(HistorialRespuesta.objects.filter(usuario=lima).exists())
+        self.assertEqual(
+            sorted(HistorialDiario.objects.filter(usuario=lima).values_list('fecha', flat=True)),
+            [date(2026, 3, 8), date(2026, 3, 9)],
+        )
+        rachas.recalcular_rachas(self.momento)
+        self.assertEqual(self._perfil(lima), (2, date(2026, 3, 9)))
+
+@override_settings(HISTORIAL_ESCRITURA_EN_SEGUNDO_PLANO=False)
+class SesionesTests(TestCase):
+    """
+    Sesiones de estudio (core/sesiones.py) a partir de las respuestas, también
+    las que llegan desordenadas desde el escritor del historial.
+    """
+    def setUp(self):
+        self.usuario = User.objects.create_user('usuario', password='clave')
+        self.baraja = Baraja.objects.create(propietario=self.usuario, titulo='Baraja')
+        self.tarjetas = [Tarjeta.objects.create(baraja=self.baraja, anverso=str(i), reverso='r') for i in range(4)]
+        self.inicio = timezone.now() - timedelta(hours=3)
+
+    def _minuto(self, minutos):
+        return self.inicio + timedelta(minutes=minutos)
+
+    def _sesiones(self):
+        return list(Sesion.objects.filter(usuario=self.usuario).order_by('fecha_inicio').values_list(
+            'fecha_inicio', 'fecha_fin', 'duracion_minutos', 'tarjetas_estudiadas'
+        ))
+
+    def _encolar(self, tarjeta, fecha, escritor):
+        escritor.agregar(HistorialRespuesta(
+            usuario=self.usuario, tarjeta=tarjeta, calificacion=3, fecha_respuesta=fecha
+        ))
+
+    def test_calificar_lote_usa_la_fecha_de_cada_respuesta(self):
+        self.client.force_login(self.usuario)
+        respuesta = self.client.post(reverse('core:calificar_lote'), {'respuestas': [
+            {'tarjeta_id': tarjeta.id, 'calificacion': 3, 'fecha': self._minuto(minutos).isoformat()}
+            for tarjeta, minutos in zip(self.tarjetas, [0, 4, 10, 60])
+        ]}, content_type='application/json')
+        self.assertEqual(respuesta.status_code, 200)
+        # La pausa de 50 minutos empieza otra sesión
+        self.assertEqual(self._sesiones(), [
+            (self._minuto(0), self._minuto(10), 10, 3),
+            (self._minuto(60), self._minuto(60), 0, 1),
+        ])
+        self.assertEqual(
+            list(HistorialRespuesta.objects.order_by('fecha_respuesta').values_list('fecha_respuesta', flat=True)),
+            [self._minuto(m) for m in [0, 4, 10, 60]]
+        )
+
+    def test_respuestas_del_escritor_que_llegan_tarde(self):
+        escritor = EscritorHistorial()
+        # Una respuesta queda en la cola del escritor mientras se agrupan otras posteriores
+        self._encolar(self.tarjetas[0], self._minuto(0), escritor)
+        sesiones.agrupar_respuestas(self.usuario.id, [(self._minuto(5), self.baraja.id), (self._minuto(8), self.baraja.id)])
+        escritor.vaciar()
+        self.assertEqual(self._sesiones(), [(self._minuto(0), self._minuto(8), 8, 3)])
+        self.assertEqual(PerfilUsuario.objects.get(usuario=self.usuario).sesiones_hasta, self._minuto(8))
+
+        # Otra que llega tarde, fuera de la sesión: una sesión nueva antes
+        self._encolar(self.tarjetas[1], self._minuto(-45), escritor)
+        escritor.vaciar()
+        self.assertEqual(self._sesiones(), [
+            (self._minuto(-45), self._minuto(-45), 0, 1),
+            (self._minuto(0), self._minuto(8), 8, 3),
+        ])
+
+    def test_el_lote_no_repite_lo_agrupado_al_calificar(self):
+        escritor = EscritorHistorial()
+        for tarjeta, minutos in zip(self.tarjetas, [0, 3, 7]):
+            self._encolar(tarjeta, self._minuto(minutos), escritor)
+        escritor.vaciar()
+        self.assertEqual(sesiones.sesionizar(hasta=timezone.now()), 0)
+        self.assertEqual(self._sesiones(), [(self._minuto(0), self._minuto(7), 7, 3)])
+
+    def test_error_al_agrupar_no_se_informa_como_historial_perdido(self):
+        escritor = EscritorHistorial()
+        self._encolar(self.tarjetas[0], self._minuto(0), escritor)
+        with mock.patch.object(sesiones, 'registrar_respuestas', side_effect=RuntimeError), \
+                self.assertLogs('core.escritor_historial') as registros:
+            escritor.vaciar()
+        self.assertEqual(HistorialRespuesta.objects.count(), 1)
+        self.assertEqual(len(registros.records), 1)
+        self.assertIn('agrupar en sesiones', registros.records[0].getMessage())
+
+@override_settings(HISTORIAL_ESCRITURA_EN_SEGUNDO_PLANO=False)
+class EscritorHistorialTests(TransactionTestCase):
+    """
+    El escritor del historial guarda la cola al vaciarla, y una respuesta
+    inválida no hace perder las demás del lote.
+    TransactionTestCase: las claves foráneas se revisan al confirmar.
+    """
+    def setUp(self):
+        self.escritor = EscritorHistorial()
+        self.usuarios = [User.objects.create_user(f'usuario{i}', password='clave') for i in range(2)]
+        baraja = Baraja.objects.create(propietario=self.usuarios[0], titulo='Baraja')
+        self.tarjetas = [Tarjeta.objects.create(baraja=baraja, anverso=str(i), reverso='r') for i in range(3)]
+
+    def _encolar(self, usuario, tarjeta):
+        self.escritor.agregar(HistorialRespuesta(usuario=usuario, tarjeta=tarjeta, calificacion=3))
+
+    def _guardadas(self):
+        return set(HistorialRespuesta.objects.values_list('usuario_id', 'tarjeta_id'))
+
+    def test_vaciar_guarda_en_lotes(self):
+        self.escritor.tamano_lote = 2
+        for usuario in self.usuarios:
+            for tarjeta in self.tarjetas:
+                self._encolar(usuario, tarjeta)
+        self.assertEqual(HistorialRespuesta.objects.count(), 0)
+        self.escritor.vaciar()
+        self.assertEqual(HistorialRespuesta.objects.count(), 6)
+        self.assertTrue(self.escritor._cola.empty())
+
+    def test_tarjeta_borrada_en_la_cola(self):
+        for usuario in self.usuarios:
+            for tarjeta in self.tarjetas:
+                self._encolar(usuario, tarjeta)
+        self.tarjetas[1].delete()
+        with self.assertLogs('core.escritor_historial', 'WARNING'):
+            self.escritor.vaciar()
+        self.assertEqual(self._guardadas(), {
+            (usuario.id, tarjeta.id) for usuario in self.usuarios for tarjeta in (self.tarjetas[0], self.tarjetas[2])
+        })
+
+    def test_usuario_borrado_en_la_cola(self):
+        for usuario in self.usuarios:
+            self._encolar(usuario, self.tarjetas[0])
+        # Un usuario borrado mientras su respuesta esperaba en la cola: el lote falla y se guarda de a una
+        otro = User.objects.create_user('otro', password='clave')
+        self._encolar(otro, self.tarjetas[1])
+        otro.delete()
+        with self.assertLogs('core.escritor_historial', 'ERROR'):
+            self.escritor.vaciar()
+        self.assertEqual(self._guardadas(), {(usuario.id, self.tarjetas[0].id) for usuario in self.usuarios})
+
+
+class MediosTests(TestCase):
+    """
+    Estado de los derivados de un archivo de medios y qué nombres son derivados.
+    """
+    def setUp(self):
+        cache.clear()
+        carpeta = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, carpeta)
+        ajustes = override_settings(MEDIA_ROOT=carpeta, MEDIOS_DERIVADOS_EN_SEGUNDO_PLANO=False)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+    def _imagen(self, imagen=None, formato='PNG', **opciones):
+        contenido = io.BytesIO()
+        (imagen or Image.new('RGB', (40, 30), 'red')).save(contenido, formato, **opciones)
+        campo = Tarjeta(id=1, baraja_id=1).imagen
+        campo.name = almacenamiento_medios.save(f'tarjetas/foto.{formato.lower()}', ContentFile(contenido.getvalue()))
+        return campo
+
+    def _audio(self):
+        campo = Tarjeta(id=1, baraja_id=1).audio
+        campo.name = almacenamiento_medios.save('audios/clip.wav', ContentFile(b'RIFF audio'))
+        return campo
+
+    def _abrir(self, nombre):
+        with almacenamiento_medios.open(nombre, 'rb') as archivo:
+            imagen = Image.open(archivo)
+            imagen.load()
+        return imagen
+
+    def test_es_derivado(self):
+        hash_ = 'ab' * 32
+        self.assertTrue(medios.es_derivado(f'tarjetas/ab/{hash_}.640w.webp'))
+        self.assertTrue(medios.es_derivado(f'audios/ab/{hash_}.normalizado.mp3'))
+        self.assertFalse(medios.es_derivado(f'tarjetas/ab/{hash_}.png'))
+        # Un original anterior al almacenamiento por contenido con nombre de variante
+        self.assertFalse(medios.es_derivado('tarjetas/foto.640w.jpg'))
+
+    def test_volver_a_subir_despues_de_borrar(self):
+        campo = self._imagen()
+        self.assertEqual(medios.estado(campo), medios.PENDIENTE)
+        medios.generador.vaciar()
+        self.assertEqual(medios.estado(campo), medios.LISTO)
+
+        # Otro proceso lo borra (sin tocar esta caché) y se vuelve a subir el mismo contenido
+        for nombre in [campo.name, *medios.nombres_derivados(campo.name)]:
+            almacenamiento_medios.delete(nombre)
+        # Fecha distinta aunque el sistema de archivos tenga poca resolución
+        os.utime(self._imagen().path, (0, time.time() + 5))
+        self.assertEqual(medios.estado(campo), medios.PENDIENTE)
+        self.assertIsNone(medios.srcset_imagen(campo))
+
+    def test_variantes_de_imagen(self):
+        # Semitransparente y más ancha que el ancho mayor
+        imagen = Image.new('RGBA', (1600, 800), (255, 0, 0, 0))
+        imagen.paste((0, 0, 255, 255), (0, 0, 800, 800))
+        campo = self._imagen(imagen)
+        self.assertEqual(medios.estado(campo), medios.PENDIENTE)
+        medios.generador.vaciar()
+
+        for ancho in medios.ANCHOS_IMAGEN:
+            with self.subTest(ancho=ancho):
+                webp = self._abrir(medios.nombre_variante(campo.name, ancho, 'webp'))
+                jpg = self._abrir(medios.nombre_variante(campo.name, ancho, 'jpg'))
+                self.assertEqual(webp.size, (ancho, ancho // 2))
+                self.assertEqual((webp.format, webp.mode), ('WEBP', 'RGBA'))
+                self.assertEqual((jpg.format, jpg.mode, jpg.size), ('JPEG', 'RGB', (ancho, ancho // 2)))
+                # JPEG no tiene transparencia: la parte transparente queda blanca
+                self.assertTrue(all(canal > 240 for canal in jpg.getpixel((ancho - 1, 0))))
+        self.assertEqual(medios.estado(campo), medios.LISTO)
+        self.assertTrue(medios.url_imagen(campo, 500).endswith('.640w.jpg'))
+        self.assertEqual(medios.srcset_imagen(campo).count('w, '), len(medios.ANCHOS_IMAGEN) - 1)
+
+    def test_imagen_chica_y_girada(self):
+        # 60x40 con orientación EXIF 6 (girada 90°): las variantes se ven derechas y no se agrandan
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        campo = self._imagen(Image.new('RGB', (60, 40), 'green'), 'JPEG', exif=exif)
+        self.assertEqual(medios.url_imagen(campo, 320), campo.url)
+        medios.generador.vaciar()
+        for ancho in medios.ANCHOS_IMAGEN:
+            self.assertEqual(self._abrir(medios.nombre_variante(campo.name, ancho, 'jpg')).size, (40, 60))
+
+    def test_imagen_invalida(self):
+        campo = Tarjeta(id=1, baraja_id=1).imagen
+        campo.name = almacenamiento_medios.save('tarjetas/rota.png', ContentFile(b'no es una imagen'))
+        medios.estado(campo)
+        with self.assertLogs('core.medios', 'ERROR'):
+            medios.generador.vaciar()
+        self.assertEqual(medios.estado(campo), medios.FALLIDO)
+        self.assertEqual(medios.url_imagen(campo, 320), campo.url)
+
+    def test_audio_sin_ffmpeg(self):
+        with mock.patch.object(medios, 'FFMPEG', None):
+            campo = self._audio()
+            self.assertEqual(medios.estado(campo), medios.FALLIDO)
+            self.assertEqual(medios.url_audio(campo), campo.url)
+            self.assertTrue(medios.generador._cola.empty())
+
+    def test_audio_normalizado(self):
+        campo = self._audio()
+        resultado = subprocess.CompletedProcess([], 0, stdout=b'mp3 normalizado', stderr=b'')
+        with mock.patch.object(medios, 'FFMPEG', '/usr/bin/ffmpeg'), \
+                mock.patch.object(medios.subprocess, 'run', return_value=resultado) as run:
+            self.assertEqual(medios.url_audio(campo), campo.url)
+            medios.generador.vaciar()
+            self.assertEqual(medios.estado(campo), medios.LISTO)
+            self.assertTrue(medios.url_audio(campo).endswith('.normalizado.mp3'))
+        # El original entra por la entrada estándar de ffmpeg
+        self.assertEqual(run.call_args.args[0][0], '/usr/bin/ffmpeg')
+        self.assertEqual(run.call_args.kwargs['input'], b'RIFF audio')
+        with almacenamiento_medios.open(medios.nombre_audio_normalizado(campo.name), 'rb') as archivo:
+            self.assertEqual(archivo.read(), b'mp3 normalizado')
+
+    def test_audio_que_ffmpeg_no_puede_leer(self):
+        campo = self._audio()
+        error = subprocess.CalledProcessError(1, 'ffmpeg', stderr=b'Invalid data')
+        with mock.patch.object(medios, 'FFMPEG', '/usr/bin/ffmpeg'), \
+                mock.patch.object(medios.subprocess, 'run', side_effect=error):
+            medios.estado(campo)
+            with self.assertLogs('core.medios', 'ERROR'):
+                medios.generador.vaciar()
+            self.assertEqual(medios.estado(campo), medios.FALLIDO)
+        self.assertFalse(almacenamiento_medios.exists(medios.nombre_audio_normalizado(campo.name)))
@@ -13,9 +13,14 @@ urlpatterns = [
     path('', views.dashboard, name='dashboard'),
     path('barajas/', views.lista_barajas, name='lista_barajas'),
     path('estudiar/<int:baraja_id>/', views.estudiar_baraja, name='estudiar_baraja'),
+    path('estudiar/<int:baraja_id>/cola/', views.cola_estudio, name='cola_estudio'),
+    path('estudiar/<int:baraja_id>/paquete/', views.paquete_estudio, name='paquete_estudio'),
+    path('estudiar/<int:baraja_id>/sincronizar/', views.sincronizar_estudio, name='sincronizar_estudio'),
     path('calificar/<int:tarjeta_id>/', views.calificar_respuesta, name='calificar_respuesta'),
+    path('calificar-lote/', views.calificar_lote, name='calificar_lote'),
     path('buscar/', views.buscar_tarjetas, name='buscar_tarjetas'),
     path('importar-csv/', views.importar_csv, name='importar_csv'),
+    path('importar-csv/<int:importacion_id>/estado/', views.estado_importacion, name='estado_importacion'),
     path('exportar-csv/<int:baraja_id>/', views.exportar_csv, name='exportar_csv'),
     
     # Sistema de clases
@@ -26,4 +31,7 @@ urlpatterns = [
     
     # Cambiar rol
     path('cambiar-rol/', views.cambiar_rol, name='cambiar_rol'),
+    
+    # Mediciones de rendimiento (solo staff)
+    path('mediciones/', views.mediciones_vistas, name='mediciones_vistas'),
 ]
\ No newline at end of file
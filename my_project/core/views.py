@@ -1,70 +1,186 @@
 from django.contrib import messages
 from pyexpat.errors import messages
-from django.shortcuts import render, redirect, get_object_or_404
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core import signing
 from django.http import HttpResponse, JsonResponse
-from datetime import date
-from .models import Baraja, Clase, Tarea, Tarjeta, Programacion, HistorialRespuesta, Sesion
-from .scheduler import SchedulerSM2
-from .decorators import rol_requerido, solo_docente
+from django.db.models import Count, Exists, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+import json
+from asgiref.sync import sync_to_async
+from datetime import date, timedelta
+from django.utils import timezone
+from .models import Baraja, Clase, Tarea, Tarjeta, Programacion, HistorialRespuesta, Sesion, ImportacionCSV
+from .scheduler import CAMPOS_SM2, CursorCola, SchedulerSM2
+from .decorators import lectura_en_replica, rol_requerido, solo_docente
+from .etiquetas import normalizar_etiquetas
+from . import busqueda, escritor_historial, estadisticas, exportador, fragmentos, importador, instrumentacion, paquetes, pendientes, progreso, rachas, sesiones
 
 # Vista principal - Lista de barajas del usuario
 @login_required  # Requiere que el usuario esté autenticado
 def lista_barajas(request):
     """
-    Muestra todas las barajas del usuario actual.
+    Muestra todas las barajas del usuario actual con sus tarjetas pendientes de hoy.
     """
-    barajas = Baraja.objects.filter(propietario=request.user)  # Filtrar barajas del usuario
+    from django.db.models import Count
+    
+    # Filtrar barajas del usuario, con el total de tarjetas contado en la misma consulta
+    barajas = list(
+        Baraja.objects.filter(propietario=request.user).annotate(total_tarjetas=Count('tarjetas'))
+    )
+    
+    # Pendientes de hoy desde el resumen diario (una fila por baraja)
+    pendientes_por_baraja = pendientes.obtener_pendientes_por_baraja(request.user)
+    for baraja in barajas:
+        baraja.pendientes_hoy = pendientes_por_baraja.get(baraja.id, 0)
+    
     return render(request, 'core/lista_barajas.html', {'barajas': barajas})
 
 
+# Cantidad de tarjetas que se envían al navegador en cada lote de estudio
+TAMANO_LOTE_ESTUDIO = 20
+
+
+# Firma de los cursores de la cola: el cliente no puede cambiar cuánto queda de cada límite
+_firmador_cursor = signing.Signer(salt='core.cola_estudio.cursor')
+
+
+def _cursor_a_texto(cursor):
+    """
+    Codifica un CursorCola como 'AAAA-MM-DD_ease_id_idnueva_repasos_nuevas:firma'
+    (las posiciones que aún no existen quedan vacías).
+    """
+    if cursor is None:
+        return None
+    fecha, ease, repaso_id, nueva_id, repasos, nuevas = cursor
+    partes = [fecha.isoformat() if fecha else None, repr(ease) if ease is not None else None,
+              repaso_id, nueva_id, repasos, nuevas]
+    return _firmador_cursor.sign('_'.join('' if parte is None else str(parte) for parte in partes))
+
+
+def _texto_a_cursor(texto):
+    """
+    Decodifica un cursor de _cursor_a_texto. Lanza ValueError si el formato o la firma son inválidos.
+    """
+    try:
+        texto = _firmador_cursor.unsign(texto)
+    except signing.BadSignature:
+        raise ValueError('Cursor con firma inválida')
+    fecha, ease, repaso_id, nueva_id, repasos, nuevas = texto.split('_')
+    return CursorCola(
+        date.fromisoformat(fecha) if fecha else None,
+        float(ease) if ease else None,
+        int(repaso_id) if repaso_id else None,
+        int(nueva_id) if nueva_id else None,
+        max(int(repasos), 0),
+        max(int(nuevas), 0),
+    )
+
+
 # Vista para estudiar una baraja
 @login_required
 def estudiar_baraja(request, baraja_id):
     """
-    Muestra las tarjetas pendientes de una baraja para estudiar hoy.
+    Muestra la página de estudio con el primer lote de tarjetas pendientes.
+    Los lotes siguientes se piden a cola_estudio mientras el usuario estudia.
     """
     baraja = get_object_or_404(Baraja, id=baraja_id)  # Obtener baraja o error 404
+    etiqueta = request.GET.get('etiqueta', '')  # Estudiar solo las tarjetas con estas etiquetas
     
-    # Obtener tarjetas pendientes para hoy usando el scheduler
-    tarjetas_pendientes = SchedulerSM2.obtener_tarjetas_pendientes(request.user, baraja)
+    # Solo el primer lote: el tiempo de carga no depende de cuántas tarjetas haya pendientes
+    # Solo los ids: el contenido de las tarjetas sale de la caché compartida por todos los usuarios
+    lote, siguiente = SchedulerSM2.obtener_lote_pendientes(
+        request.user, baraja, limite=TAMANO_LOTE_ESTUDIO, etiquetas=normalizar_etiquetas(etiqueta), campos=['id']
+    )
     
     context = {
         'baraja': baraja,
-        'tarjetas': tarjetas_pendientes,
-        'total_pendientes': tarjetas_pendientes.count()
+        'etiqueta': etiqueta,
+        'tarjetas': fragmentos.tarjetas_estudio(baraja, [t.id for t in lote]),
+        'siguiente_cursor': _cursor_a_texto(siguiente),
+        'hay_mas': siguiente is not None,
+        'max_calificaciones_lote': MAX_CALIFICACIONES_LOTE,
     }
     
     return render(request, 'core/estudiar_baraja.html', context)
 
 
-# Vista para calificar una respuesta (AJAX)
+# Vista para obtener el siguiente lote de tarjetas pendientes (AJAX, async)
 @login_required
-def calificar_respuesta(request, tarjeta_id):
+async def cola_estudio(request, baraja_id):
+    """
+    Devuelve el siguiente lote de la cola de estudio (repasos y nuevas, con los límites diarios).
+    Parámetros GET: cursor (opcional, devuelto por el lote anterior), limite y etiqueta.
+    Es async: con ASGI las consultas no ocupan un hilo por petición.
+    """
+    baraja = await aget_object_or_404(Baraja, id=baraja_id)
+    
+    try:
+        cursor = _texto_a_cursor(request.GET['cursor']) if request.GET.get('cursor') else None
+        limite = min(int(request.GET.get('limite', TAMANO_LOTE_ESTUDIO)), 100)  # Máximo 100 por lote
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Parámetros inválidos'}, status=400)
+    
+    lote, siguiente = await SchedulerSM2.aobtener_lote_pendientes(
+        await request.auser(), baraja, cursor=cursor, limite=max(limite, 1),
+        etiquetas=normalizar_etiquetas(request.GET.get('etiqueta', '')), campos=['id']
+    )
+    
+    return JsonResponse({
+        'success': True,
+        'tarjetas': await fragmentos.atarjetas_estudio(baraja, [t.id for t in lote]),
+        'siguiente': _cursor_a_texto(siguiente),
+    })
+
+
+# Vista para calificar una respuesta (AJAX, async)
+@login_required
+async def calificar_respuesta(request, tarjeta_id):
     """
     Procesa la calificación de una tarjeta y actualiza el scheduler SM-2.
+    Es async y no espera al historial: la respuesta se encola en el escritor
+    en segundo plano, que la guarda en lotes (ver core/escritor_historial.py).
     """
     if request.method == 'POST':
-        tarjeta = get_object_or_404(Tarjeta, id=tarjeta_id)
-        calificacion = int(request.POST.get('calificacion'))  # 1, 2, 3 o 4
-        tiempo_respuesta = int(request.POST.get('tiempo', 0))  # Segundos que tardó
+        usuario = await request.auser()
+        tarjeta = await aget_object_or_404(Tarjeta, id=tarjeta_id)
+        try:
+            calificacion = int(request.POST.get('calificacion'))  # 1, 2, 3 o 4
+            tiempo_respuesta = int(request.POST.get('tiempo', 0))  # Segundos que tardó
+        except (TypeError, ValueError):
+            return JsonResponse({'success': False, 'error': 'Formato de respuesta inválido'}, status=400)
+        # Antes de escribir nada: fuera de 1-4 no hay campo de estadísticas que sumar
+        if calificacion not in (1, 2, 3, 4):
+            return JsonResponse({'success': False, 'error': 'Calificación inválida'}, status=400)
         
-        # Obtener o crear la programación de la tarjeta
-        programacion, created = Programacion.objects.get_or_create(
+        # Obtener o crear la programación del usuario para esta tarjeta
+        programacion, created = await Programacion.objects.aget_or_create(
+            usuario=usuario,
             tarjeta=tarjeta,
             defaults={'proximo_estudio': date.today()}
         )
+        era_pendiente = not created and programacion.proximo_estudio <= date.today()
         
-        # Aplicar el algoritmo SM-2
-        programacion = SchedulerSM2.calcular_siguiente_revision(programacion, calificacion)
+        # Aplicar el algoritmo SM-2 en memoria y guardar solo sus campos
+        SchedulerSM2.calcular_siguiente_revision(programacion, calificacion, guardar=False)
+        await programacion.asave(update_fields=CAMPOS_SM2)
         
-        # Guardar el historial de respuesta
-        HistorialRespuesta.objects.create(
-            usuario=request.user,
+        # El historial se guarda en segundo plano (la fecha queda fijada ahora)
+        escritor_historial.escritor.agregar(HistorialRespuesta(
+            usuario=usuario,
             tarjeta=tarjeta,
             calificacion=calificacion,
             tiempo_respuesta_segundos=tiempo_respuesta
+        ))
+        
+        # Actualizar las estadísticas del dashboard en caché y los pendientes por baraja
+        await sync_to_async(estadisticas.registrar_respuestas)(
+            usuario, [calificacion], pendientes_resueltas=int(era_pendiente)
         )
+        await sync_to_async(pendientes.registrar_respuestas)(usuario, {tarjeta.baraja_id: int(era_pendiente)})
+        # Racha de días de estudio (solo la primera respuesta del día escribe)
+        await sync_to_async(rachas.registrar_estudio)(usuario.id)
         
         # Retornar respuesta JSON con la info actualizada
         return JsonResponse({
@@ -77,62 +193,231 @@ def calificar_respuesta(request, tarjeta_id):
     return JsonResponse({'success': False, 'error': 'Método no permitido'})
 
 
-# Vista del dashboard del usuario
+# Máximo de calificaciones aceptadas en un solo lote
+MAX_CALIFICACIONES_LOTE = 500
+
+# Antigüedad máxima de la fecha de una respuesta de calificar_lote (el navegador
+# las junta en una cola y las reintenta si falla la red)
+ANTIGUEDAD_MAXIMA_LOTE = timedelta(days=1)
+
+
+def _leer_fecha(texto, desde, hasta):
+    """
+    Fecha ISO 8601 con zona horaria de una respuesta, acotada a [desde, hasta]
+    (el cliente no puede adelantar ni atrasar respuestas fuera de ese rango).
+    Retorna: datetime, o None si no vino. Lanza ValueError si es inválida.
+    """
+    if texto is None:
+        return None
+    fecha = paquetes.leer_fecha(texto)
+    return min(max(fecha, desde), hasta)
+
+
+def _leer_respuestas(lista, desde=None):
+    """
+    Valida la lista de respuestas de un lote ([{"tarjeta_id", "calificacion", "tiempo"}, ...]).
+    Si se indica desde (un datetime), cada respuesta puede traer además
+    "fecha", el momento en que se dio, que se acota entre desde y ahora.
+    Retorna: (lista de tuplas (tarjeta_id, calificacion, tiempo, fecha o None), None)
+             o (None, mensaje de error)
+    """
+    ahora = timezone.now()
+    try:
+        respuestas = [
+            (
+                int(r['tarjeta_id']), int(r['calificacion']), int(r.get('tiempo', 0)),
+                _leer_fecha(r.get('fecha'), desde, ahora) if desde is not None else None,
+            )
+            for r in lista
+        ]
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return None, 'Formato de lote inválido'
+    
+    if len(respuestas) > MAX_CALIFICACIONES_LOTE:
+        return None, f'El lote no puede tener más de {MAX_CALIFICACIONES_LOTE} respuestas'
+    
+    if any(r[1] not in (1, 2, 3, 4) for r in respuestas):
+        return None, 'Calificación inválida'
+    
+    return respuestas, None
+
+
+def _aplicar_respuestas(usuario, respuestas, tarjetas=None):
+    """
+    Aplica SM-2 a las respuestas de tarjetas existentes (de tarjetas, un queryset, si se indica)
+    y actualiza estadísticas, pendientes, progreso, racha y sesiones.
+    respuestas: tuplas de _leer_respuestas; las que no traen fecha se dan por respondidas ahora.
+    Retorna: (ids de tarjetas no encontradas, dict {tarjeta_id: Programacion}, cantidad procesada)
+    """
+    if tarjetas is None:
+        tarjetas = Tarjeta.objects.all()
+    
+    # Descartar tarjetas que ya no existen (una sola consulta, que trae la baraja para las sesiones)
+    barajas = dict(
+        tarjetas.filter(id__in={r[0] for r in respuestas}).values_list('id', 'baraja_id')
+    )
+    existentes = barajas.keys()
+    # La fecha de cada respuesta se fija aquí: la misma va al historial, a la racha y a las sesiones
+    ahora = timezone.now()
+    validas = [
+        (tarjeta_id, calificacion, tiempo, fecha or ahora)
+        for tarjeta_id, calificacion, tiempo, fecha in respuestas
+        if tarjeta_id in existentes
+    ]
+    
+    programaciones = {}
+    if validas:
+        programaciones, pendientes_resueltas = SchedulerSM2.calificar_lote(usuario, validas)
+        # Los contadores son del día: no cuentan las respuestas sin conexión de días anteriores
+        hoy = timezone.localdate(ahora)
+        estadisticas.registrar_respuestas(
+            usuario,
+            [calificacion for _, calificacion, _, fecha in validas if timezone.localdate(fecha) == hoy],
+            pendientes_resueltas=sum(pendientes_resueltas.values())
+        )
+        pendientes.registrar_respuestas(usuario, pendientes_resueltas)
+        progreso.registrar_respuestas(usuario, programaciones.keys())
+        rachas.registrar_estudios(usuario.id, [r[3] for r in validas])
+        if sesiones.AL_CALIFICAR:
+            # Después del historial, con las fechas con que quedó guardado
+            sesiones.agrupar_respuestas(
+                usuario.id, sorted(((r[3], barajas[r[0]]) for r in validas), key=lambda r: r[0])
+            )
+    
+    return sorted({r[0] for r in respuestas} - existentes), programaciones, len(validas)
+
+
+# Vista para calificar varias respuestas de una vez (AJAX)
 @login_required
-def dashboard(request):
+def calificar_lote(request):
     """
-    Muestra estadísticas generales del usuario: barajas, tarjetas estudiadas, racha, etc.
+    Procesa un lote de calificaciones en una sola transacción.
+    Cuerpo JSON esperado: {"respuestas": [{"tarjeta_id": 1, "calificacion": 3, "tiempo": 5,
+    "fecha": "2024-05-01T10:00:00Z"}, ...]}
+    fecha (opcional) es cuándo se respondió, hasta ANTIGUEDAD_MAXIMA_LOTE atrás: las
+    sesiones de estudio se arman con ella.
     """
-    # Obtener todas las barajas del usuario
-    barajas = Baraja.objects.filter(propietario=request.user)
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'Método no permitido'})
     
-    # Total de tarjetas en todas las barajas
-    total_tarjetas = Tarjeta.objects.filter(baraja__propietario=request.user).count()
+    # Leer y validar el cuerpo de la petición
+    try:
+        datos = json.loads(request.body)
+        respuestas, error = _leer_respuestas(datos['respuestas'], desde=timezone.now() - ANTIGUEDAD_MAXIMA_LOTE)
+    except (ValueError, KeyError, TypeError):
+        respuestas, error = None, 'Formato de lote inválido'
+    if error:
+        return JsonResponse({'success': False, 'error': error}, status=400)
+    
+    no_encontradas, programaciones, procesadas = _aplicar_respuestas(request.user, respuestas)
+    
+    return JsonResponse({
+        'success': True,
+        'procesadas': procesadas,
+        'no_encontradas': no_encontradas,
+        'programaciones': {
+            str(tarjeta_id): {
+                'proximo_estudio': p.proximo_estudio.strftime('%Y-%m-%d'),
+                'intervalo': p.intervalo,
+                'ease_factor': p.ease_factor
+            }
+            for tarjeta_id, p in programaciones.items()
+        }
+    })
+
+
+def _barajas_de_estudio(usuario):
+    """
+    Retorna: queryset de las barajas que el usuario puede descargar y
+    sincronizar: las suyas y las asignadas como tarea en clases de las que es
+    alumno o docente.
+    """
+    tareas = Tarea.objects.filter(baraja=OuterRef('pk')).filter(
+        Q(clase__alumnos=usuario) | Q(clase__docente=usuario)
+    )
+    return Baraja.objects.filter(Q(propietario=usuario) | Exists(tareas))
+
+
+# Vista para descargar una baraja y estudiarla sin conexión
+@login_required
+def paquete_estudio(request, baraja_id):
+    """
+    Devuelve el paquete de estudio sin conexión de la baraja: tarjetas (con las
+    URLs de imagen y audio), la programación SM-2 del usuario y los límites
+    diarios restantes, con la versión a enviar en la próxima sincronización.
+    En JSON, o en MessagePack con ?formato=msgpack o Accept: application/msgpack.
+    """
+    baraja = get_object_or_404(_barajas_de_estudio(request.user), id=baraja_id)
+    return paquetes.responder(request, paquetes.armar_paquete(request.user, baraja))
+
+
+# Vista para sincronizar lo estudiado sin conexión
+@login_required
+def sincronizar_estudio(request, baraja_id):
+    """
+    Aplica las respuestas dadas sin conexión y devuelve solo lo que cambió desde
+    la versión del cliente (ver core/paquetes.py).
+    Cuerpo (JSON o MessagePack): {"version": "<versión firmada del paquete>", "respuestas": [{"tarjeta_id": 1, "calificacion": 3, "tiempo": 5,
+    "fecha": "2024-05-01T10:00:00+00:00"}, ...]}
+    Las respuestas se aplican en orden al recibirlas: la programación que calcula el servidor es la que vale.
+    fecha (opcional) es cuándo se respondió sin conexión; se acota entre la versión del paquete y ahora,
+    y sin ella se usa el momento de la sincronización.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'Método no permitido'}, status=405)
     
-    # Tarjetas pendientes hoy (en todas las barajas)
-    hoy = date.today()
-    tarjetas_pendientes = Programacion.objects.filter(
-        tarjeta__baraja__propietario=request.user,
-        proximo_estudio__lte=hoy
-    ).count()
+    baraja = get_object_or_404(_barajas_de_estudio(request.user), id=baraja_id)
     
-    # Tarjetas estudiadas hoy (contar respuestas de hoy)
-    from datetime import datetime
-    tarjetas_estudiadas_hoy = HistorialRespuesta.objects.filter(
-        usuario=request.user,
-        fecha_respuesta__date=hoy
-    ).count()
+    try:
+        datos = paquetes.leer_cuerpo(request)
+        version = paquetes.leer_version(datos['version'])
+        respuestas, error = _leer_respuestas(datos.get('respuestas', []), desde=version)
+    except (ValueError, KeyError, TypeError, AttributeError):
+        respuestas, error = None, 'Formato de sincronización inválido'
+    if error:
+        return paquetes.responder(request, {'success': False, 'error': error}, status=400)
+    
+    # Solo se aceptan respuestas de tarjetas de esta baraja
+    no_encontradas, _, procesadas = _aplicar_respuestas(request.user, respuestas, tarjetas=baraja.tarjetas.all())
+    
+    # Se relee la baraja: otra petición pudo cambiar su versión mientras tanto
+    baraja.refresh_from_db(fields=['fecha_modificacion'])
+    return paquetes.responder(request, {
+        'success': True,
+        'procesadas': procesadas,
+        'no_encontradas': no_encontradas,
+        **paquetes.armar_diferencias(request.user, baraja, version),
+    })
+
+
+# Vista del dashboard del usuario
+@login_required
+@lectura_en_replica
+def dashboard(request):
+    """
+    Muestra estadísticas generales del usuario: barajas, tarjetas estudiadas, racha, etc.
+    """
+    # Totales, pendientes y respuestas de hoy (desde la caché por usuario)
+    stats = estadisticas.obtener_estadisticas(request.user)
     
-    # Sesiones recientes (últimas 5)
-    sesiones_recientes = Sesion.objects.filter(usuario=request.user).order_by('-fecha_inicio')[:5]
+    # Sesiones recientes (últimas 5), ya agrupadas por core/sesiones.py (índice usuario+fecha_inicio)
+    sesiones_recientes = Sesion.objects.filter(usuario=request.user).select_related('baraja').order_by('-fecha_inicio')[:5]
     
     # Obtener perfil del usuario para la racha
     perfil = request.user.perfil if hasattr(request.user, 'perfil') else None
     
-    # Calcular estadísticas de respuestas de hoy
-    respuestas_hoy = HistorialRespuesta.objects.filter(
-        usuario=request.user,
-        fecha_respuesta__date=hoy
-    )
-    
-    # Contar por tipo de calificación
-    otra_vez = respuestas_hoy.filter(calificacion=1).count()
-    dificil = respuestas_hoy.filter(calificacion=2).count()
-    bien = respuestas_hoy.filter(calificacion=3).count()
-    facil = respuestas_hoy.filter(calificacion=4).count()
-    
     context = {
-        'total_barajas': barajas.count(),
-        'total_tarjetas': total_tarjetas,
-        'tarjetas_pendientes': tarjetas_pendientes,
-        'tarjetas_estudiadas_hoy': tarjetas_estudiadas_hoy,
+        'total_barajas': stats['total_barajas'],
+        'total_tarjetas': stats['total_tarjetas'],
+        'tarjetas_pendientes': stats['tarjetas_pendientes'],
+        'tarjetas_estudiadas_hoy': stats['tarjetas_estudiadas_hoy'],
         'sesiones_recientes': sesiones_recientes,
-        'racha_dias': perfil.racha_dias if perfil else 0,
+        'racha_dias': rachas.racha_vigente(perfil) if perfil else 0,
         'estadisticas_hoy': {
-            'otra_vez': otra_vez,
-            'dificil': dificil,
-            'bien': bien,
-            'facil': facil,
+            'otra_vez': stats['otra_vez'],
+            'dificil': stats['dificil'],
+            'bien': stats['bien'],
+            'facil': stats['facil'],
         }
     }
     
@@ -140,37 +425,29 @@ def dashboard(request):
 
 # Vista para buscar tarjetas
 @login_required
+@lectura_en_replica
 def buscar_tarjetas(request):
     """
     Busca tarjetas por texto en anverso/reverso o por etiquetas.
+    Los resultados se ordenan por relevancia y se muestran por páginas.
     """
+    from django.core.paginator import Paginator
+    
     query = request.GET.get('q', '')  # Obtener el término de búsqueda de la URL
-    resultados = []
-    
-    if query:
-        # Buscar en tarjetas del usuario (en anverso, reverso o etiquetas)
-        resultados = Tarjeta.objects.filter(
-            baraja__propietario=request.user  # Solo tarjetas del usuario
-        ).filter(
-            # Buscar en anverso O reverso O etiquetas
-            anverso__icontains=query  # icontains = insensible a mayúsculas
-        ) | Tarjeta.objects.filter(
-            baraja__propietario=request.user
-        ).filter(
-            reverso__icontains=query
-        ) | Tarjeta.objects.filter(
-            baraja__propietario=request.user
-        ).filter(
-            etiquetas__icontains=query
-        )
-        
-        # Eliminar duplicados y ordenar
-        resultados = resultados.distinct().order_by('baraja__titulo', 'anverso')
+    etiqueta = request.GET.get('etiqueta', '')  # Filtro opcional por etiquetas (separadas por comas)
+    pagina = None
+    
+    if query or etiqueta:
+        # Búsqueda de texto completo y filtro de etiquetas (índices GIN), ordenada por relevancia
+        resultados = busqueda.buscar_tarjetas(request.user, query, normalizar_etiquetas(etiqueta))
+        pagina = Paginator(resultados, busqueda.RESULTADOS_POR_PAGINA).get_page(request.GET.get('pagina'))
     
     context = {
         'query': query,
-        'resultados': resultados,
-        'total_resultados': resultados.count() if resultados else 0
+        'etiqueta': etiqueta,
+        'resultados': pagina.object_list if pagina else [],
+        'pagina': pagina,
+        'total_resultados': pagina.paginator.count if pagina else 0
     }
     
     return render(request, 'core/buscar_tarjetas.html', context)
@@ -183,9 +460,6 @@ def importar_csv(request):
     Formato esperado: anverso,reverso,etiquetas,baraja_id
     """
     if request.method == 'POST':
-        import csv
-        from io import StringIO
-        
         # Obtener el archivo subido
         csv_file = request.FILES.get('archivo_csv')
         baraja_id = request.POST.get('baraja_id')
@@ -211,39 +485,18 @@ def importar_csv(request):
                 'barajas': Baraja.objects.filter(propietario=request.user)
             })
         
+        # Los archivos grandes se procesan en segundo plano; la página consulta el avance
+        if csv_file.size > importador.UMBRAL_SEGUNDO_PLANO:
+            importacion = importador.encolar_importacion(csv_file, baraja, request.user)
+            return render(request, 'core/importar_csv.html', {
+                'importacion': importacion,
+                'barajas': Baraja.objects.filter(propietario=request.user)
+            })
+        
         # Leer el archivo CSV
         try:
-            # Decodificar el archivo
-            file_data = csv_file.read().decode('utf-8')
-            csv_data = StringIO(file_data)
-            reader = csv.DictReader(csv_data)
-            
-            tarjetas_creadas = 0
-            errores = []
-            
-            # Procesar cada fila del CSV
-            for row_num, row in enumerate(reader, start=2):  # start=2 porque la fila 1 es el encabezado
-                try:
-                    anverso = row.get('anverso', '').strip()
-                    reverso = row.get('reverso', '').strip()
-                    etiquetas = row.get('etiquetas', '').strip()
-                    
-                    # Validar que tenga al menos anverso y reverso
-                    if not anverso or not reverso:
-                        errores.append(f'Fila {row_num}: Falta anverso o reverso')
-                        continue
-                    
-                    # Crear la tarjeta
-                    Tarjeta.objects.create(
-                        baraja=baraja,
-                        anverso=anverso,
-                        reverso=reverso,
-                        etiquetas=etiquetas
-                    )
-                    tarjetas_creadas += 1
-                    
-                except Exception as e:
-                    errores.append(f'Fila {row_num}: {str(e)}')
+            # Decodificar e insertar el archivo por lotes
+            tarjetas_creadas, errores = importador.importar_archivo(csv_file, baraja, request.user)
             
             # Mostrar resultado
             mensaje_exito = f'✅ Se importaron {tarjetas_creadas} tarjetas correctamente'
@@ -253,6 +506,13 @@ def importar_csv(request):
                 'barajas': Baraja.objects.filter(propietario=request.user)
             })
             
+        except importador.ImportacionInterrumpida as e:
+            # Los lotes anteriores al error quedaron importados: decir cuántos
+            return render(request, 'core/importar_csv.html', {
+                'error': f'Error al procesar el archivo. {e}',
+                'errores': e.errores or None,
+                'barajas': Baraja.objects.filter(propietario=request.user)
+            })
         except Exception as e:
             return render(request, 'core/importar_csv.html', {
                 'error': f'Error al procesar el archivo: {str(e)}',
@@ -264,14 +524,33 @@ def importar_csv(request):
         'barajas': Baraja.objects.filter(propietario=request.user)
     })
 
+# Vista para consultar el avance de una importación en segundo plano (AJAX)
+@login_required
+def estado_importacion(request, importacion_id):
+    """
+    Devuelve el estado y el avance de una importación CSV del usuario.
+    """
+    importacion = get_object_or_404(ImportacionCSV, id=importacion_id, usuario=request.user)
+    
+    return JsonResponse({
+        'estado': importacion.estado,
+        'estado_display': importacion.get_estado_display(),
+        'porcentaje': importacion.porcentaje,
+        'filas_procesadas': importacion.filas_procesadas,
+        'tarjetas_creadas': importacion.tarjetas_creadas,
+        'errores': importacion.errores,
+        'mensaje_error': importacion.mensaje_error,
+    })
+
 # Vista para exportar tarjetas a CSV
 @login_required
+@lectura_en_replica
 def exportar_csv(request, baraja_id):
     """
     Exporta todas las tarjetas de una baraja a formato CSV.
+    El archivo se envía en streaming; con ?gzip=1 se descarga comprimido (.csv.gz).
     """
-    import csv
-    from django.http import HttpResponse
+    from django.http import StreamingHttpResponse
     
     # Obtener la baraja (verificar que pertenece al usuario)
     try:
@@ -279,30 +558,15 @@ def exportar_csv(request, baraja_id):
     except Baraja.DoesNotExist:
         return HttpResponse('Baraja no encontrada', status=404)
     
-    # Crear la respuesta HTTP como archivo CSV
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = f'attachment; filename="{baraja.titulo}.csv"'
-    
-    # Configurar para usar UTF-8 con BOM (para que Excel lo abra correctamente)
-    response.write('\ufeff')  # BOM para UTF-8
-    
-    # Crear el escritor CSV
-    writer = csv.writer(response)
-    
-    # Escribir encabezados
-    writer.writerow(['anverso', 'reverso', 'etiquetas', 'extra', 'tipo'])
-    
-    # Escribir todas las tarjetas de la baraja
-    tarjetas = Tarjeta.objects.filter(baraja=baraja).order_by('fecha_creacion')
+    # Generar el CSV fila a fila (la memoria no crece con el tamaño de la baraja)
+    contenido = exportador.generar_csv(baraja)
     
-    for tarjeta in tarjetas:
-        writer.writerow([
-            tarjeta.anverso,
-            tarjeta.reverso,
-            tarjeta.etiquetas,
-            tarjeta.extra,
-            tarjeta.tipo
-        ])
+    if request.GET.get('gzip') == '1':
+        response = StreamingHttpResponse(exportador.comprimir_gzip(contenido), content_type='application/gzip')
+        response['Content-Disposition'] = f'attachment; filename="{baraja.titulo}.csv.gz"'
+    else:
+        response = StreamingHttpResponse(contenido, content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="{baraja.titulo}.csv"'
     
     return response
 
@@ -313,12 +577,18 @@ def exportar_csv(request, baraja_id):
 def mis_clases(request):
     """
     Muestra las clases donde el usuario es docente o alumno.
+    Los conteos de alumnos y tareas vienen anotados en la misma consulta.
     """
     # Clases donde soy docente
-    clases_docente = Clase.objects.filter(docente=request.user)
+    clases_docente = Clase.objects.filter(docente=request.user).annotate(
+        total_alumnos=_contar_por_clase(Clase.alumnos.through),
+        total_tareas=_contar_por_clase(Tarea),
+    )
     
-    # Clases donde soy alumno
-    clases_alumno = Clase.objects.filter(alumnos=request.user)
+    # Clases donde soy alumno (con su docente en la misma consulta)
+    clases_alumno = Clase.objects.filter(alumnos=request.user).select_related('docente').annotate(
+        total_tareas=_contar_por_clase(Tarea),
+    )
     
     context = {
         'clases_docente': clases_docente,
@@ -328,31 +598,50 @@ def mis_clases(request):
     return render(request, 'core/mis_clases.html', context)
 
 
+def _contar_por_clase(modelo):
+    """
+    Subconsulta con la cantidad de filas de modelo (con campo clase) de cada clase.
+    Una subconsulta por conteo evita el producto alumnos x tareas de dos JOIN.
+    """
+    filas = modelo.objects.filter(clase=OuterRef('pk')).order_by().values('clase')
+    return Coalesce(Subquery(filas.annotate(total=Count('*')).values('total')), 0)
+
+
 # Vista para ver detalles de una clase
 @login_required
 def detalle_clase(request, clase_id):
     """
     Muestra los detalles de una clase: alumnos, tareas, etc.
+    La cantidad de consultas no depende de cuántos alumnos o tareas tenga la clase.
     """
-    from django.shortcuts import get_object_or_404
-    
-    clase = get_object_or_404(Clase, id=clase_id)
+    clase = get_object_or_404(
+        Clase.objects.select_related('docente').annotate(
+            total_alumnos=_contar_por_clase(Clase.alumnos.through),
+            total_tareas=_contar_por_clase(Tarea),
+        ),
+        id=clase_id
+    )
     
-    # Verificar que el usuario es docente o alumno de la clase
-    es_docente = clase.docente == request.user
-    es_alumno = request.user in clase.alumnos.all()
+    # Verificar que el usuario es docente o alumno de la clase (sin cargar la lista de alumnos)
+    es_docente = clase.docente_id == request.user.id
+    es_alumno = clase.alumnos.filter(id=request.user.id).exists()
     
     if not (es_docente or es_alumno):
         return HttpResponse('No tienes acceso a esta clase', status=403)
     
-    # Obtener tareas de la clase
-    tareas = Tarea.objects.filter(clase=clase).order_by('-fecha_creacion')
+    # Obtener tareas de la clase, con su baraja y su cantidad de tarjetas
+    # (la fecha de modificación de la baraja es parte de la clave en caché)
+    tareas = Tarea.objects.filter(clase=clase).select_related('baraja').annotate(
+        total_tarjetas=Count('baraja__tarjetas')
+    ).order_by('-fecha_creacion')
     
     context = {
         'clase': clase,
         'es_docente': es_docente,
         'es_alumno': es_alumno,
+        'alumnos': clase.alumnos.only('id', 'username').order_by('username'),
         'tareas': tareas,
+        'today': date.today(),
     }
     
     return render(request, 'core/detalle_clase.html', context)
@@ -371,13 +660,13 @@ def unirse_clase(request):
             clase = Clase.objects.get(codigo_invitacion=codigo)
             
             # Verificar que no sea el docente
-            if clase.docente == request.user:
+            if clase.docente_id == request.user.id:
                 return render(request, 'core/unirse_clase.html', {
                     'error': 'No puedes unirte a tu propia clase como alumno'
                 })
             
             # Verificar que no esté ya inscrito
-            if request.user in clase.alumnos.all():
+            if clase.alumnos.filter(id=request.user.id).exists():
                 return render(request, 'core/unirse_clase.html', {
                     'error': 'Ya estás inscrito en esta clase'
                 })
@@ -401,6 +690,7 @@ def unirse_clase(request):
 # Vista para ver progreso de alumnos (solo docentes)
 @login_required
 @solo_docente
+@lectura_en_replica
 def progreso_clase(request, clase_id):
     """
     Muestra el progreso de todos los alumnos en las tareas de la clase.
@@ -410,38 +700,8 @@ def progreso_clase(request, clase_id):
     
     clase = get_object_or_404(Clase, id=clase_id, docente=request.user)
     
-    # Obtener todas las tareas de la clase
-    tareas = Tarea.objects.filter(clase=clase)
-    
-    # Obtener progreso de cada alumno
-    alumnos_progreso = []
-    
-    for alumno in clase.alumnos.all():
-        # Contar tarjetas estudiadas de cada tarea
-        progreso_tareas = []
-        
-        for tarea in tareas:
-            # Contar cuántas tarjetas de la baraja de la tarea ha estudiado el alumno
-            tarjetas_estudiadas = HistorialRespuesta.objects.filter(
-                usuario=alumno,
-                tarjeta__baraja=tarea.baraja,
-                fecha_respuesta__gte=tarea.fecha_creacion
-            ).values('tarjeta').distinct().count()
-            
-            total_tarjetas = tarea.baraja.tarjetas.count()
-            porcentaje = (tarjetas_estudiadas / total_tarjetas * 100) if total_tarjetas > 0 else 0
-            
-            progreso_tareas.append({
-                'tarea': tarea,
-                'estudiadas': tarjetas_estudiadas,
-                'total': total_tarjetas,
-                'porcentaje': round(porcentaje, 1)
-            })
-        
-        alumnos_progreso.append({
-            'alumno': alumno,
-            'progreso_tareas': progreso_tareas
-        })
+    # Leer el reporte materializado (se mantiene al día cuando los alumnos responden)
+    tareas, alumnos_progreso = progreso.obtener_progreso_clase(clase)
     
     context = {
         'clase': clase,
@@ -451,6 +711,28 @@ def progreso_clase(request, clase_id):
     
     return render(request, 'core/progreso_clase.html', context)
 
+# Vista con las mediciones de rendimiento por vista (solo staff)
+@staff_member_required
+def mediciones_vistas(request):
+    """
+    Devuelve el resumen por vista de las peticiones medidas por
+    InstrumentacionMiddleware en este proceso, y las más recientes.
+    Parámetro GET: recientes (cuántas mediciones individuales incluir, 50 por defecto).
+    """
+    try:
+        recientes = max(int(request.GET.get('recientes', 50)), 0)
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Parámetros inválidos'}, status=400)
+    
+    mediciones = instrumentacion.registro.mediciones()
+    
+    return JsonResponse({
+        'success': True,
+        'mediciones': len(mediciones),
+        'vistas': instrumentacion.registro.resumen(),
+        'recientes': mediciones[-recientes:] if recientes else [],
+    })
+
 # Vista para cambiar el rol del usuario (solo para pruebas/demo)
 @login_required
 def cambiar_rol(request):
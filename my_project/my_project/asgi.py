@@ -5,6 +5,10 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+Las vistas de estudio (cola_estudio, calificar_respuesta) son async; con un
+servidor ASGI (por ejemplo: uvicorn my_project.asgi:application) un solo
+worker atiende muchas peticiones concurrentes sin un hilo por petición.
 """
 
 import os
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -37,15 +38,18 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',  # Búsqueda de texto completo e índices GIN
     'core'      #app
 ]
 
 MIDDLEWARE = [
+    'core.instrumentacion.InstrumentacionMiddleware',  # Primero, para medir también los demás middlewares
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.replicas.FijarPrimariaMiddleware',  # Después de AuthenticationMiddleware (usa request.user)
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -56,13 +60,19 @@ TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [BASE_DIR / 'templates'],  # Indicar dónde están los templates
-        'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
             ],
+            # Las plantillas se compilan una vez por proceso (en desarrollo se recargan al cambiar)
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
         },
     },
 ]
@@ -84,6 +94,40 @@ DATABASES = {
     }
 }
 
+# Réplicas de lectura para las vistas con @lectura_en_replica (ver core/replicas.py).
+# Localmente 'replica' es otra conexión a la misma base de datos; en producción
+# apunta al servidor réplica (HOST). En las pruebas usa la base de datos de 'default'.
+DATABASES['replica'] = {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}}
+DATABASES_REPLICAS = ['replica']
+DATABASE_ROUTERS = ['core.replicas.RouterReplicas']
+REPLICAS_FIJAR_PRIMARIA_SEGUNDOS = 10  # Tiempo que un usuario lee de 'default' después de escribir
+
+
+# Caché
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+# En producción tiene que ser compartida por todos los procesos: las
+# estadísticas, los pendientes, los roles y los fragmentos se invalidan en el
+# proceso que hace el cambio, y los demás tienen que ver la invalidación (con
+# la caché en memoria de cada proceso servirían datos viejos). Se configura con
+# la variable de entorno REDIS_URL (por ejemplo, redis://127.0.0.1:6379/1;
+# requiere el paquete redis). Sin ella, para desarrollo y pruebas, se usa la
+# caché en memoria, y check --deploy da un error (core.E001).
+REDIS_URL = os.environ.get('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -132,6 +176,32 @@ LOGIN_URL = 'core:login'  # Cambiar de '/admin/login/' a 'core:login'
 LOGIN_REDIRECT_URL = 'core:dashboard'  # Ya estaba así
 LOGOUT_REDIRECT_URL = 'core:login'  # Cambiar de '/admin/' a 'core:login'
 
+# Importación de CSV
+IMPORTACION_CSV_TAMANO_LOTE = 1000  # Tarjetas insertadas por cada bulk_create
+IMPORTACION_CSV_UMBRAL_BYTES = 1024 * 1024  # Archivos más grandes (1 MB) se procesan en segundo plano
+
+# Historial de respuestas (tabla particionada por mes, ver core/historial.py)
+HISTORIAL_DIAS_RETENCION = 365  # Respuestas más antiguas se compactan por día
+HISTORIAL_MESES_ADELANTE = 3  # Meses futuros con partición creada
+HISTORIAL_ESCRITURA_EN_SEGUNDO_PLANO = True  # False: la cola solo se guarda con escritor.vaciar() (pruebas)
+HISTORIAL_ESCRITURA_TAMANO_LOTE = 500  # Respuestas por bulk_create del escritor en segundo plano
+HISTORIAL_ESCRITURA_INTERVALO = 2  # Segundos máximos que una respuesta espera en la cola
+
+# Variantes reducidas de imágenes y audios subidos (ver core/medios.py)
+MEDIOS_ANCHOS_IMAGEN = (320, 640, 1280)  # Anchos (px) de las variantes de imagen
+MEDIOS_DERIVADOS_EN_SEGUNDO_PLANO = True  # False: la cola solo se procesa con generador.vaciar() (pruebas)
+MEDIOS_FFMPEG = None  # Ruta de ffmpeg para normalizar audios (None: se busca en el PATH)
+
+# Sesiones de estudio agrupadas desde el historial (ver core/sesiones.py)
+SESIONES_INACTIVIDAD_MINUTOS = 30  # Una pausa más larga que esto empieza otra sesión
+SESIONES_AL_CALIFICAR = True  # False: solo las agrupa el comando sesionizar
+
+# Medición de consultas y tiempos por vista (ver core/instrumentacion.py y /mediciones/)
+INSTRUMENTACION_MUESTREO = 0.1  # Fracción de peticiones medidas
+INSTRUMENTACION_TAMANO_BUFFER = 1000  # Mediciones que se conservan en memoria por proceso
+INSTRUMENTACION_UMBRAL_CONSULTAS = 50  # Más consultas que esto se registran en el log (None: sin umbral)
+INSTRUMENTACION_UMBRAL_MS = 1000  # Más milisegundos que esto se registran en el log (None: sin umbral)
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 